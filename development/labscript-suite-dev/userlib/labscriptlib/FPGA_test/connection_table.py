@@ -13,7 +13,7 @@ from user_devices.FPGA_device.labscript_device import (
 from user_devices.FPGA_device.shared import use_prelim_version
 if use_prelim_version:
     from user_devices.FPGA_device.DAC import DAC712, DAC715, DAC7744
-    from user_devices.FPGA_device.generic_conversion import generic_conversion
+    from user_devices.FPGA_device.generic_conversion import generic_conversion, table_conversion
 
 ########################################################################################################################
 # FPGA boards
@@ -204,6 +204,13 @@ if use_prelim_version:
                    unit_conversion_parameters={'unit':'MHz', 'equation':'(x-142.31036)/31.31786', 'min':0.0, 'max':455.48896})
     DAC7744(name='ao5', parent_device=AO1, connection='0x07', unit_conversion_class=generic_conversion,
                    unit_conversion_parameters={'unit':'MHz', 'equation':'(x-142.31036)/31.31786', 'min':0.0, 'max':455.48896})
+    # example with table_conversion class.
+    # 'table' gives measured [value in 'unit', voltage] pairs. conversion interpolates linearly between them.
+    #DAC712 (name='ao9', parent_device=AO1, connection='0x0b', unit_conversion_class=table_conversion,
+    #               unit_conversion_parameters={'unit':'A', 'table':[[0.0, 0.0], [10.0, 0.98], [50.0, 5.03], [100.0, 9.99]]})
+    # example with nonlinearity correction of the DAC.
+    # 'correction' gives measured [set voltage, measured voltage] knots or file name with measured voltage for each code.
+    #DAC712 (name='ao10', parent_device=AO1, connection='0x0c', correction=[[-10.0, -10.002], [0.0, 0.001], [10.0, 9.998]])
 
     if secondary is not None:
         AnalogChannels(name='AO2', parent_device=secondary, rack=0, max_channels=4)
@@ -11,7 +11,8 @@ from labscript import LabscriptError
 from user_devices.FPGA_device.DDS_generic import DDS_generic
 from user_devices.FPGA_device.shared import (
     DATA_MASK, DATA_SHIFT,ADDR_BITS, ADDR_SHIFT, ADDR_MASK,
-    BACK_CONVERT,
+    BACK_CONVERT, back_convert, DDS_SHADOW_REGISTERS, CRC_CHECK,
+    DDS_CHANNEL_FREQ,
     BIT_NOP_SH,
 )
 
@@ -109,6 +110,30 @@ class AD9854(DDS_generic):
     REGS_AMP_INIT   = None
     REGS_PHASE_INIT = None
 
+    # virtual register for words written directly without update (both control bits set).
+    # None = not used.
+    REG_DIRECT      = None
+
+    # frequency sweep in chirp mode
+    # operating mode is given by bits [3:1] of REG_MODE: 000 = single tone, 011 = chirp
+    # the other bits of REG_MODE are kept as set by init_hardware (see reg_value).
+    REG_MODE            = 0x1F
+    MODE_MASK           = 0x0E
+    MODE_SINGLE_TONE    = 0x00
+    MODE_CHIRP          = 0x06
+    CLR_ACC1            = 0x80
+    RAMP_RATE_BITS      = 20
+
+    # registers for frequency sweep. LSB first. None = sweep not supported.
+    # delta frequency word (two's complement), ramp rate clock, mode control register
+    REGS_SWEEP          = [[0x15, 0x14, 0x13, 0x12, 0x11, 0x10], [0x1C, 0x1B, 0x1A], [REG_MODE]]
+    REGS_SWEEP_INIT     = [None, None, [MODE_SINGLE_TONE]]
+
+    # approximate number of frequency steps of sweep
+    # and number of points inserted by words_to_freq for each sweep
+    SWEEP_STEPS         = 1 << 16
+    SWEEP_POINTS        = 100
+
     @classmethod
     def init_hardware(cls, properties):
         """
@@ -142,61 +167,310 @@ class AD9854(DDS_generic):
         return None
 
     @classmethod
-    def get_tuning_words(cls, properties, times, words, regs, regs_init):
+    def replay_groups(cls, properties, times, words, groups):
         """
-        filters words for device address range and
-        returns times and frequency/amplitude/phase tuning words for given registers.
+        replays the register file of the DDS in a single pass over all words.
         properties = sub-channel properties
         times      = np.array of times (seconds or ticks).
         words      = np.array of cls.raw_dtype
-        returns [times, values] as np.array of times.dtype and np.float64 of converted words.
+        groups     = list of (registers, initial values) with registers LSB first.
+                     initial values None = all 0.
+        returns [times, value group 0, value group 1, ...]
+                as np.array of times.dtype and np.uint64 register values for each group.
         notes:
         - the function filters input words for device address (range)
-        - the function returns fewer times and values than filtered words
-        - the function tracks the registers and generates tuning words for each WRITE_AND_UPDATE
+        - the function returns one entry for each WRITE_AND_UPDATE
+          and for each REG_DIRECT word if REG_DIRECT is in one of the groups.
+          direct words do not update the other registers and are ignored when REG_DIRECT is not tracked.
+        - only the registers of the given groups are tracked. one call gives all groups at each update.
+        - for each tracked register we take the index of the last write before each word
+          using np.maximum.accumulate and take the register byte from this word.
+          this is done register by register to keep memory linear in number of words.
         """
         address   = cls.raw_dtype(properties['address'] & ADDR_MASK)
         addr_mask = (((words >> ADDR_SHIFT) & cls.ADDR_RNG_MASK) == address)
-        #print('address 0x%x'%address)
-        #print(regs)
-        #print(['0x%x' % d for d in words])
-        #print(addr_mask)
         w = words[addr_mask]
-        if len(w) > 0:
-            write  = (w & (cls.WRITE | cls.WRITE_AND_UPDATE) == cls.WRITE)
-            update = (w & (cls.WRITE | cls.WRITE_AND_UPDATE) == cls.WRITE_AND_UPDATE)
-            write_or_update = write | update
-            values = np.zeros(shape=(len(w),), dtype=np.uint64)
-            words_reg = (w >> cls.REG_SHIFT) & cls.REG_MASK
-            for i,addr in enumerate(regs):
-                # init register
-                if regs_init is None:
-                    reg = np.zeros(shape=(len(w),), dtype=np.int16)
-                else:
-                    reg = np.ones(shape=(len(w),), dtype=np.int16)*regs_init[i]
-                # find where register is written (WRITE or WRITE_OR_UPDATE bits but not both)
-                mask = (words_reg == addr) & write_or_update
-                # take register values where is written
-                # and fill values in between with previous values using difference and cumsum.
-                changes = (w[mask] >> cls.VALUE_SHIFT) & cls.VALUE_MASK
-                changes[1:] = changes[1:] - changes[:-1]
-                reg[mask] = changes
-                reg = np.cumsum(reg)
-                #print(['0x%x'%d for d in w])
-                #print(i, 'reg', addr, 'all:', np.transpose([times[addr_mask], reg]))
-                # add register to values at proper offset
-                values |= reg.astype(np.uint64) << np.uint64(i*cls.VALUE_BITS)
-            # return times and tuning word where update bit is set
-            return [times[addr_mask][update], values[update]]
+        if len(w) == 0:
+            return [np.array([], dtype=times.dtype)] + [np.array([], dtype=np.uint64) for group in groups]
+        ctrl      = w & (cls.WRITE | cls.WRITE_AND_UPDATE)
+        update    = (ctrl == cls.WRITE_AND_UPDATE)
+        write     = (ctrl == cls.WRITE) | update
+        words_reg = (w >> cls.REG_SHIFT) & cls.REG_MASK
+        words_val = ((w >> cls.VALUE_SHIFT) & cls.VALUE_MASK).astype(np.uint64)
+        if (cls.REG_DIRECT is not None) and any(cls.REG_DIRECT in regs for regs, init in groups):
+            # words with both control bits set are written directly without update.
+            # we track them as a virtual register REG_DIRECT which is updated immediately.
+            direct    = (ctrl == (cls.WRITE | cls.WRITE_AND_UPDATE))
+            words_reg = np.where(direct, cls.REG_DIRECT, words_reg)
+            write    |= direct
+            update   |= direct
+        result   = [times[addr_mask][update]]
+        position = np.arange(len(w))
+        for regs_group, init_group in groups:
+            # register values at each update shifted to their position within the group value
+            value = np.zeros(shape=(len(result[0]),), dtype=np.uint64)
+            for i, reg in enumerate(regs_group):
+                # index of last write of register before each update. -1 = not yet written.
+                index = np.maximum.accumulate(np.where((words_reg == reg) & write, position, -1))[update]
+                init  = np.uint64(0 if init_group is None else init_group[i])
+                value |= np.where(index >= 0, words_val[index], init) << np.uint64(i*cls.VALUE_BITS)
+            result.append(value)
+        return result
+
+    @classmethod
+    def replay_registers(cls, properties, times, words):
+        """
+        replays the register file of the DDS in a single pass over all words.
+        properties = sub-channel properties
+        times      = np.array of times (seconds or ticks).
+        words      = np.array of cls.raw_dtype
+        returns [times, ftw, atw, ptw] as np.array of times.dtype and 3x np.uint64 tuning words.
+        when cls.REGS_SWEEP is not None the values of the sweep registers are appended.
+        see replay_groups for details.
+        use this when all sub-channels are needed. for a single sub-channel replay only its groups.
+        """
+        groups = [(cls.REGS_FREQ, cls.REGS_FREQ_INIT), (cls.REGS_AMP, cls.REGS_AMP_INIT), (cls.REGS_PHASE, cls.REGS_PHASE_INIT)]
+        if cls.REGS_SWEEP is not None:
+            groups += list(zip(cls.REGS_SWEEP, cls.REGS_SWEEP_INIT))
+        return cls.replay_groups(properties, times, words, groups)
+
+    @classmethod
+    def words_to_values(cls, properties, times, words):
+        """
+        converts np.array of words into frequency in MHz, amplitude in dBm and phase in degree.
+        properties = sub-channel properties
+        times      = numpy array of time (ticks or seconds)
+        words      = np.array of cls.raw_dtype
+        returns [times, freq, amp, phase] as np.array of times.dtype and 3x np.float64.
+        notes:
+        - register file is replayed only once for all three sub-channels (see replay_registers)
+        - use this when all sub-channels are needed, like in runviewer and in the worker CRC check.
+        - back conversion in freq/amp/phase_to_words uses words_to_freq/amp/phase instead,
+          since there the words contain only the registers of a single sub-channel.
+        """
+        times, ftw, atw, ptw, *sweep = cls.replay_registers(properties, times, words)
+        freq = cls.ftw_to_freq(ftw)
+        if len(sweep) > 0:
+            times, freq, index = cls.insert_sweeps(times, freq, *cls.sweep_params(ftw, sweep))
+            atw, ptw = atw[index], ptw[index]
+        return [times, freq, cls.atw_to_amp(atw), cls.ptw_to_phase(ptw)]
+
+    @classmethod
+    def ftw_to_freq(cls, ftw):
+        "converts frequency tuning words into frequency in MHz"
+        df = cls.SYSCLK/(1<<cls.FREQ_BITS)
+        return (ftw & np.uint64(cls.FREQ_MASK)).astype(np.float64)*df/1e6
+
+    @classmethod
+    def atw_to_amp(cls, atw):
+        "converts amplitude tuning words into amplitude in dBm using amplitude calibration"
+        values = ((atw & np.uint64(cls.AMP_MASK)).astype(np.float64)*(cls.U1-cls.U0) + cls.U0*cls.A1 - cls.U1*cls.A0)/(cls.A1-cls.A0)
+        return np.where(values <= 0, cls.DBM_MIN, 20.0*np.log10(np.where(values <= 0, 1.0, values)))
+
+    @classmethod
+    def ptw_to_phase(cls, ptw):
+        "converts phase tuning words into phase in degree"
+        return (ptw & np.uint64(cls.PHASE_MASK)).astype(np.float64)*360.0/((1<<cls.PHASE_BITS)-1)
+
+    @classmethod
+    def skip_unchanged(cls, words, shadow, update=True):
+        """
+        removes register writes where the register value is unchanged (differential register writes).
+        words  = np.array of cls.raw_dtype with shape (values, registers), i.e. all registers for each value.
+        shadow = dictionary with last written value for each register. is updated on return.
+                 registers not in shadow are unknown and are always written.
+        update = if True the last written word for each value gets WRITE_AND_UPDATE, otherwise WRITE.
+        returns np.array of cls.raw_dtype with remaining words.
+        notes:
+        - for each value at least the last register is written. this way every user value
+          generates at least one word and the update is not lost.
+        - the update flag is moved to the last written register of each value.
+        """
+        regs     = (words >> cls.REG_SHIFT) & cls.REG_MASK
+        values   = ((words >> cls.VALUE_SHIFT) & cls.VALUE_MASK).astype(np.int64)
+        previous = np.empty_like(values)
+        previous[0]  = [shadow[reg] if reg in shadow else -1 for reg in regs[0]]
+        previous[1:] = values[:-1]
+        changed = (values != previous)
+        changed[:,-1] |= ~np.any(changed, axis=1)
+        # index of last written register for each value
+        last = (words.shape[1] - 1) - np.argmax(changed[:,::-1], axis=1)
+        ctrl = np.full(shape=words.shape, fill_value=cls.WRITE, dtype=cls.raw_dtype)
+        ctrl[np.arange(len(words)), last] = cls.WRITE_AND_UPDATE if update else cls.WRITE
+        words = (words & ~cls.raw_dtype(cls.WRITE | cls.WRITE_AND_UPDATE)) | ctrl
+        # after last value all registers have the last value
+        shadow.update(zip(regs[-1].tolist(), values[-1].tolist()))
+        return words[changed]
+
+    @classmethod
+    def reg_to_words(cls, address, regs, value, update=False):
+        """
+        returns np.array of cls.raw_dtype with words to write integer value into registers (LSB first).
+        address = DDS address already shifted by ADDR_SHIFT
+        update  = if True last word has WRITE_AND_UPDATE bit set, otherwise only WRITE.
+        """
+        return np.array([
+                address                                                                    |
+                (cls.WRITE_AND_UPDATE if (update and (i == len(regs)-1)) else cls.WRITE) |
+                (((value >> (i*cls.VALUE_BITS)) & cls.VALUE_MASK) << cls.VALUE_SHIFT)     |
+                (reg << cls.REG_SHIFT)
+                for i,reg in enumerate(regs)], dtype=cls.raw_dtype)
+
+    @classmethod
+    def reg_value(cls, reg, shadow=None):
+        """
+        returns value of register reg from shadow or after init_hardware.
+        reg    = register number
+        shadow = None or dictionary with register values of the DDS (see skip_unchanged).
+                 when the register is in shadow this value is returned.
+        otherwise returns last value written to the register by RESET_DATA or 0 if not written.
+        use this to change only some bits of a control register.
+        """
+        if (shadow is not None) and (reg in shadow):
+            return shadow[reg]
+        value = 0
+        for word in cls.RESET_DATA:
+            ctrl = word & (cls.WRITE | cls.WRITE_AND_UPDATE)
+            if (ctrl in (cls.WRITE, cls.WRITE_AND_UPDATE)) and (((word >> cls.REG_SHIFT) & cls.REG_MASK) == reg):
+                value = (word >> cls.VALUE_SHIFT) & cls.VALUE_MASK
+        return value
+
+    @classmethod
+    def sweep_to_words(cls, properties, f_start, f_stop, duration, shadow=None):
+        """
+        returns [start, stop] words for linear frequency sweep from f_start to f_stop in Hz within duration in seconds.
+        properties = frequency sub-channel properties
+        shadow     = None or dictionary with register values of the DDS (see skip_unchanged).
+                     when given only changed registers are written and shadow is updated.
+        start      = np.array of cls.raw_dtype to be written at start time of sweep
+        stop       = np.array of cls.raw_dtype to be written at start time + duration.
+                     this stops the sweep and sets frequency to f_stop.
+        AD9854 chirp mode: output starts at FTW1 and every ramp rate clock period (RRC+1)/SYSCLK
+        the delta frequency word is added. the ramp rate clock is selected to give about SWEEP_STEPS steps.
+        only the mode bits and CLR_ACC1 of REG_MODE are changed, the other bits are kept (see reg_value).
+        in a derived class define this function, sweep_params and REGS_SWEEP for your hardware.
+        """
+        address = cls.raw_dtype((properties['address'] & ADDR_MASK) << ADDR_SHIFT)
+        df    = cls.SYSCLK/(1<<cls.FREQ_BITS)
+        rrc   = int(np.clip(np.ceil(duration*cls.SYSCLK/cls.SWEEP_STEPS) - 1, 0, (1<<cls.RAMP_RATE_BITS)-1))
+        steps = duration*cls.SYSCLK/(rrc+1)
+        dfw   = int(np.round((f_stop - f_start)/df/steps))
+        if dfw == 0:
+            raise LabscriptError("%s: frequency sweep %e -> %e Hz within %e s is too slow (delta frequency word is 0)!" % (cls.__name__, f_start, f_stop, duration))
+        dfw  &= cls.FREQ_MASK # two's complement
+        mode  = cls.reg_value(cls.REG_MODE, shadow)
+        start = np.concatenate([
+            cls.freq_to_words(properties, np.array([f_start]), update=False),
+            cls.reg_to_words(address, cls.REGS_SWEEP[0], dfw),
+            cls.reg_to_words(address, cls.REGS_SWEEP[1], rrc),
+            cls.reg_to_words(address, cls.REGS_SWEEP[2], (mode & ~cls.MODE_MASK) | cls.MODE_CHIRP | cls.CLR_ACC1, update=True)])
+        stop  = np.concatenate([
+            cls.freq_to_words(properties, np.array([f_stop]), update=False),
+            cls.reg_to_words(address, cls.REGS_SWEEP[2], (mode & ~(cls.MODE_MASK | cls.CLR_ACC1)) | cls.MODE_SINGLE_TONE, update=True)])
+        if shadow is not None: # write only changed registers. mode register is always changed.
+            start = cls.skip_unchanged(start.reshape((1,-1)), shadow)
+            stop  = cls.skip_unchanged(stop.reshape((1,-1)), shadow)
+        return [start, stop]
+
+    @classmethod
+    def sweep_params(cls, ftw, sweep):
+        """
+        returns [enabled, f0, slope, f_end] of frequency sweep for each update.
+        ftw     = np.array of frequency tuning words at each update
+        sweep   = list of np.array of register values for each group in REGS_SWEEP at each update.
+        enabled = np.array of bool, True when sweep is running after update.
+        f0      = np.array of start frequency in MHz
+        slope   = np.array of sweep rate in MHz/s
+        f_end   = np.array of final frequency in MHz where sweep stops. np.nan = sweep does not stop.
+        """
+        dfw, rrc, mode = sweep
+        enabled = (((mode >> np.uint64(1)) & np.uint64(7)) == np.uint64(cls.MODE_CHIRP >> 1))
+        dfw     = dfw & np.uint64(cls.FREQ_MASK)
+        dfw     = np.where((dfw >> np.uint64(cls.FREQ_BITS-1)) != 0, dfw.astype(np.float64) - float(1 << cls.FREQ_BITS), dfw.astype(np.float64))
+        rrc     = (rrc & np.uint64((1<<cls.RAMP_RATE_BITS)-1)).astype(np.float64)
+        df      = cls.SYSCLK/(1<<cls.FREQ_BITS)
+        slope   = (dfw*df/1e6)*cls.SYSCLK/(rrc+1)
+        return [enabled, cls.ftw_to_freq(ftw), slope, np.full(shape=(len(ftw),), fill_value=np.nan)]
+
+    @classmethod
+    def insert_sweeps(cls, times, freq, enabled, f0, slope, f_end):
+        """
+        inserts SWEEP_POINTS frequencies between each update with running sweep and the next update.
+        times = np.array of update times in seconds
+        freq  = np.array of frequencies in MHz at each update
+        enabled, f0, slope, f_end = returned from sweep_params
+        returns [times, freq, index] with inserted times and frequencies
+        and index of update for each returned time. use index to get other values at the same times.
+        the last update is not expanded since the end time is not known.
+        """
+        sweeps = np.argwhere(enabled[:-1]).ravel()
+        if len(sweeps) == 0:
+            return [times, freq, np.arange(len(times))]
+        t_list, f_list, i_list = [], [], []
+        last = 0
+        for i in sweeps:
+            t_list.append(times[last:i])
+            f_list.append(freq[last:i])
+            i_list.append(np.arange(last,i))
+            t = np.linspace(times[i], times[i+1], cls.SWEEP_POINTS, endpoint=False)
+            f = f0[i] + slope[i]*(t - times[i])
+            if not np.isnan(f_end[i]):
+                f = np.minimum(f, f_end[i]) if slope[i] >= 0 else np.maximum(f, f_end[i])
+            t_list.append(t)
+            f_list.append(f)
+            i_list.append(np.full(shape=(len(t),), fill_value=i))
+            last = i+1
+        t_list.append(times[last:])
+        f_list.append(freq[last:])
+        i_list.append(np.arange(last, len(times)))
+        return [np.concatenate(t_list), np.concatenate(f_list), np.concatenate(i_list)]
+
+    def sweep(self, t, f_start, f_stop, duration):
+        """
+        linear frequency sweep from f_start to f_stop in Hz starting at time t with given duration in seconds.
+        uses the ramp generator of the DDS. only few words are written at start and at end of the sweep.
+        at the end of the sweep frequency is set to f_stop.
+        returns duration in seconds.
+        """
+        if self.REGS_SWEEP is None:
+            raise LabscriptError("%s: frequency sweep is not supported by %s!" % (self.name, self.description))
+        for f in [f_start, f_stop]:
+            if f < self.freq_limits[0] or f > self.freq_limits[1]:
+                raise LabscriptError("%s t=%e: frequency %e is out of range %e - %e!" % (self.name, t, f, self.freq_limits[0], self.freq_limits[1]))
+        if duration <= 0:
+            raise LabscriptError("%s t=%e: sweep duration %e must be positive!" % (self.name, t, duration))
+        if DDS_SHADOW_REGISTERS:
+            if self.frequency.final_time is not None and t < self.frequency.final_time:
+                raise LabscriptError("%s t=%e: frequency sweep before last instruction at t=%e! insert instructions with increasing time or set DDS_SHADOW_REGISTERS = False." % (self.name, t, self.frequency.final_time))
+            shadow = self.shadow
         else:
-            return [np.array([], dtype=times.dtype), np.array([], dtype=np.uint64)]
+            shadow = None
+        start, stop = self.sweep_to_words(self.frequency.properties, f_start, f_stop, duration, shadow=shadow)
+        dt = 1.0/self.frequency.clock_limit
+        if len(start)*dt > duration:
+            raise LabscriptError("%s t=%e: sweep duration %e must be at least %e!" % (self.name, t, duration, len(start)*dt))
+        if CRC_CHECK:
+            self.crc(start)
+            self.crc(stop)
+        for i, data in enumerate(start):
+            self.frequency.add_instruction(t + i*dt, data)
+        for i, data in enumerate(stop):
+            self.frequency.add_instruction(t + duration + i*dt, data)
+        # save final time and frequency in MHz
+        if self.frequency.final_time is None or (t + duration) > self.frequency.final_time:
+            self.frequency.final_time = t + duration
+            self.final_values[DDS_CHANNEL_FREQ] = f_stop/1e6
+        return duration + (len(stop)-1)*dt
 
     @classmethod
-    def freq_to_words(cls, properties, frequencies, update=True):
+    def freq_to_words(cls, properties, frequencies, update=True, shadow=None):
         """
         converts frequency in Hz to raw data words for the specific device.
         properties = sub-channel properties
         frequency  = np.array of frequencies in Hz
+        update     = if True last word has WRITE_AND_UPDATE bit set, otherwise only WRITE.
+        shadow     = None or dictionary with register values of the DDS (see skip_unchanged).
+                     when given only changed registers are written and shadow is updated.
         returns np.array of type self.raw_dtype of one or several words.
         in a derived class define this function and to_words for your hardware.
         """
@@ -215,19 +489,16 @@ class AD9854(DDS_generic):
                 (fb[i]<<cls.VALUE_SHIFT)                                |
                 (reg<<cls.REG_SHIFT)
                 for i,reg in enumerate(cls.REGS_FREQ)], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
+        if BACK_CONVERT: # check back conversion
             if update: tmp = raw_data
-            else: # we have to set update flag in last raw_data otherwise will not work!
+            else: # we have to set update flag in last word of each value otherwise will not work!
                 tmp = raw_data.copy()
                 update_mask = (cls.ADDR_RNG_MASK << ADDR_SHIFT) | (DATA_MASK << DATA_SHIFT)
-                tmp[-1] = (tmp[-1] & update_mask) | cls.WRITE_AND_UPDATE
-            val = cls.words_to_freq(properties, np.arange(len(tmp)), tmp)
-            errors    = np.abs(val[1] - f[mask]/1e6)
-            max_error = 0.5*cls.SYSCLK/((1<<cls.FREQ_BITS)-1)
-            imax      = np.argmax(errors)
-            print('f = %.6f MHz: FTW = 0x%x -> %.6f MHz (%s, %.1e <= %.1e)' % (frequencies[mask][imax] / 1e6, ftw[mask][imax], val[1][imax], 'ok' if errors[imax] <= max_error else 'error', errors[imax], max_error))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s freq_to_words: %i frequency conversions out of tolerance! max. error for %.6f MHz != %.6f MHz" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], f[mask][imax]/1e6))
+                n = len(cls.REGS_FREQ)
+                tmp[n-1::n] = (tmp[n-1::n] & update_mask) | cls.WRITE_AND_UPDATE
+            back_convert(cls, properties, f/1e6, mask, tmp, cls.words_to_freq, 1e-6*cls.SYSCLK/(1<<cls.FREQ_BITS))
+        if shadow is not None: # write only changed registers
+            raw_data = cls.skip_unchanged(raw_data.reshape((-1, len(cls.REGS_FREQ))), shadow, update)
         return raw_data
 
     @classmethod
@@ -241,21 +512,31 @@ class AD9854(DDS_generic):
         notes:
         - the function filters input words for device address (range)
         - the function returns fewer times and values than words
-        - the function tracks the frequency registers and generates values for each WRITE_AND_UPDATE
+        - the function tracks only the frequency (and sweep) registers and generates values for each WRITE_AND_UPDATE
+        - during a frequency sweep SWEEP_POINTS values are inserted between start and end of sweep.
+          for this times must be in seconds.
         TODO:
         - FSK/OSK bits are ignored here
         """
-        times, values = cls.get_tuning_words(properties, times, words, cls.REGS_FREQ, cls.REGS_FREQ_INIT)
-        #print('FTW:', values)
-        df = cls.SYSCLK/(1<<cls.FREQ_BITS)
-        return [times, (values & cls.FREQ_MASK).astype(np.float64)*df/1e6]
+        groups = [(cls.REGS_FREQ, cls.REGS_FREQ_INIT)]
+        if cls.REGS_SWEEP is not None:
+            groups += list(zip(cls.REGS_SWEEP, cls.REGS_SWEEP_INIT))
+        times, ftw, *sweep = cls.replay_groups(properties, times, words, groups)
+        #print('FTW:', ftw)
+        freq = cls.ftw_to_freq(ftw)
+        if len(sweep) > 0:
+            times, freq, index = cls.insert_sweeps(times, freq, *cls.sweep_params(ftw, sweep))
+        return [times, freq]
 
     @classmethod
-    def amp_to_words(cls, properties, amplitudes, update=True):
+    def amp_to_words(cls, properties, amplitudes, update=True, shadow=None):
         """
         converts amplitude in dBm to raw data words for the specific device.
         properties = sub-channel properties
         amplitudes = np.array of amplitudes in dBm
+        update     = if True last word has WRITE_AND_UPDATE bit set, otherwise only WRITE.
+        shadow     = None or dictionary with register values of the DDS (see skip_unchanged).
+                     when given only changed registers are written and shadow is updated.
         returns np.array of type self.raw_dtype of one or several words.
         in a derived class define this function and to_words for your hardware.
         here we use amplitude calibration to calculate amplitude tuning word.
@@ -275,19 +556,16 @@ class AD9854(DDS_generic):
                 (ab[i] << cls.VALUE_SHIFT)                                 |
                 (reg   << cls.REG_SHIFT)
                 for i,reg in enumerate(cls.REGS_AMP)], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
+        if BACK_CONVERT: # check back conversion
             if update: tmp = raw_data
-            else: # we have to set update flag in last raw_data otherwise will not work!
+            else: # we have to set update flag in last word of each value otherwise will not work!
                 tmp = raw_data.copy()
                 update_mask = (cls.ADDR_RNG_MASK << ADDR_SHIFT) | (DATA_MASK << DATA_SHIFT)
-                tmp[-1] = (tmp[-1] & update_mask) | cls.WRITE_AND_UPDATE
-            val = cls.words_to_amp(properties, np.array(range(len(tmp))), tmp)
-            errors    = np.abs(val[1] - a[mask])
-            max_error = (cls.DBM_MAX - cls.DBM_MIN) / ((1 << cls.AMP_BITS) - 1)
-            imax      = np.argmax(errors)
-            print('a = %.6f MHz: ATW = 0x%x -> %.6f MHz (%s, %.1e <= %.1e)' % (amplitudes[mask][imax], atw[mask][imax], val[1][imax], 'ok' if errors[imax] <= max_error else 'error', errors[imax], max_error))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s amp_to_words: %i amplitude conversions out of tolerance! max. error for %.6f dBm != %.6f dBm" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], a[mask][imax]))
+                n = len(cls.REGS_AMP)
+                tmp[n-1::n] = (tmp[n-1::n] & update_mask) | cls.WRITE_AND_UPDATE
+            back_convert(cls, properties, a, mask, tmp, cls.words_to_amp, (cls.DBM_MAX - cls.DBM_MIN) / ((1 << cls.AMP_BITS) - 1))
+        if shadow is not None: # write only changed registers
+            raw_data = cls.skip_unchanged(raw_data.reshape((-1, len(cls.REGS_AMP))), shadow, update)
         return raw_data
 
     @classmethod
@@ -302,17 +580,19 @@ class AD9854(DDS_generic):
         - the function returns fewer times and values than words
         - the function tracks the amplitude registers and generates word for each WRITE_AND_UPDATE
         """
-        times, values = cls.get_tuning_words(properties, times, words, cls.REGS_AMP, cls.REGS_AMP_INIT)
-        #print('ATW:', values)
-        values = ((values & cls.AMP_MASK).astype(np.float64)*(cls.U1-cls.U0) + cls.U0*cls.A1 - cls.U1*cls.A0)/(cls.A1-cls.A0)
-        return [times, np.where(values <= 0, cls.DBM_MIN, 20.0*np.log10(values))]
+        times, atw = cls.replay_groups(properties, times, words, [(cls.REGS_AMP, cls.REGS_AMP_INIT)])
+        #print('ATW:', atw)
+        return [times, cls.atw_to_amp(atw)]
 
     @classmethod
-    def phase_to_words(cls, properties, phases, update=True):
+    def phase_to_words(cls, properties, phases, update=True, shadow=None):
         """
         converts phase in degree to raw data words for the specific device.
         properties = sub-channel properties
         phases     = np.array of phases in degree
+        update     = if True last word has WRITE_AND_UPDATE bit set, otherwise only WRITE.
+        shadow     = None or dictionary with register values of the DDS (see skip_unchanged).
+                     when given only changed registers are written and shadow is updated.
         returns np.array of type self.raw_dtype of one or several words.
         in a derived class define this function and to_words for your hardware.
         """
@@ -330,19 +610,16 @@ class AD9854(DDS_generic):
                 (pb[i] << cls.VALUE_SHIFT)                                   |
                 (reg   << cls.REG_SHIFT)
                 for i,reg in enumerate(cls.REGS_PHASE)], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
+        if BACK_CONVERT: # check back conversion
             if update: tmp = raw_data
-            else: # we have to set update flag in last raw_data otherwise will not work!
+            else: # we have to set update flag in last word of each value otherwise will not work!
                 tmp = raw_data.copy()
                 update_mask = (cls.ADDR_RNG_MASK << ADDR_SHIFT) | (DATA_MASK << DATA_SHIFT)
-                tmp[-1] = (tmp[-1] & update_mask) | cls.WRITE_AND_UPDATE
-            val = cls.words_to_phase(properties, np.array(range(len(tmp))), tmp)
-            errors    = np.abs(val[1] - p[mask])
-            max_error = 360.0/((1<<cls.PHASE_BITS)-1)
-            imax      = np.argmax(errors)
-            print('p = %.6f MHz: PTW = 0x%x -> %.6f MHz (%s, %.1e <= %.1e)' % (phases[mask][imax], ptw[mask][imax], val[1][imax], 'ok' if errors[imax] <= max_error else 'error', errors[imax], max_error))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s phase_to_words: %i phase conversions out of tolerance! max. error for %.6f deg != %.6f deg" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], p[mask][imax]))
+                n = len(cls.REGS_PHASE)
+                tmp[n-1::n] = (tmp[n-1::n] & update_mask) | cls.WRITE_AND_UPDATE
+            back_convert(cls, properties, p, mask, tmp, cls.words_to_phase, 360.0/((1<<cls.PHASE_BITS)-1))
+        if shadow is not None: # write only changed registers
+            raw_data = cls.skip_unchanged(raw_data.reshape((-1, len(cls.REGS_PHASE))), shadow, update)
         return raw_data
 
     @classmethod
@@ -357,9 +634,9 @@ class AD9854(DDS_generic):
         - the function returns fewer times and values than words
         - the function tracks the phase registers and generates word for each WRITE_AND_UPDATE
         """
-        times, values = cls.get_tuning_words(properties, times, words, cls.REGS_PHASE, cls.REGS_PHASE_INIT)
-        #print('PTW:', values)
-        return [times, (values & cls.PHASE_MASK).astype(np.float64)*360.0/((1<<cls.PHASE_BITS)-1)]
+        times, ptw = cls.replay_groups(properties, times, words, [(cls.REGS_PHASE, cls.REGS_PHASE_INIT)])
+        #print('PTW:', ptw)
+        return [times, cls.ptw_to_phase(ptw)]
 
 
 class AD9858(AD9854):
@@ -434,17 +711,27 @@ class AD9858(AD9854):
         WRITE_AND_UPDATE | (0x58 << VALUE_SHIFT) | (0x00 << REG_SHIFT), # 2 GHz divider disable; Mixer power down; Phase detect power down
         ]
 
-    # registers for frequency, and phase. LSB first
+    # amplitude is written directly to attenuator with AMPLITUDE control bits.
+    # we track it as virtual register outside of the register range.
+    REG_DIRECT      = 1 << REG_BITS
+
+    # registers for frequency, amplitude and phase. LSB first
     REGS_FREQ       = [0x0a, 0x0b, 0x0c, 0x0d]
+    REGS_AMP        = [REG_DIRECT]
     REGS_PHASE      = [0x0e, 0x0f]
 
     # initial value for each register. None = all 0.
     # TODO: update for your hardware
     REGS_FREQ_INIT  = None
+    REGS_AMP_INIT   = None
     REGS_PHASE_INIT = None
 
+    # frequency sweep not implemented
+    REGS_SWEEP      = None
+    REGS_SWEEP_INIT = None
+
     @classmethod
-    def amp_to_words(cls, properties, amplitudes):
+    def amp_to_words(cls, properties, amplitudes, **args):
         """
         converts amplitude in dBm to raw data words for the specific device.
         properties = sub-channel properties
@@ -453,6 +740,7 @@ class AD9858(AD9854):
         in a derived class define this function and to_words for your hardware.
         here we use amplitude calibration to calculate amplitude tuning word.
         note: this has no update flag since is directly written to attenuator.
+              this is a single word, therefore shadow is ignored.
         TODO: assumed amplitude value is shifted by VALUE_SHIFT?
         """
         address = cls.raw_dtype((properties['address'] & ADDR_MASK) << ADDR_SHIFT)
@@ -465,33 +753,10 @@ class AD9858(AD9854):
         raw_data = np.array([
             address | cls.AMPLITUDE | (atw << cls.VALUE_SHIFT)
         ], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
-            val = cls.words_to_amp(properties, np.array(range(len(raw_data))), raw_data)
-            errors    = np.abs(val[1] - a[mask])
-            max_error = (cls.DBM_MAX - cls.DBM_MIN) / ((1 << cls.AMP_BITS) - 1)
-            imax      = np.argmax(errors)
-            print('a = %.6f MHz: ATW = 0x%x -> %.6f MHz (%s, %.1e <= %.1e)' % (amplitudes[mask][imax], atw[mask][imax], val[1][imax], 'ok' if errors[imax] <= max_error else 'error', errors[imax], max_error))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s amp_to_words: %i amplitude conversions out of tolerance! max. error for %.6f dBm != %.6f dBm" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], a[mask][imax]))
+        if BACK_CONVERT: # check back conversion
+            back_convert(cls, properties, a, mask, raw_data, cls.words_to_amp, (cls.DBM_MAX - cls.DBM_MIN) / ((1 << cls.AMP_BITS) - 1))
         return raw_data
 
-    @classmethod
-    def words_to_amp(cls, properties, times, words):
-        """
-        converts np.array of words into amplitude in dBm.
-        properties = sub-channel properties
-        words = np.array of cls.raw_dtype
-        returns [times, values] as np.array of times.dtype and np.float64 of converted words.
-        notes:
-        - the function filters input words for device address (range)
-        - the function returns ALL times and values where AMPLITUDE is set
-        TODO: assumed amplitude value is shifted by VALUE_SHIFT?
-        """
-        amplitude = ((words & cls.AMPLITUDE) == cls.AMPLITUDE)
-        values = (words[amplitude] >> cls.VALUE_SHIFT) & cls.AMP_MASK
-        values = (values.astype(np.float64)*(cls.U1-cls.U0) + cls.U0*cls.A1 - cls.U1*cls.A0)/(cls.A1-cls.A0)
-        return [times[amplitude], np.where(values <= 0, cls.DBM_MIN, 20.0*np.log10(values))]
-
 class AD9915(AD9854):
     description         = 'DDS AD9915'
 
@@ -572,3 +837,68 @@ class AD9915(AD9854):
     REGS_FREQ_INIT  = None
     REGS_AMP_INIT   = None
     REGS_PHASE_INIT = None
+
+    # frequency sweep with digital ramp generator (DRG)
+    # note: the DRG ramps up when DRCTL pin is high. we assume DRCTL is high.
+    REG_CFR1            = 0x01
+    CFR1_OSK            = 0x01
+    CFR1_AUTOCLEAR      = 0x40
+    REG_CFR2            = 0x06
+    CFR2_PROFILE        = 0x80
+    CFR2_DRG_ENABLE     = 0x08
+    RAMP_RATE_BITS      = 16
+    RAMP_RATE_DIV       = 24        # ramp rate counter runs with SYNC_CLK = SYSCLK/24
+
+    # registers for frequency sweep. LSB first.
+    # DRG lower limit, DRG upper limit, DRG rising step size, DRG rising ramp rate, CFR2 byte with DRG enable
+    REGS_SWEEP          = [[0x10, 0x11, 0x12, 0x13], [0x14, 0x15, 0x16, 0x17], [0x18, 0x19, 0x1a, 0x1b], [0x20, 0x21], [REG_CFR2]]
+    REGS_SWEEP_INIT     = [None, None, None, None, [CFR2_PROFILE]]
+
+    @classmethod
+    def sweep_to_words(cls, properties, f_start, f_stop, duration, shadow=None):
+        """
+        returns [start, stop] words for linear frequency sweep from f_start to f_stop in Hz within duration in seconds.
+        see AD9854.sweep_to_words.
+        AD9915 digital ramp generator: output starts at lower limit and every ramp rate period
+        the rising step size is added until upper limit is reached.
+        only rising sweeps are supported since falling ramps need DRCTL pin low.
+        only CFR1_AUTOCLEAR and CFR2_DRG_ENABLE are changed, the other bits of CFR1/CFR2 are kept (see reg_value).
+        """
+        if f_stop < f_start:
+            raise LabscriptError("%s: falling frequency sweep %e -> %e Hz is not supported (requires DRCTL pin low)!" % (cls.__name__, f_start, f_stop))
+        address = cls.raw_dtype((properties['address'] & ADDR_MASK) << ADDR_SHIFT)
+        df    = cls.SYSCLK/(1<<cls.FREQ_BITS)
+        ftw_start = int(np.round(f_start/df)) & cls.FREQ_MASK
+        ftw_stop  = int(np.round(f_stop /df)) & cls.FREQ_MASK
+        rate  = int(np.clip(np.ceil(duration*cls.SYSCLK/cls.RAMP_RATE_DIV/cls.SWEEP_STEPS), 1, (1<<cls.RAMP_RATE_BITS)-1))
+        steps = duration*cls.SYSCLK/cls.RAMP_RATE_DIV/rate
+        step  = max(1, int(np.round((ftw_stop - ftw_start)/steps)))
+        cfr1  = cls.reg_value(cls.REG_CFR1, shadow)
+        cfr2  = cls.reg_value(cls.REG_CFR2, shadow)
+        start = np.concatenate([
+            cls.reg_to_words(address, cls.REGS_SWEEP[0], ftw_start),
+            cls.reg_to_words(address, cls.REGS_SWEEP[1], ftw_stop),
+            cls.reg_to_words(address, cls.REGS_SWEEP[2], step),
+            cls.reg_to_words(address, cls.REGS_SWEEP[3], rate),
+            cls.reg_to_words(address, [cls.REG_CFR1], cfr1 | cls.CFR1_AUTOCLEAR),
+            cls.reg_to_words(address, cls.REGS_SWEEP[4], cfr2 | cls.CFR2_DRG_ENABLE, update=True)])
+        stop  = np.concatenate([
+            cls.freq_to_words(properties, np.array([f_stop]), update=False),
+            cls.reg_to_words(address, [cls.REG_CFR1], cfr1 & ~cls.CFR1_AUTOCLEAR),
+            cls.reg_to_words(address, cls.REGS_SWEEP[4], cfr2 & ~cls.CFR2_DRG_ENABLE, update=True)])
+        if shadow is not None: # write only changed registers. CFR2 is always changed.
+            start = cls.skip_unchanged(start.reshape((1,-1)), shadow)
+            stop  = cls.skip_unchanged(stop.reshape((1,-1)), shadow)
+        return [start, stop]
+
+    @classmethod
+    def sweep_params(cls, ftw, sweep):
+        """
+        returns [enabled, f0, slope, f_end] of frequency sweep for each update.
+        see AD9854.sweep_params.
+        """
+        lower, upper, step, rate, cfr2 = sweep
+        enabled = ((cfr2 & np.uint64(cls.CFR2_DRG_ENABLE)) != 0)
+        df      = cls.SYSCLK/(1<<cls.FREQ_BITS)
+        slope   = (step.astype(np.float64)*df/1e6)*(cls.SYSCLK/cls.RAMP_RATE_DIV)/np.maximum(rate, 1).astype(np.float64)
+        return [enabled, cls.ftw_to_freq(lower), slope, cls.ftw_to_freq(upper)]
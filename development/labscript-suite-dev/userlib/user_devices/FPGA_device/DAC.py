@@ -9,11 +9,15 @@ import numpy as np
 from labscript import AnalogQuantity, LabscriptError
 from user_devices.FPGA_device.shared import (
     DATA_MASK, DATA_SHIFT,ADDR_BITS, ADDR_SHIFT, ADDR_MASK,
-    BACK_CONVERT,
+    BACK_CONVERT, back_convert,
     AO_INVALID_VALUE, AO_DEFAULT_VALUE,
     BIT_NOP_SH,
 )
 
+# cache of nonlinearity correction tables
+# key = (class name, correction), value = [forward, inverse] lookup table
+_correction_cache = {}
+
 class AnalogOutput(AnalogQuantity):
     # generic analog output (implemented as DAC712)
     # use to derive other DAC's by overwriting class constants and V_to_words and words_to_V
@@ -72,12 +76,18 @@ class AnalogOutput(AnalogQuantity):
 
     def __init__(self, name, parent_device, connection, limits=None,
                  unit_conversion_class=None, unit_conversion_parameters=None,
-                 default_value=None, **kwargs):
+                 default_value=None, correction=None, **kwargs):
         # true device default and invalid values
         self.properties = {
             'default_value': default_value if default_value is not None else AO_DEFAULT_VALUE,
             'invalid_value': AO_INVALID_VALUE,
         }
+        # optional nonlinearity correction of this channel. see get_correction.
+        if correction is not None:
+            if not isinstance(correction, str):
+                correction = [[float(v_set), float(v_meas)] for v_set, v_meas in correction]
+            self.properties['correction'] = correction
+            self.get_correction(self.properties)
         AnalogQuantity.__init__(self, name, parent_device, connection, limits,
                  unit_conversion_class, unit_conversion_parameters,
                  default_value, **kwargs)
@@ -104,8 +114,48 @@ class AnalogOutput(AnalogQuantity):
                          words.astype(np.float64) + 0x8000) * \
                 (cls.AO_MAX - cls.AO_MIN) / ((2**cls.AO_BITS)-1) + cls.AO_MIN)
 
+    @classmethod
+    def get_correction(cls, properties):
+        """
+        returns [forward, inverse] nonlinearity correction tables of channel or None.
+        properties['correction'] is either:
+        - list of sparse knots [[set voltage, measured voltage], ...].
+          measured voltage is linearly interpolated between knots.
+        - file name of np.save or text file with 2^AO_BITS measured voltages indexed by code.
+          the file is not stored in the shot file and must be available for runviewer.
+        forward = np.array of corrected code indexed by code of V_to_words.
+        inverse = np.array of measured voltage indexed by code.
+        tables are calculated once per class and correction.
+        """
+        correction = properties.get('correction', None)
+        if correction is None: return None
+        key = (cls.__name__, correction if isinstance(correction, str) else tuple(tuple(k) for k in correction))
+        if key in _correction_cache: return _correction_cache[key]
+        words = np.arange(2**cls.AO_BITS, dtype=cls.raw_dtype)
+        volts = cls.words_to_V(words)
+        if isinstance(correction, str):
+            measured = np.load(correction) if correction.endswith('.npy') else np.loadtxt(correction)
+            measured = np.array(measured, dtype=np.float64).flatten()
+            if len(measured) != len(words):
+                raise LabscriptError("%s: correction '%s' has %i entries but %i expected!" % (cls.__name__, correction, len(measured), len(words)))
+        else:
+            knots = np.array(correction, dtype=np.float64)
+            if (knots.ndim != 2) or (knots.shape[1] != 2) or (len(knots) < 2):
+                raise LabscriptError("%s: correction must be at least 2 knots [set voltage, measured voltage]!" % (cls.__name__))
+            knots = knots[np.argsort(knots[:,0])]
+            measured = np.interp(volts, knots[:,0], knots[:,1])
+        # sort codes by voltage. measured voltage must increase with set voltage.
+        order = np.argsort(volts)
+        if np.any(np.diff(measured[order]) <= 0):
+            raise LabscriptError("%s: correction is not strictly monotonic!" % (cls.__name__))
+        # for each code find the code which gives the ideal voltage of the code
+        forward = cls.V_to_words(np.interp(volts, measured[order], volts[order])).astype(cls.raw_dtype)
+        _correction_cache[key] = [forward, measured]
+        return _correction_cache[key]
+
     # conversion function from data to raw_data word(s)
     # properies = dictionary with required content 'invalid_value' and 'address'
+    #             optional 'correction' with nonlinearity correction. see get_correction.
     # values    = numpy array of analog values to be converted to raw data words.
     # args      = additional arguments for implementation of derived classes
     # returns np.array of type cls.raw_dtype with one or several data words.
@@ -117,16 +167,17 @@ class AnalogOutput(AnalogQuantity):
         address       = cls.raw_dtype(properties['address'] & ADDR_MASK) << ADDR_SHIFT
         invalid_value = properties['invalid_value']
         mask = (values != invalid_value)
-        raw_data = np.where(mask, cls.V_to_words(np.clip(values, cls.AO_MIN, cls.AO_MAX)) | address, BIT_NOP_SH).astype(cls.raw_dtype)
-        if BACK_CONVERT and np.any(mask):
-            val = cls.from_words(properties, np.arange(len(raw_data)), raw_data)
-            errors    = np.abs(val[1] - values[mask])
-            max_error = cls.AO_RESOLUTION
-            imax      = np.argmax(errors)
-            #print(np.transpose([values, raw_data]))
-            print('%s U = %.6f V: word = 0x%x -> %.6f V (%s, %.1e <= %.1e)' % (cls.__name__, values[mask][imax], raw_data[mask][imax], val[1][imax], 'ok' if errors[imax] <= max_error else 'error', errors[imax], max_error))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s to_words: %i voltage conversions out of tolerance! max error for %.6f V != %.6f V" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], values[mask][imax]))
+        words = cls.V_to_words(np.clip(values, cls.AO_MIN, cls.AO_MAX))
+        correction = cls.get_correction(properties)
+        if correction is not None:
+            words = correction[0][words]
+        raw_data = np.where(mask, words | address, BIT_NOP_SH).astype(cls.raw_dtype)
+        if BACK_CONVERT:
+            # with correction the value is rounded twice: to the ideal code and to the corrected code.
+            # the measured step between neighbouring output voltages might be larger than the resolution.
+            # note: sort since codes are not ordered by voltage (0x7fff -> 0x8000 wraps around).
+            max_error = cls.AO_RESOLUTION if correction is None else 0.5*cls.AO_RESOLUTION + np.max(np.diff(np.sort(correction[1])))
+            back_convert(cls, properties, values, mask, raw_data, cls.from_words, max_error)
         return raw_data
 
     # conversion function from raw data word(s) to analog values
@@ -138,10 +189,14 @@ class AnalogOutput(AnalogQuantity):
     # implementation specific:
     # - filters data for device address
     # - returns same number of values as filtered data
+    # - with correction returns measured voltage instead of words_to_V
     @classmethod
     def from_words(cls, properties, times, words, **args):
         address = cls.raw_dtype(properties['address'] & ADDR_MASK) << ADDR_SHIFT
         mask = ((words & (BIT_NOP_SH | (ADDR_MASK << ADDR_SHIFT))) == address)
+        correction = cls.get_correction(properties)
+        if correction is not None:
+            return [times[mask], correction[1][words[mask] & DATA_MASK]]
         return [times[mask], cls.words_to_V(words[mask] & DATA_MASK)]
 
     @classmethod
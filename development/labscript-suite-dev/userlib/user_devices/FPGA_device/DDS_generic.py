@@ -13,7 +13,7 @@ from .shared import (
     PROP_UNIT, PROP_MIN, PROP_MAX, PROP_STEP, PROP_DEC,
     PROP_UNIT_MHZ, PROP_UNIT_DBM, PROP_UNIT_DEGREE,
     DDS_CHANNEL_FREQ, DDS_CHANNEL_AMP, DDS_CHANNEL_PHASE,
-    CRC_CHECK, CRC, show_data, BACK_CONVERT,
+    CRC_CHECK, CRC, show_data, BACK_CONVERT, back_convert, DDS_SHADOW_REGISTERS,
     DATA_BITS, DATA_MASK, DATA_SHIFT, ADDR_BITS, ADDR_MASK, ADDR_SHIFT, ADDR_MAX,
     BIT_NOP_SH,
 )
@@ -180,6 +180,11 @@ class DDS_generic(DDSQuantity):
                              DDS_CHANNEL_AMP  : DDS_AMP_DEFAULT_VALUE,
                              DDS_CHANNEL_PHASE: DDS_PHASE_DEFAULT_VALUE}
 
+        # shadow of DDS registers written during this shot. key = register, value = last written value.
+        # empty means all registers are unknown and will be written.
+        # used only by devices supporting differential register writes and when DDS_SHADOW_REGISTERS = True.
+        self.shadow = {}
+
         # save all properties into h5 file
         # this way worker and runviewer have access to it.
         for sub in [self.frequency, self.amplitude, self.phase]:
@@ -242,14 +247,8 @@ class DDS_generic(DDSQuantity):
         f = np.clip(f, freq_limits[0], freq_limits[1])
         ftw = np.round(f/df).astype(np.uint64) & np.uint64(cls.FREQ_MASK)
         raw_data = np.array([address | (((ftw >> np.uint64(i)).astype(cls.raw_dtype) & DATA_MASK) << DATA_SHIFT) for i in range(0, cls.FREQ_BITS, DATA_BITS)], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
-            val = cls.words_to_freq(properties, np.array(range(len(raw_data))), raw_data)
-            errors = np.abs(val[1] - f[mask]/1e6)
-            max_error = 0.5*cls.SYSCLK/((1<<cls.FREQ_BITS)-1)
-            imax = np.argmax(errors)
-            #print('%s f = %.6f MHz: FTW = 0x%x -> %.6f MHz' % (cls.__name__, frequency[mask][imax]/1e6, ftw[mask][imax], val[1][imax]))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s freq_to_words: %i frequencies out of tolerance! max. error for %.6f MHz != %.6f MHz" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], f[mask][imax]/1e6))
+        if BACK_CONVERT: # check back conversion
+            back_convert(cls, properties, f/1e6, mask, raw_data, cls.words_to_freq, 1e-6*cls.SYSCLK/(1<<cls.FREQ_BITS))
         return raw_data
 
     @classmethod
@@ -300,14 +299,8 @@ class DDS_generic(DDSQuantity):
         uval = 10**(a/20.0)
         atw = np.round(((uval - cls.U0)*cls.A1 + (cls.U1 - uval)*cls.A0)/(cls.U1-cls.U0)).astype(dtype=cls.raw_dtype) & cls.AMP_MASK
         raw_data = np.array([address | (((atw >> i) & DATA_MASK) << DATA_SHIFT) for i in range(0, cls.AMP_BITS, DATA_BITS)], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
-            val = cls.words_to_amp(properties, np.arange(len(raw_data)), raw_data)
-            errors    = np.abs(val[1] - a[mask])
-            max_error = (cls.DBM_MAX-cls.DBM_MIN)/((1<<cls.AMP_BITS)-1)
-            imax      = np.argmax(errors)
-            #print('%s a = %.6f dBm: ATW = 0x%x -> %.6f dBm' % (cls.__name__, amplitude[mask][imax], atw[mask][imax], val[1][imax]))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s amp_to_words: %i amplitudes out of tolerance! max. error for %.6f dBm != %.6f dBm" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], a[mask][imax]))
+        if BACK_CONVERT: # check back conversion
+            back_convert(cls, properties, a, mask, raw_data, cls.words_to_amp, (cls.DBM_MAX-cls.DBM_MIN)/((1<<cls.AMP_BITS)-1))
         return raw_data
 
     @classmethod
@@ -346,14 +339,8 @@ class DDS_generic(DDSQuantity):
         p = np.clip(p % 360.0, phase_limits[0], phase_limits[1])
         ptw = np.round((p/360.0)*((1<<cls.PHASE_BITS)-1)).astype(cls.raw_dtype) & cls.PHASE_MASK
         raw_data = np.array([address | (((ptw>>i) & DATA_MASK) << DATA_SHIFT) for i in range(0, cls.PHASE_BITS, DATA_BITS)], dtype=cls.raw_dtype).flatten(order='F')
-        if BACK_CONVERT and np.any(mask): # check back conversion
-            val = cls.words_to_phase(properties, np.array(range(len(raw_data))), raw_data)
-            errors    = np.abs(val[1] - p[mask])
-            max_error = 360.0/((1<<cls.PHASE_BITS)-1)
-            imax      = np.argmax(errors)
-            #print('%s p = %.6f deg: PTW = 0x%x -> %.6f deg' % (cls.__name__, phase[mask][imax], ptw[mask][imax], val[1][imax]))
-            if errors[imax] > max_error:
-                raise LabscriptError("%s phase_to_words: %i phases out of tolerance! max. error for %.6f deg != %.6f deg" % (cls.__name__, np.count_nonzero(errors > max_error), val[1][imax], p[mask][imax]))
+        if BACK_CONVERT: # check back conversion
+            back_convert(cls, properties, p, mask, raw_data, cls.words_to_phase, 360.0/((1<<cls.PHASE_BITS)-1))
         return raw_data
 
     @classmethod
@@ -418,6 +405,11 @@ class DDS_generic(DDSQuantity):
         # check limits
         if value < self.freq_limits[0] or value > self.freq_limits[1]:
             raise LabscriptError("%s t=%e: frequency %e is out of range %e - %e!" % (self.name, t, value, self.freq_limits[0], self.freq_limits[1]))
+        if DDS_SHADOW_REGISTERS:
+            # differential register writes require increasing time
+            if self.frequency.final_time is not None and t < self.frequency.final_time:
+                raise LabscriptError("%s t=%e: frequency instruction before last instruction at t=%e! insert instructions with increasing time or set DDS_SHADOW_REGISTERS = False." % (self.name, t, self.frequency.final_time))
+            args['shadow'] = self.shadow
         # save raw data into individual instructions
         raw_data = self.freq_to_words(self.frequency.properties, np.array([value]), **args)
         #print(self.name, 't', t, 'f', value, '['+(','.join(['0x%x'%d for d in raw_data])+']'))
@@ -441,6 +433,11 @@ class DDS_generic(DDSQuantity):
         # check limits
         if value < self.amp_limits[0] or value > self.amp_limits[1]:
             raise LabscriptError("%s t=%e: amplitude %e is out of range %e - %e!" % (self.name, t, value, self.amp_limits[0], self.amp_limits[1]))
+        if DDS_SHADOW_REGISTERS:
+            # differential register writes require increasing time
+            if self.amplitude.final_time is not None and t < self.amplitude.final_time:
+                raise LabscriptError("%s t=%e: amplitude instruction before last instruction at t=%e! insert instructions with increasing time or set DDS_SHADOW_REGISTERS = False." % (self.name, t, self.amplitude.final_time))
+            args['shadow'] = self.shadow
         # save raw data into individual instructions
         raw_data = self.amp_to_words(self.amplitude.properties, np.array([value]), **args)
         #print(self.name, 't', t, 'a', value, '['+(','.join(['0x%x'%d for d in raw_data])+']'))
@@ -464,6 +461,11 @@ class DDS_generic(DDSQuantity):
         # check limits
         if value < self.phase_limits[0] or value > self.phase_limits[1]:
             raise LabscriptError("%s t=%e: phase %e is out of range %e - %e!" % (self.name, t, value, self.phase_limits[0], self.phase_limits[1]))
+        if DDS_SHADOW_REGISTERS:
+            # differential register writes require increasing time
+            if self.phase.final_time is not None and t < self.phase.final_time:
+                raise LabscriptError("%s t=%e: phase instruction before last instruction at t=%e! insert instructions with increasing time or set DDS_SHADOW_REGISTERS = False." % (self.name, t, self.phase.final_time))
+            args['shadow'] = self.shadow
         # save raw data into individual instructions
         raw_data = self.phase_to_words(self.phase.properties, np.array([value]), **args)
         #print(self.name, 't', t, 'p', value, '['+(','.join(['0x%x'%d for d in raw_data])+']'))
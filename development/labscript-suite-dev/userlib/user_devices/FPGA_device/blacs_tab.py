@@ -19,6 +19,7 @@ from blacs.tab_base_classes import Worker, define_state, MODE_MANUAL, MODE_TRANS
 from blacs.device_base_class import DeviceTab
 
 import logging
+from time import perf_counter as get_ticks
 from .labscript_device import (
     log_level, get_channels,
     AO_NAME, DO_NAME, DDS_NAME, FPGA_NAME, ADD_WORKER,
@@ -41,6 +42,7 @@ from .shared import (
     use_prelim_version,
     DDS_CHANNEL_FREQ, DDS_CHANNEL_AMP, DDS_CHANNEL_PHASE,
     PROP_MIN, PROP_MAX, ADDR_BITS,
+    LAZY_WIDGETS,
 )
 
 if use_prelim_version:
@@ -826,9 +828,27 @@ class FPGA_force(QGroupBox):
                 self.parent.event_queue.put(allowed_states=MODE_MANUAL|MODE_BUFFERED|MODE_TRANSITION_TO_BUFFERED|MODE_TRANSITION_TO_MANUAL, queue_state_indefinitely=True, delete_stale_states=False, data=[self._changed, [[self.value],{}]])
         self.setChecked(enabled)
 
+class LazyGroup(QObject):
+    """
+    calls create() when palette is shown the first time.
+    used to create channel widgets of a group only when the user opens the group.
+    """
+    def __init__(self, palette, create):
+        QObject.__init__(self, palette)
+        self.create = create
+        palette.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if (event.type() == QEvent.Show) and (self.create is not None):
+            create, self.create = self.create, None
+            obj.removeEventFilter(self)
+            create()
+        return False
+
 @BLACS_tab
 class FPGA_tab(DeviceTab):
     def initialise_GUI(self):
+        t_start = get_ticks()
         # reduce number of log entries in logfile (labscript-suite/logs/BLACS.log)
         # TODO: maybe there is a global setting for this but could not find?
         self.logger.setLevel(log_level)
@@ -872,6 +892,7 @@ class FPGA_tab(DeviceTab):
 
         # get all channels of board
         # note: connections = pseudo clock -> clockline -> intermediate device -> channel
+        t_channels = get_ticks()
         #ao_list = {}
         #do_list = {}
         #dds_list = {}
@@ -944,6 +965,8 @@ class FPGA_tab(DeviceTab):
             print('channel',key,'name',child.name)
 
         # Create the output objects
+        t_outputs = get_ticks()
+        t_channels = t_outputs - t_channels
         save_print('create %i analog  outputs' % (len(ao_prop)))
         save_print('create %i digital outputs' % (len(do_prop)))
         save_print('create %i DDS     outputs' % (len(dds_prop)))
@@ -957,40 +980,31 @@ class FPGA_tab(DeviceTab):
             return all_IDs[channel]
 
         # create widgets and place on GUI
-        dds_widgets, ao_widgets, do_widgets = self.auto_create_widgets()
-        for name, prop in ao_widgets.items():
-            # if there is a unit conversion class select unit, decimals* and step size*. Volts can be still selected manually.
-            # TODO: (*) these settings are not permanent: changed when user selects Volts and then goes back to 'unit'.
-            child = self.channels[name]
-            if child.unit_conversion_class is not None:
-                # select unit
-                try:
-                    unit = child.unit_conversion_params['unit']
-                    # replace % symbol since in unit conversion class have to define %_to_base and %_from_base functions which would be invalid names
-                    # TODO: how to display still '%' instead?
-                    if unit == '%': unit = 'percent'
-                    prop.set_selected_unit(unit)
-                except KeyError:
-                    pass
-                # save_print("analog out '%s' selected unit '%s'" % (name, prop.selected_unit))
-                # select number of decimals.
-                try:
-                    decimals = child.unit_conversion_params['decimals']
-                    prop.set_num_decimals(decimals)
-                except KeyError:
-                    pass
-                # set step size.
-                try:
-                    step = child.unit_conversion_params['step']
-                    prop.set_step_size(step)
-                except KeyError:
-                    pass
-                # the limits we have already set via voltage limits. this is permanent.
-                #prop.set_limits(lower, upper)
-
-        self.auto_place_widgets((AO_NAME, ao_widgets, sort),
-                                (DO_NAME, do_widgets, sort),
-                                (DDS_NAME, dds_widgets, sort))
+        # with LAZY_WIDGETS we create only the groups and the widgets of a group are created when the user opens the group.
+        # all groups are closed at startup, so with many channels this saves most of the startup time of the tab.
+        # the output objects created above keep the channel values also without widgets.
+        t_widgets = get_ticks()
+        t_outputs = t_widgets - t_outputs
+        if LAZY_WIDGETS:
+            widget = QWidget()
+            toolpalettegroup = ToolPaletteGroup(widget)
+            for name, outputs in [(AO_NAME, self._AO), (DO_NAME, self._DO), (DDS_NAME, self._DDS)]:
+                if len(outputs) > 0:
+                    palette = toolpalettegroup.append_new_palette(name)
+                    channels = sorted(outputs.keys(), key=sort)
+                    LazyGroup(palette, lambda palette=palette, outputs=outputs, channels=channels: self.create_widgets(palette, outputs, channels))
+            self.get_tab_layout().addWidget(widget)
+            self.get_tab_layout().addItem(QSpacerItem(0, 0, QSizePolicy.Minimum, QSizePolicy.MinimumExpanding))
+        else:
+            dds_widgets, ao_widgets, do_widgets = self.auto_create_widgets()
+            for name, widget in ao_widgets.items():
+                self.init_ao_widget(name, widget)
+            for widget in do_widgets.values():
+                self.init_do_widget(widget)
+            self.auto_place_widgets((AO_NAME, ao_widgets, sort),
+                                    (DO_NAME, do_widgets, sort),
+                                    (DDS_NAME, dds_widgets, sort))
+        t_widgets = get_ticks() - t_widgets
 
         if False:
             # change ananlog output list to contain only IDs and last value
@@ -1012,6 +1026,7 @@ class FPGA_tab(DeviceTab):
 
         # create the worker process
         # each board gets his own name, so we can refer to it
+        t_worker = get_ticks()
         self.primary_worker = self.device_name + ADD_WORKER
         #self.secondary_worker = self.device_name + ADD_WORKER
         #save_print('create worker',self.primary_worker,'args',self.worker_args)
@@ -1028,6 +1043,8 @@ class FPGA_tab(DeviceTab):
             'worker_args'   : self.worker_args, # additional worker arguments
         })
 
+        t_worker = get_ticks() - t_worker
+
         # Set the capabilities of this device
         # TODO: should check what these make. maybe is useful for something?
         self.supports_remote_value_check(False)
@@ -1043,7 +1060,7 @@ class FPGA_tab(DeviceTab):
         if True:
             # customize digital and analog outputs GUI appearance
             # + close all widget group buttons
-            # + change color of digital outputs since is hardly readable
+            # note: color of digital outputs is changed in init_do_widget
             index = layout.count()
             for i in range(index):
                 widget = layout.itemAt(i).widget()
@@ -1060,15 +1077,6 @@ class FPGA_tab(DeviceTab):
                             child.hide_palette(DDS_NAME)
                         if FPGA_NAME in child._widget_groups:
                             child.hide_palette(FPGA_NAME)
-                    # change digital output text color since text is hardly readable
-                    DO = widget.findChildren(DigitalOutput)
-                    for do in DO:
-                        #save_print('set color of digital output', do.text())
-                        do.setToolTip(do.text())
-                        #do.setText('changed!\n')
-                        do.setStyleSheet('QPushButton {color: white; font-size: 14pt;}')
-                        #do.setStyleSheet('QPushButton {color: white; background-color: darkgreen; font-size: 14pt;} QPushButton::pressed {color: black; background-color: lightgreen; font-size: 14pt;}')
-                        #do.setStyleSheet('QPushButton {color: white; font-size: 14pt;} QPushButton::pressed {color: black; font-size: 14pt;}')
 
         # optional worker arguments
         #save_print("'%s' worker args:" % self.device_name, self.worker_args)
@@ -1123,6 +1131,59 @@ class FPGA_tab(DeviceTab):
         self.warning = warn_user_dialog(parent=self._ui, text=self.warning_text, title="'%s' warning!" % self.device_name)
         #self.warning.update("'%s' test" % self.device_name)
 
+        # startup time
+        save_print("'%s' initialise_GUI: channels %.1fms, outputs %.1fms, widgets %.1fms%s, worker %.1fms, total %.1fms" % (
+            self.device_name, t_channels*1e3, t_outputs*1e3, t_widgets*1e3, ' (lazy)' if LAZY_WIDGETS else '', t_worker*1e3, (get_ticks() - t_start)*1e3))
+
+    def create_widgets(self, palette, outputs, channels):
+        # create widgets of given output objects and add to palette in order of channels
+        t_start = get_ticks()
+        for channel in channels:
+            widget = outputs[channel].create_widget()
+            if   outputs is self._AO: self.init_ao_widget(channel, widget)
+            elif outputs is self._DO: self.init_do_widget(widget)
+            palette.addWidget(widget, True)
+        save_print("'%s' created %i widgets (%.1fms)" % (self.device_name, len(channels), (get_ticks() - t_start)*1e3))
+
+    def init_ao_widget(self, name, widget):
+        # if there is a unit conversion class select unit, decimals* and step size*. Volts can be still selected manually.
+        # TODO: (*) these settings are not permanent: changed when user selects Volts and then goes back to 'unit'.
+        child = self.channels[name]
+        if child.unit_conversion_class is not None:
+            # select unit
+            try:
+                unit = child.unit_conversion_params['unit']
+                # replace % symbol since in unit conversion class have to define %_to_base and %_from_base functions which would be invalid names
+                # TODO: how to display still '%' instead?
+                if unit == '%': unit = 'percent'
+                widget.set_selected_unit(unit)
+            except KeyError:
+                pass
+            # save_print("analog out '%s' selected unit '%s'" % (name, widget.selected_unit))
+            # select number of decimals.
+            try:
+                decimals = child.unit_conversion_params['decimals']
+                widget.set_num_decimals(decimals)
+            except KeyError:
+                pass
+            # set step size.
+            try:
+                step = child.unit_conversion_params['step']
+                widget.set_step_size(step)
+            except KeyError:
+                pass
+            # the limits we have already set via voltage limits. this is permanent.
+            #widget.set_limits(lower, upper)
+
+    def init_do_widget(self, do):
+        # change digital output text color since text is hardly readable
+        #save_print('set color of digital output', do.text())
+        do.setToolTip(do.text())
+        #do.setText('changed!\n')
+        do.setStyleSheet('QPushButton {color: white; font-size: 14pt;}')
+        #do.setStyleSheet('QPushButton {color: white; background-color: darkgreen; font-size: 14pt;} QPushButton::pressed {color: black; background-color: lightgreen; font-size: 14pt;}')
+        #do.setStyleSheet('QPushButton {color: white; font-size: 14pt;} QPushButton::pressed {color: black; font-size: 14pt;}')
+
 
     def get_child_from_connection_table(self, parent_device_name, port):
         # this is called from create_analog/digital/dds_outputs to get the name of the channel.
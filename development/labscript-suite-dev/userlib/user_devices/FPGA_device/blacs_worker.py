@@ -17,10 +17,9 @@ from labscript import (
     StaticDigitalOut, StaticDigitalQuantity,
     StaticAnalogOut, StaticAnalogQuantity
 )
-from labscript_utils import import_or_reload
 
 from .labscript_device import (
-    log_level, save_print,
+    log_level, save_print, get_device_class,
     SOCK_TIMEOUT_SHORT, SOCK_TIMEOUT,
     SERVER_ACK, SERVER_NACK, SERVER_STOP, SERVER_CMD_NUM_BYTES,
     SERVER_OPEN, SERVER_RESET, SERVER_CONFIG, SERVER_CLOSE, SERVER_START, SERVER_WRITE,
@@ -39,7 +38,7 @@ from .labscript_device import (
     MSG_ENABLED, MSG_DISABLED, MSG_EXT_CLOCK, MSG_IO_SETTINGS,
     MSG_IGNORE_CLOCK_LOSS,
     START_TIME, BIT_NOP_SH,
-    from_string, get_board_samples,
+    from_bytes, open_matrix, get_board_samples,
     get_rack, get_address, get_channel,
     to_client_status, from_client_status,
     to_client_sr32, from_client_sr32, STRUCT_CLIENT_SR32_NUM_BYTES,
@@ -64,6 +63,20 @@ from .shared import (
     CRC_CHECK, CRC,
     ADDR_SHIFT, ADDR_MASK_SH,
 )
+# timing of transition phases is shared with iPCdev. see iPCdev/shot_timing.py
+# iPCdev is optional: when it is not installed the timing is not measured.
+try:
+    from user_devices.iPCdev.shot_timing import ShotTiming, TIMING_SUMMARY, TIMING_SAVE
+except ImportError:
+    TIMING_SUMMARY = 0
+    TIMING_SAVE    = False
+    class ShotTiming(object):
+        # no-op timing with the same interface as iPCdev ShotTiming. done() returns False such that nothing is printed or saved.
+        def __init__(self, name): self.count = 0
+        def start(self): pass
+        def mark(self, phase, boards=None): pass
+        def since_run(self, phase): pass
+        def done(self): return False
 
 #connect to server
 #timeout = time in seconds (float) after which function returns with error
@@ -252,7 +265,8 @@ def send_data(info, sock, data, reset):
             num_bytes = len(data)*len(data[0])*4
             result = send_recv_data(sock, to_client_data32(SERVER_WRITE, num_bytes), SOCK_TIMEOUT, output='SEND %d bytes?'%(num_bytes))
             if result == SERVER_ACK:
-                result = send_recv_data(sock, data.tobytes(order='C'), None, output='SEND %d bytes'%(num_bytes))
+                # contiguous data is sent without copy
+                result = send_recv_data(sock, memoryview(data) if data.flags['C_CONTIGUOUS'] else data.tobytes(order='C'), None, output='SEND %d bytes'%(num_bytes))
                 if result == SERVER_ACK:
                     print('%d bytes sent to server (ok)' % (num_bytes))
                     return True
@@ -274,6 +288,7 @@ class FPGA_worker(Worker):
         global select; import select
         global struct; import struct
         global get_ticks; from time import perf_counter as get_ticks
+        t_init = get_ticks()
 
         # these functions allow to send events between the board worker processes
         # the minimum propagation time is however ca. 0.7(1)ms, which is not super fast.
@@ -288,6 +303,8 @@ class FPGA_worker(Worker):
         self.board_cycles  = 0
         self.abort = False
         self.t_start = [0,0]; # start time from transition_to_manual and start_run
+        self.timing = ShotTiming(self.device_name) # timing of transition phases of last shots
+        self.h5file = None
         self.final_values = {}
         self.front_panel_values = {}
 
@@ -344,6 +361,7 @@ class FPGA_worker(Worker):
             self.onChangeExtClock(self.ext_clock)
             self.onChangeIgnoreClockLoss(self.ignore_clock_loss)
 
+        t_connect = get_ticks()
         if not self.simulate:
             # connect - open - reset - configure board
             # on error: we disconnect and set self.sock=None
@@ -361,6 +379,7 @@ class FPGA_worker(Worker):
                             sync_wait   = self.sync_wait,
                             sync_phase  = self.sync_phase)
         else: self.sock = None
+        t_connect = get_ticks() - t_connect
         self.first_time   = True
         self.state_manual = False # config is in manual state (True) or in running state (False)
 
@@ -389,19 +408,15 @@ class FPGA_worker(Worker):
         # and to call to_word for user input
         print('%i channels' % (len(self.channels)))
         init_data = []
+        t_classes = get_ticks()
         for connection, channel in self.channels.items():
-            # note: the default channel.device_class is only the class name
-            #       but we need the path + name for loading device class!
-            device_class = channel.properties['device_class'].split('.')
-            module_name = '.'.join(device_class[:-1])
-            class_name  = device_class[-1]
-            if class_name != channel.device_class:
-                raise LabscriptError("%s (%s) class name '%s' != '%s'!" % (channel.name, connection, class_name, channel.device_class))
-            import_or_reload(module_name)
-            channel.cls = getattr(sys.modules[module_name], channel.device_class)
+            # device classes are imported once per process. see get_device_class.
+            channel.cls = get_device_class(channel, connection)
             if False and hasattr(channel.cls, 'test'):
                 # perform self tests
                 channel.cls.test()
+        t_act = get_ticks()
+        save_print("'%s' init: connect %.1fms, %i channel classes %.1fms, total %.1fms" % (self.device_name, t_connect*1e3, len(self.channels), (t_act - t_classes)*1e3, (t_act - t_init)*1e3))
 
     def program_manual(self, front_panel_values):
         # save actual front panel values
@@ -570,6 +585,8 @@ class FPGA_worker(Worker):
         """
         self.count = 0
         self.t_start[0] = get_ticks()
+        self.timing.start()
+        self.h5file = hdf5file
         if self.simulate:
             self.state_manual = False
         else:
@@ -596,26 +613,28 @@ class FPGA_worker(Worker):
                 self.state_manual = False
             if self.sock is None:
                 return None
+        self.timing.mark('config')
 
         self.abort = False
-        with h5py.File(hdf5file,'r') as hdf5_file:
+        # board data is kept until upload is finished. for MATRIX_CONTIGUOUS data is mapped from the file without copy.
+        with h5py.File(hdf5file,'r') as hdf5_file, open_matrix(hdf5_file['devices/%s'%(device_name)], '%s_matrix'%device_name) as data:
             group = hdf5_file['devices/%s'%(device_name)]
-            data = group['%s_matrix'%device_name][:] # TODO: without [:] does not work?
             #print(data)
             #print(data.shape)
 
-            self.final_values = from_string(group['%s_final' % device_name][0])
+            self.final_values = from_bytes(group['%s_final' % device_name][0])
             print('final values:', self.final_values)
 
             if CRC_CHECK:
-                all_crc = from_string(group['%s_CRC' % device_name][0])
+                all_crc = from_bytes(group['%s_CRC' % device_name][0])
                 print('CRC:', all_crc)
 
             t_read = (get_ticks()-self.t_start[0])*1e3
+            self.timing.mark('read')
 
             # use updated settings given in worker_args_ex which take precedence to worker_args.
             # however, worker_args are not overwritten, so if worker_args_ex are not anymore set, original worker_args apply.
-            worker_args_ex = from_string(group['%s_worker_args_ex' % device_name][0])
+            worker_args_ex = from_bytes(group['%s_worker_args_ex' % device_name][0])
             #print('updating worker_args', worker_args_ex)
             self.parse_worker_args(worker_args_ex)
 
@@ -684,13 +703,21 @@ class FPGA_worker(Worker):
                         if value != crc:
                             raise LabscriptError('%s %i samples CRC 0x%08x != 0x%08x' % (channel.name, len(raw_data), value, crc))
                         # check word_to_freq
-                        values = channel.cls.from_words(channel.child_list[channel.name+'_freq'].properties, data[:,0], data[:,rack+1])
-                        print('freq  (MHz) =', values)
-                        values = channel.cls.from_words(channel.child_list[channel.name+'_amp'].properties, data[:,0], data[:,rack+1])
-                        print('amp   (dBm) =', values)
-                        values = channel.cls.from_words(channel.child_list[channel.name+'_phase'].properties, data[:,0], data[:,rack+1])
-                        print('phase (deg) =', values)
-
+                        if hasattr(channel.cls, 'words_to_values') and (channel.cls.addr_offset is None):
+                            # all sub-channels share the same address (range): decode all at once.
+                            times, freq, amp, phase = channel.cls.words_to_values(channel.child_list[channel.name+'_freq'].properties, data[:,0], data[:,rack+1])
+                            print('freq  (MHz) =', [times, freq])
+                            print('amp   (dBm) =', [times, amp])
+                            print('phase (deg) =', [times, phase])
+                        else:
+                            values = channel.cls.from_words(channel.child_list[channel.name+'_freq'].properties, data[:,0], data[:,rack+1])
+                            print('freq  (MHz) =', values)
+                            values = channel.cls.from_words(channel.child_list[channel.name+'_amp'].properties, data[:,0], data[:,rack+1])
+                            print('amp   (dBm) =', values)
+                            values = channel.cls.from_words(channel.child_list[channel.name+'_phase'].properties, data[:,0], data[:,rack+1])
+                            print('phase (deg) =', values)
+
+                self.timing.mark('config')
                 if self.is_primary:
                     # primary board
 
@@ -724,6 +751,7 @@ class FPGA_worker(Worker):
                     if result != True: return None
 
                     t_data = (get_ticks() - self.t_start[0]) * 1e3
+                    self.timing.mark('upload')
                     save_print('send data result =', result)
                     #save_print('events =',self.events)
                     if len(self.events) > 0:
@@ -734,21 +762,27 @@ class FPGA_worker(Worker):
                         self.count += 1
 
                         # primary board: wait for secondary boards started
+                        # arrival = time in ms after primary started waiting when each secondary board has started
+                        arrival = {}
+                        t_wait = get_ticks()
                         for i,evt in enumerate(self.events):
                             try:
                                 t_start = get_ticks()
                                 result = evt.wait(self.count, timeout=EVT_TIMEOUT)
                                 t_end = get_ticks()
+                                arrival[self.boards[i]] = (t_end - t_wait) * 1e3
                                 save_print("'%s' wait '%s': %s, posted %.3fms, waited %.3fms (%i)" % (self.device_name, self.boards[i], str(result[1]), (t_end - result[0]) * 1e3, (t_end - t_start) * 1e3, self.count))
                                 if result[1] == False: return None # TODO: what to do with this?
                             except zTimeoutError:
                                 save_print("'%s' wait '%s' started: timeout %.3fs (%i)" % (self.device_name, self.boards[i], get_ticks() - t_start, self.count))
                                 return None
+                        self.timing.mark('wait', arrival)
 
                     # start primary board
                     # note: FPGA_worker::start_run is called from transition_to_buffered since FPGA_tab::start_run is called only for primary pseudoclock device.
                     #sleep(0.1)
                     result = self.start_run()
+                    self.timing.mark('start')
                     t_start = (get_ticks() - self.t_start[0]) * 1e3
                     print('start: %s (hdf %.1fms c&d %.1fms st %.1fms tot %.1fms)' % (result, t_read, t_data-t_read, t_start-t_data, t_start))
                     if result != True: return None
@@ -767,6 +801,7 @@ class FPGA_worker(Worker):
                         save_print("'%s' wait start: timeout %.3fs (%i)" % (self.device_name, get_ticks()-t_start, self.count))
                         return None
                     self.count += 1
+                    self.timing.mark('wait')
 
                     # get status bits and check if external clock is present
                     if self.simulate:
@@ -788,6 +823,7 @@ class FPGA_worker(Worker):
                             if not (self.board_status & STATUS_EXT_LOCKED):  # warning or error state
                                 save_print("'%s' required external clock is missing!" % (self.device_name))
                                 return None
+                    self.timing.mark('config')
 
                     # use external clock and send data
                     # returns True on success, False on error.
@@ -815,9 +851,11 @@ class FPGA_worker(Worker):
                             if result:
                                 result = (self.set_reg(FPGA_REG_CTRL, self.config) is not None)
 
+                    self.timing.mark('upload')
                     if result:
                         # secondary board: start and wait for external trigger
                         result = self.start_run()
+                        self.timing.mark('start')
 
                     # post ok for start of primary board
                     self.events[0].post(self.count, data=(get_ticks(), result))
@@ -977,11 +1015,28 @@ class FPGA_worker(Worker):
         # get changed channels # disabled
         # self.changed = self.get_changed_channels()
 
+        # finish timing of shot and save into shot file if enabled
+        self.timing_done(save=(result == True) and not self.abort)
+
         # return result. True = ok, False = error
         t_act = get_ticks()
         print('transition to manual result %s (%.1fms, total %.1fms)' % (str(result), (t_act - start)*1e3, (t_act - self.t_start[0])*1e3))
         return result
 
+    def timing_done(self, save=True):
+        # finish timing of shot. prints timing of shot and each TIMING_SUMMARY shots the summary of the last shots.
+        # when TIMING_SAVE = True and save = True the timing is saved into the shot file.
+        if not self.timing.done(): return
+        print(self.timing.text())
+        if (TIMING_SUMMARY > 0) and ((self.timing.count % TIMING_SUMMARY) == 0):
+            print(self.timing.summary_text(TIMING_SUMMARY))
+        if save and TIMING_SAVE and (self.h5file is not None):
+            try:
+                with h5py.File(self.h5file, 'r+') as f:
+                    self.timing.save(f)
+            except Exception as e:
+                save_print("'%s' save timing failed: %s" % (self.device_name, str(e)))
+
     def start_run(self):
         # note: FPGA_worker::start_run is called from transition_to_buffered
         #       since FPGA_tab::start_run is called only for primary pseudoclock device,
@@ -1015,6 +1070,7 @@ class FPGA_worker(Worker):
               this will call transition_to_manual where we check board status and return error.
         """
         end = True
+        self.timing.since_run('status')
         if self.simulate:
             run_time = int((get_ticks() - self.t_start[1])*1e6)
             if run_time >= self.exp_time:
@@ -1062,6 +1118,7 @@ class FPGA_worker(Worker):
                         save_print('%8i, # %8i, status 0x%08x running' % (self.board_time, self.board_samples, self.board_status))
                     if not self.abort: end = False
                 elif self.board_status & STATUS_END: # end state
+                    self.timing.since_run('end')
                     save_print('%8i, # %8i, status 0x%08x end (%.1fms)' % (self.board_time, self.board_samples, self.board_status, (get_ticks()-self.t_start[1])*1e3))
                 #elif self.board_status & STATUS_WAIT: # wait state = start trigger
                 elif (self.board_status & STATUS_WAIT) or self.start_trg: # TODO: update firmware such it sets WAIT bit, then we do not need to check for self.start_trg!
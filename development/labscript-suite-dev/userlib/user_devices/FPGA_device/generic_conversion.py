@@ -10,6 +10,20 @@ from labscript_utils.unitconversions import UnitConversion
 # TODO: it would be nice to remove this dependency
 from user_devices.FPGA_device.labscript_device import default_ao_props
 
+# cache of lookup tables used by generic_conversion.from_base
+# key = (equation, min, max, number of points), value = [y, x] or None
+_lut_cache = {}
+
+# cache of calculated calibrations. this way each calibration is calculated only once.
+# key = (equation, user_param, min, max, decimals) see generic_conversion.get_key
+# value = dictionary with calculated attributes (see _cached_attrs)
+_calibration_cache = {}
+_cached_attrs = ['user_param', 'equation', 'compiled', 'decimals', 'x_tol', 'V_min', 'V_max', 'min', 'max', 'x_rng', 'y_rng', 'lut']
+
+# shared conversion objects returned by generic_conversion.get_conversion
+# key = calibration key + (unit,)
+_conversion_cache = {}
+
 class generic_conversion(UnitConversion):
     """
     generic unit conversion class
@@ -47,6 +61,16 @@ class generic_conversion(UnitConversion):
     # number of values used to calculate starting values in from_base()
     num_start = 10
 
+    # number of points of lookup table used by from_base() for inverse conversion.
+    # 65536 points correspond to the resolution of a 16-bit DAC over the full range.
+    # if the equation is not monotonic within 'min' and 'max' from_base() uses newton method.
+    num_lut = 1 << 16
+
+    # if True refine result of lookup table with num_refine newton iterations (vectorized).
+    # this is more accurate but slower.
+    refine = False
+    num_refine = 2
+
     def __init__(self, calibration_parameters = None):
         #print('generic_conversion::__init__ params=',calibration_parameters)
         if calibration_parameters is None:
@@ -65,77 +89,108 @@ class generic_conversion(UnitConversion):
             if self.unit == '%': self.unit = 'percent'
             self.derived_units = [self.unit]
 
-            # get optional 'user_param' and replace with 'x' in equation.
-            # this is easier than defining a variable with name 'user_param'.
-            try:
-                self.user_param = calibration_parameters['user_param']
-                self.equation = self.equation.replace(self.user_param, 'x')
-            except KeyError:
-                self.user_param = 'x'
+            # take calculated calibration from cache if available.
+            # otherwise calculate and save into cache.
+            key = generic_conversion.get_key(calibration_parameters)
+            if key in _calibration_cache:
+                self.__dict__.update(_calibration_cache[key])
+            else:
+                # get optional 'user_param' and replace with 'x' in equation.
+                # this is easier than defining a variable with name 'user_param'.
+                try:
+                    self.user_param = calibration_parameters['user_param']
+                    self.equation = self.equation.replace(self.user_param, 'x')
+                except KeyError:
+                    self.user_param = 'x'
 
-            # compile equation as function of 'x'
-            self.compiled = compile(self.equation, 'conv', 'eval')
+                # compile equation as function of 'x'
+                self.compiled = compile(self.equation, 'conv', 'eval')
 
-            # get optional number of decimals from which tolerance for newton method is calculated
-            try:
-                self.decimals = calibration_parameters['decimals']
-            except KeyError:
-                self.decimals = default_ao_props['decimals']
-            self.x_tol = 10**(-self.decimals-2)
-
-            # set default voltages. might be overwritten by min/max values below.
-            self.V_min = default_ao_props['min']
-            self.V_max = default_ao_props['max']
-
-            # get min/max in user-defined unit:
-            # if 'min' or 'max' given: calculate V_min and V_max in volts.
-            # otherwise calculate with newton() 'min' or 'max' from default 'V_min' or 'V_max' voltage.
-            # note: if 'min' or 'max' is not given we assume that full voltage range is valid, which might produces problems.
-            #       therefore, give always 'min' and 'max' for equations which are valid only in a limited range.
-            try:
-                x = self.min = calibration_parameters['min']
-                self.V_min = eval(self.compiled)
-            except KeyError:
-                y = self.V_min
-                max = calibration_parameters['max'] if 'max' in calibration_parameters else None
-                x, err, ok, iter = newton((lambda x: eval(compiled)-y), x0 = 0.0, dx = 1.0, tol = self.x_tol, x_min=None, x_max=max, warn=False)
-                #x, err, ok = secant((lambda x: eval(self.compiled) - y), self.V_min, self.V_max, tol=self.x_tol, maxiter=50, print_warning=False)
-                if not ok:
-                    txt = "generic_conversion error: could not calculate min value for equation:\n%s\nwith %f%s!\ngive 'min' in connection table." % (self.equation, y, self.base_unit)
-                    print(txt)
-                    raise LabscriptError(txt)
-                else: self.min = x
-            try:
-                x = self.max = calibration_parameters['max']
-                self.V_max = eval(self.compiled)
-            except KeyError:
-                y = self.V_max
-                x, err, ok, iter = newton((lambda x: eval(compiled)-y), x0 = 0.0, dx = 1.0, tol = self.x_tol, x_min=self.min, x_max=None, warn=False)
-                #x, err, ok = secant((lambda x: eval(self.compiled) - y), self.V_min, self.V_max, tol=self.x_tol, maxiter=50, print_warning=False)
-                if not ok:
-                    txt = "generic_conversion error: could not calculate max value for equation '%s' with %f%s!\ngive 'max' in connection table." % (self.equation, y, self.base_unit)
-                    print(txt)
-                    raise LabscriptError(txt)
-                else: self.max = x
-
-            # get mapping y(x) for calculation of starting values
-            self.x_rng = np.linspace(self.min, self.max, num=self.num_start, endpoint=True)
-            self.y_rng = np.array([eval(self.compiled) for x in self.x_rng])
-            # sort by increasing y-values
-            index = np.argsort(self.y_rng)
-            self.x_rng = self.x_rng[index]
-            self.y_rng = self.y_rng[index]
+                # get optional number of decimals from which tolerance for newton method is calculated
+                try:
+                    self.decimals = calibration_parameters['decimals']
+                except KeyError:
+                    self.decimals = default_ao_props['decimals']
+                self.x_tol = 10**(-self.decimals-2)
+
+                # set default voltages. might be overwritten by min/max values below.
+                self.V_min = default_ao_props['min']
+                self.V_max = default_ao_props['max']
+
+                # get min/max in user-defined unit:
+                # if 'min' or 'max' given: calculate V_min and V_max in volts.
+                # otherwise calculate with newton() 'min' or 'max' from default 'V_min' or 'V_max' voltage.
+                # note: if 'min' or 'max' is not given we assume that full voltage range is valid, which might produces problems.
+                #       therefore, give always 'min' and 'max' for equations which are valid only in a limited range.
+                try:
+                    x = self.min = calibration_parameters['min']
+                    self.V_min = eval(self.compiled)
+                except KeyError:
+                    y = self.V_min
+                    max = calibration_parameters['max'] if 'max' in calibration_parameters else None
+                    x, err, ok, iter = newton((lambda x: eval(self.compiled)-y), x0 = 0.0, dx = 1.0, tol = self.x_tol, x_min=None, x_max=max, warn=False)
+                    #x, err, ok = secant((lambda x: eval(self.compiled) - y), self.V_min, self.V_max, tol=self.x_tol, maxiter=50, print_warning=False)
+                    if not ok:
+                        txt = "generic_conversion error: could not calculate min value for equation:\n%s\nwith %f%s!\ngive 'min' in connection table." % (self.equation, y, self.base_unit)
+                        print(txt)
+                        raise LabscriptError(txt)
+                    else: self.min = x
+                try:
+                    x = self.max = calibration_parameters['max']
+                    self.V_max = eval(self.compiled)
+                except KeyError:
+                    y = self.V_max
+                    x, err, ok, iter = newton((lambda x: eval(self.compiled)-y), x0 = 0.0, dx = 1.0, tol = self.x_tol, x_min=self.min, x_max=None, warn=False)
+                    #x, err, ok = secant((lambda x: eval(self.compiled) - y), self.V_min, self.V_max, tol=self.x_tol, maxiter=50, print_warning=False)
+                    if not ok:
+                        txt = "generic_conversion error: could not calculate max value for equation '%s' with %f%s!\ngive 'max' in connection table." % (self.equation, y, self.base_unit)
+                        print(txt)
+                        raise LabscriptError(txt)
+                    else: self.max = x
+
+                # get mapping y(x) for calculation of starting values
+                self.x_rng = np.linspace(self.min, self.max, num=self.num_start, endpoint=True)
+                self.y_rng = np.array([eval(self.compiled) for x in self.x_rng])
+                # sort by increasing y-values
+                index = np.argsort(self.y_rng)
+                self.x_rng = self.x_rng[index]
+                self.y_rng = self.y_rng[index]
+
+                # get lookup table for inverse conversion or None
+                self.lut = self.get_lut()
+
+                _calibration_cache[key] = {attr: getattr(self, attr) for attr in _cached_attrs}
 
         setattr(self, self.unit+'_to_base', self.to_base)
         setattr(self, self.unit+'_from_base', self.from_base)
         self.parameters = calibration_parameters
         UnitConversion.__init__(self, self.parameters)
 
+    @staticmethod
+    def get_key(calibration_parameters):
+        "static function which returns key of calibration_parameters used for caching"
+        return (calibration_parameters.get('equation'),
+                calibration_parameters.get('user_param', 'x'),
+                calibration_parameters.get('min'),
+                calibration_parameters.get('max'),
+                calibration_parameters.get('decimals', default_ao_props['decimals']))
+
+    @staticmethod
+    def get_conversion(calibration_parameters):
+        """
+        static function which returns generic_conversion object for given calibration parameters.
+        the object is created only once and is shared between all channels with the same calibration.
+        """
+        key = generic_conversion.get_key(calibration_parameters) + (calibration_parameters.get('unit'),)
+        if key not in _conversion_cache:
+            _conversion_cache[key] = generic_conversion(calibration_parameters)
+        return _conversion_cache[key]
+
     @staticmethod
     def get_limits(calibration_parameters):
         "static function which returns [V_min, V_max, min, max] for given calibration parameters"
-        # temporarily create a generic_conversion class object and return limits
-        gc = generic_conversion(calibration_parameters)
+        # take shared generic_conversion class object and return limits
+        gc = generic_conversion.get_conversion(calibration_parameters)
         return [gc.V_min, gc.V_max, gc.min, gc.max]
 
     def to_base(self, x):
@@ -147,11 +202,68 @@ class generic_conversion(UnitConversion):
         #print('%%s %%.%if -> %%s %%.%if' % (self.decimals, self.V_decimals) % (self.user_param, x, self.base_unit, y))
         return y
 
+    def evaluate(self, xs):
+        "evaluates equation for np.array xs. returns np.array or None if equation cannot be evaluated or result is not finite."
+        with np.errstate(all='ignore'):
+            try:
+                x = xs
+                y = eval(self.compiled)
+                if np.shape(y) != np.shape(xs): # equation is not vectorized
+                    y = np.array([eval(self.compiled) for x in xs])
+            except Exception:
+                return None
+        y = np.asarray(y, dtype=np.float64)
+        return y if np.all(np.isfinite(y)) else None
+
+    def get_lut(self):
+        """
+        returns lookup table [y, x] with num_lut points for inverse conversion sorted by increasing y.
+        returns None if equation cannot be evaluated or is not monotonic between min and max.
+        lookup tables are cached for the same equation and limits.
+        """
+        key = (self.equation, self.min, self.max, self.num_lut)
+        if key in _lut_cache:
+            return _lut_cache[key]
+        x = np.linspace(self.min, self.max, num=self.num_lut, endpoint=True)
+        y = self.evaluate(x)
+        lut = None
+        if y is not None:
+            dy = np.diff(y)
+            if   np.all(dy >= 0): lut = [y, x]
+            elif np.all(dy <= 0): lut = [y[::-1], x[::-1]]
+        _lut_cache[key] = lut
+        return lut
+
+    def refine_newton(self, x, y):
+        "refines x where equation(x) == y with vectorized newton iterations. x and y are np.arrays."
+        dx = (self.max - self.min)/self.num_lut
+        for i in range(self.num_refine):
+            x1 = np.where(x + dx > self.max, x - dx, x + dx)
+            y0 = self.evaluate(x)
+            y1 = self.evaluate(x1)
+            if y0 is None or y1 is None: break
+            slope = (y1 - y0)/(x1 - x)
+            x = np.clip(x - np.where(slope != 0, (y0 - y)/np.where(slope != 0, slope, 1.0), 0.0), self.min, self.max)
+        return x
+
     def from_base(self, y):
-        "convert Volts to unit using newton method"
-        #TODO: can this be made more efficient for ndarrays?
-        if isinstance(y, np.ndarray):
-            return np.array([self.from_base(yi) for yi in y])
+        "convert Volts to unit. y can be a numpy array. uses lookup table if available, otherwise newton method."
+        if self.lut is None:
+            if isinstance(y, np.ndarray):
+                return np.array([self.from_base_newton(yi) for yi in y])
+            return self.from_base_newton(y)
+        y_lut, x_lut = self.lut
+        yc = np.clip(np.asarray(y, dtype=np.float64), self.V_min, self.V_max)
+        x = np.interp(yc, y_lut, x_lut)
+        if self.refine:
+            x = self.refine_newton(np.atleast_1d(x), np.atleast_1d(yc)).reshape(np.shape(yc))
+        if self.round:
+            x = np.round(x, self.decimals)
+        x = np.clip(x, self.min, self.max)
+        return x if isinstance(y, np.ndarray) else float(x)
+
+    def from_base_newton(self, y):
+        "convert Volts to unit using newton method. y must be a scalar"
         if   y < self.V_min: y = self.V_min
         elif y > self.V_max: y = self.V_max
         # find staring values x0 and x1 left and right of solution y(x) = y
@@ -183,6 +295,110 @@ class generic_conversion(UnitConversion):
         #print('%%s %%.%if -> %%s %%.%if' % (self.V_decimals, self.decimals) % (self.base_unit, y, self.user_param, x))
         return x
 
+class table_conversion(UnitConversion):
+    """
+    table based unit conversion class
+    give calibration_parameters a dictionary with required keys:
+    'unit' is displayed by labscript as the unit of user input.
+    'table' list of measured [user value in 'unit', voltage] pairs, e.g. [[0.0, 0.0], [1.0, 0.52], [2.0, 1.07]].
+    optional calibration_parameters keys:
+    'min' minimum value in units 'unit'. default smallest user value in table.
+    'max' maximum value in units 'unit'. default largest user value in table.
+    'step' step when clicking in gui on up/down arrow. default default_ao_props['step']
+    'decimals' number of decimals to be displayed in gui. default default_ao_props['decimals']
+    notes:
+    - conversion in both directions is piecewise-linear interpolation between table entries (np.interp).
+    - user values and voltages must be strictly monotonic, otherwise LabscriptError is raised.
+      voltages can be increasing or decreasing with user value.
+    - input values are automatically clipped to 'min' <= value <= 'max' and to the table range.
+    - the table is saved in the connection table properties as lists of floats.
+      to update the calibration just update the table in the connection table.
+    """
+
+    base_unit   = default_ao_props['base_unit']
+
+    # number of decimals in base unit
+    V_decimals = default_ao_props['decimals']
+
+    # if True (default) round values to number of decimals. see generic_conversion.
+    round = True
+
+    def __init__(self, calibration_parameters = None):
+        if calibration_parameters is None:
+            calibration_parameters = {}
+            self.derived_units = []
+        else:
+            # get unit and table. both are mandatory.
+            try:
+                self.unit = calibration_parameters['unit']
+                table = np.array(calibration_parameters['table'], dtype=np.float64)
+            except KeyError:
+                raise LabscriptError("table_conversion error: please give 'unit' and 'table' as calibration_parameters!")
+            if (table.ndim != 2) or (table.shape[1] != 2) or (len(table) < 2):
+                raise LabscriptError("table_conversion error: 'table' must be a list of at least 2 [%s, %s] pairs!" % (self.unit, self.base_unit))
+
+            # define derived_units which is required for UnitConversionClass
+            if self.unit == '%': self.unit = 'percent'
+            self.derived_units = [self.unit]
+
+            # sort by increasing user value and check monotonicity
+            table = table[np.argsort(table[:,0], kind='stable')]
+            self.x_tab = table[:,0]
+            self.y_tab = table[:,1]
+            if np.any(np.diff(self.x_tab) <= 0):
+                raise LabscriptError("table_conversion error: 'table' contains repeated %s values!" % (self.unit))
+            dy = np.diff(self.y_tab)
+            if   np.all(dy > 0): index = slice(None)
+            elif np.all(dy < 0): index = slice(None, None, -1)
+            else:
+                raise LabscriptError("table_conversion error: %s in 'table' must be strictly increasing or decreasing with %s!" % (self.base_unit, self.unit))
+            if np.min(self.y_tab) < default_ao_props['min'] or np.max(self.y_tab) > default_ao_props['max']:
+                raise LabscriptError("table_conversion error: %s in 'table' must be within %f%s and %f%s!" % (self.base_unit, default_ao_props['min'], self.base_unit, default_ao_props['max'], self.base_unit))
+            # table sorted by increasing voltage for inverse conversion
+            self.x_inv = self.x_tab[index]
+            self.y_inv = self.y_tab[index]
+
+            # get optional number of decimals
+            self.decimals = calibration_parameters['decimals'] if 'decimals' in calibration_parameters else default_ao_props['decimals']
+
+            # get optional min/max in user unit. limited by table range.
+            self.min = max(calibration_parameters['min'], self.x_tab[0])  if 'min' in calibration_parameters else self.x_tab[0]
+            self.max = min(calibration_parameters['max'], self.x_tab[-1]) if 'max' in calibration_parameters else self.x_tab[-1]
+            if self.min >= self.max:
+                raise LabscriptError("table_conversion error: 'min' %f must be smaller than 'max' %f!" % (self.min, self.max))
+            V = np.interp([self.min, self.max], self.x_tab, self.y_tab)
+            self.V_min = np.min(V)
+            self.V_max = np.max(V)
+
+            # save table compactly as lists of floats
+            calibration_parameters = calibration_parameters.copy()
+            calibration_parameters['table'] = table.tolist()
+
+        setattr(self, self.unit+'_to_base', self.to_base)
+        setattr(self, self.unit+'_from_base', self.from_base)
+        self.parameters = calibration_parameters
+        UnitConversion.__init__(self, self.parameters)
+
+    @staticmethod
+    def get_limits(calibration_parameters):
+        "static function which returns [V_min, V_max, min, max] for given calibration parameters"
+        tc = table_conversion(calibration_parameters)
+        return [tc.V_min, tc.V_max, tc.min, tc.max]
+
+    def to_base(self, x):
+        "convert unit to Volts. x can be a numpy array"
+        y = np.interp(np.clip(x, self.min, self.max), self.x_tab, self.y_tab)
+        if self.round: y = np.round(y, self.V_decimals)
+        y = np.clip(y, self.V_min, self.V_max)
+        return y if isinstance(x, np.ndarray) else float(y)
+
+    def from_base(self, y):
+        "convert Volts to unit. y can be a numpy array"
+        x = np.interp(np.clip(y, self.V_min, self.V_max), self.y_inv, self.x_inv)
+        if self.round: x = np.round(x, self.decimals)
+        x = np.clip(x, self.min, self.max)
+        return x if isinstance(y, np.ndarray) else float(x)
+
 def secant(func, x0, x1, tol=1e-12, maxiter=50, print_warning=True, return_iter=False):
     """
     secant method to find root of a function func(x) within starting values x=x0 and x=x1.
@@ -10,6 +10,8 @@ from time import sleep
 from time import perf_counter as get_ticks
 from time import process_time as get_ticks2
 import struct
+import json
+from contextlib import contextmanager
 
 from labscript import (
     PseudoclockDevice, Pseudoclock, ClockLine, IntermediateDevice,
@@ -30,8 +32,11 @@ from .shared import (
     PROP_UNIT_V, PROP_UNIT_A, PROP_UNIT_MHZ, PROP_UNIT_DBM, PROP_UNIT_DEGREE,
     DDS_CHANNEL_FREQ, DDS_CHANNEL_AMP, DDS_CHANNEL_PHASE,
     ALWAYS_SHOW, MAX_SHOW, show_data,
-    CRC_CHECK, CRC, BACK_CONVERT,
+    CRC_CHECK, CRC, BACK_CONVERT, back_convert_start, back_convert_stop, back_convert_summary,
+    AUTO_CYCLES,
+    MATRIX_PLAIN, MATRIX_DELTA, MATRIX_CONTIGUOUS, MATRIX_LAYOUT, MATRIX_COMPRESSION, MATRIX_COMPRESSION_OPTS, MATRIX_CHUNK,
     ADD_WORKER, AO_NAME, DO_NAME, DDS_NAME, FPGA_NAME,
+    CLASS_CACHE,
     MAX_FPGA_RATE, MAX_RACKS,
     DATA_BITS, ADDR_BITS, ADDR_SHIFT, ADDR_MAX, ADDR_MASK, ADDR_MASK_SH, DATA_MASK, DATA_ADDR_MASK,
     BIT_NOP, BIT_NOP_SH,
@@ -922,6 +927,190 @@ def from_string(data, level=0):
     else: # unknown
         raise LabscriptError("from_string: '%s' invalid! (2)" % (data))
 
+# version of to_bytes format. 0 = to_string format.
+SERIALIZE_VERSION = 1
+SERIALIZE_HEADER  = '#%i:'
+
+def _to_json(d):
+    "helper function for to_bytes. returns json compatible object with tuples and dict keys preserved."
+    if isinstance(d, dict):
+        if all(isinstance(key, str) for key in d.keys()):
+            return {key: _to_json(value) for key, value in d.items()}
+        return {'%D': [[_to_json(key), _to_json(value)] for key, value in d.items()]}
+    elif isinstance(d, list):
+        return [_to_json(di) for di in d]
+    elif isinstance(d, tuple):
+        return {'%T': [_to_json(di) for di in d]}
+    elif isinstance(d, (np.integer, np.floating, np.bool_)):
+        return d.item()
+    elif (d is None) or isinstance(d, (str, int, float, bool)):
+        return d
+    else:
+        raise LabscriptError('to_bytes: %s has unknown data type %s' % (str(d), str(type(d))))
+
+def _from_json(d):
+    "helper function for from_bytes. inverse of _to_json."
+    if isinstance(d, dict):
+        if len(d) == 1:
+            if '%T' in d: return tuple(_from_json(di) for di in d['%T'])
+            if '%D' in d: return {_from_json(key): _from_json(value) for key, value in d['%D']}
+        return {key: _from_json(value) for key, value in d.items()}
+    elif isinstance(d, list):
+        return [_from_json(di) for di in d]
+    return d
+
+def to_bytes(d):
+    """
+    creates bytes from a python object to be used to save as dataset for hdf5 file.
+    allowed objects are the same as for to_string. numpy scalars are converted to python types.
+    data is json with a header giving the format version. encoding and decoding is linear in size of data.
+    inverse function of from_bytes.
+    """
+    return (SERIALIZE_HEADER % SERIALIZE_VERSION).encode('ascii') + json.dumps(_to_json(d), separators=(',',':')).encode('ascii')
+
+def from_bytes(data):
+    """
+    inverse function of to_bytes. returns reconstructed object.
+    data without header is in to_string format of older files and is converted with from_string.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    if data[:1] != b'#':
+        return from_string(data)
+    i = data.find(b':')
+    if (i < 0) or (int(data[1:i]) != SERIALIZE_VERSION):
+        raise LabscriptError("from_bytes: '%s' unknown format version!" % (data[:i+1]))
+    return _from_json(json.loads(data[i+1:]))
+
+def save_matrix(group, name, data, layout=MATRIX_LAYOUT):
+    """
+    save board matrix data (samples x racks+1) into hdf5 group with given name and layout.
+    for layouts see MATRIX_LAYOUT in shared.py. inverse function of load_matrix.
+    """
+    if (layout == MATRIX_PLAIN) or (len(data) == 0):
+        dset = group.create_dataset(name, compression=config.compression, data=data)
+        dset.attrs['layout'] = MATRIX_PLAIN
+    elif layout == MATRIX_DELTA:
+        sub = group.create_group(name)
+        sub.attrs['layout'] = MATRIX_DELTA
+        sub.attrs['racks'] = data.shape[1] - 1
+        chunks = (min(len(data), MATRIX_CHUNK),)
+        # time is monotonic increasing. deltas are small and repeat often.
+        time = np.empty(shape=(len(data),), dtype=np.uint32)
+        time[0]  = data[0,0]
+        time[1:] = data[1:,0] - data[:-1,0]
+        sub.create_dataset('time', data=time, chunks=chunks, shuffle=True,
+                           compression=MATRIX_COMPRESSION, compression_opts=MATRIX_COMPRESSION_OPTS)
+        for rack in range(data.shape[1] - 1):
+            sub.create_dataset('rack%i' % rack, data=np.ascontiguousarray(data[:,rack+1]), chunks=chunks, shuffle=True,
+                               compression=MATRIX_COMPRESSION, compression_opts=MATRIX_COMPRESSION_OPTS)
+    elif layout == MATRIX_CONTIGUOUS:
+        # without chunks and filters dataset is saved contiguous in file
+        dset = group.create_dataset(name, data=np.ascontiguousarray(data, dtype=np.uint32))
+        dset.attrs['layout'] = MATRIX_CONTIGUOUS
+    else:
+        raise LabscriptError("save_matrix: layout %s unknown!" % (str(layout)))
+
+def load_matrix(group, name, unroll=False, mapped=False):
+    """
+    returns board matrix data (samples x racks+1) from hdf5 group with given name.
+    the layout is detected automatically. inverse function of save_matrix.
+    for MATRIX_CONTIGUOUS data is read directly from the file at the dataset offset without hdf5 overhead.
+    if mapped = True returns a read-only np.memmap of the file without copy. the caller must close it.
+    use open_matrix for this. otherwise the returned array is a copy and no mapping of the file stays open.
+    if unroll = True and data was saved with cycles (see find_cycles) returns data of all cycles.
+    """
+    obj = group[name]
+    if unroll and ('cycles' in obj.attrs):
+        data = load_matrix(group, name)
+        cycles = int(obj.attrs['cycles'])
+        period = np.uint32(obj.attrs['period'])
+        data = np.tile(data, (cycles, 1))
+        data[:,0] += np.repeat(np.arange(cycles, dtype=np.uint32) * period, len(data) // cycles)
+        return data
+    layout = obj.attrs['layout'] if 'layout' in obj.attrs else MATRIX_PLAIN
+    if layout == MATRIX_PLAIN:
+        return obj[:]
+    elif layout == MATRIX_CONTIGUOUS:
+        offset = obj.id.get_offset()
+        if (offset is None) or (len(obj) == 0): # not allocated
+            return obj[:]
+        if mapped:
+            return np.memmap(obj.file.filename, dtype=obj.dtype, mode='r', offset=offset, shape=obj.shape)
+        return np.fromfile(obj.file.filename, dtype=obj.dtype, count=obj.size, offset=offset).reshape(obj.shape)
+    elif layout == MATRIX_DELTA:
+        racks = int(obj.attrs['racks'])
+        time = obj['time'][:]
+        data = np.empty(shape=(len(time), racks + 1), dtype=np.uint32)
+        np.cumsum(time, dtype=np.uint32, out=data[:,0])
+        for rack in range(racks):
+            data[:,rack+1] = obj['rack%i' % rack][:]
+        return data
+    else:
+        raise LabscriptError("load_matrix: '%s' layout %s unknown!" % (name, str(layout)))
+
+@contextmanager
+def open_matrix(group, name):
+    """
+    context manager giving board matrix data (samples x racks+1) from hdf5 group with given name.
+    for MATRIX_CONTIGUOUS data is a read-only np.memmap of the file without copy.
+    the mapping is closed on exit. data and views of it must not be used after exit.
+    for all other layouts data is the same as returned by load_matrix.
+    usage: with open_matrix(group, name) as data: ...
+    """
+    data = load_matrix(group, name, mapped=True)
+    try:
+        yield data
+    finally:
+        # close mapping explicitly. otherwise the file stays mapped until data is garbage collected.
+        if isinstance(data, np.memmap):
+            data._mmap.close()
+
+def find_cycles(data, strobe=False):
+    """
+    find smallest block of samples which is exactly repeated in board matrix data (samples x racks+1).
+    the last sample might be a NOP sample at the start time of the next (not existing) block.
+    strobe = if True strobe bit is toggled for each sample, then the block must have even number of samples.
+    returns [cycles, block] with number of cycles and data of one block including NOP samples needed
+    to keep timing of the next cycle. returns [1, data] if no repetition found.
+    """
+    samples = len(data)
+    if samples >= 3 and np.all((data[-1,1:] & BIT_NOP_SH) != 0):
+        candidates = [samples, samples - 1]
+    else:
+        candidates = [samples]
+    racks = data.shape[1] - 1
+    for num in candidates:
+        # try largest number of cycles first
+        divisors = set()
+        for i in range(1, int(np.sqrt(num)) + 1):
+            if num % i == 0: divisors.update([i, num // i])
+        for cycles in sorted(divisors, reverse=True):
+            if cycles < 2 or cycles == num: continue
+            period = num // cycles
+            if strobe and (period & 1): continue
+            # quick check of first sample of next block before comparing all samples
+            T = np.int64(data[period,0]) - np.int64(data[0,0])
+            if np.any(data[period,1:] != data[0,1:]) or (T <= 0): continue
+            if (num < samples) and (np.int64(data[-1,0]) - np.int64(data[0,0]) != cycles*T): continue
+            blocks = data[:num].reshape((cycles, period, racks+1))
+            if np.any(blocks[:,:,1:] != blocks[0,:,1:]): continue
+            if np.any((blocks[:,:,0].astype(np.int64) - blocks[0,:,0]) != (np.arange(cycles, dtype=np.int64)*T)[:,np.newaxis]): continue
+            # append NOP samples such that board time after last sample = start of next block.
+            for add in range(4):
+                if strobe and ((period + add) & 1): continue
+                last_time = np.int64(data[0,0]) + T - get_board_samples(period + add, 0)[1]
+                if add == 0:
+                    if np.int64(data[period-1,0]) != last_time: continue
+                    return [cycles, np.array(blocks[0])]
+                elif np.int64(data[period-1,0]) < last_time - add + 1:
+                    nop = np.empty(shape=(add, racks+1), dtype=data.dtype)
+                    nop[:,0] = np.arange(last_time - add + 1, last_time + 1)
+                    nop[:,1:] = BIT_NOP_SH
+                    if strobe: nop[:,1:] |= ((np.arange(period, period + add) & 1) * BIT_STRB_SH).astype(data.dtype)[:,np.newaxis]
+                    return [cycles, np.concatenate((blocks[0], nop))]
+    return [1, data]
+
 # PseudoClock
 # accepts only ClockLine as childs
 class FPGA_PseudoClock(Pseudoclock):
@@ -1368,6 +1557,11 @@ class FPGA_board(PseudoclockDevice):
             inputs = default_in_sec
             outputs = default_out_sec
 
+        # collect back conversion of all channels of the shot.
+        # DDS convert instructions already in setfreq/setamp/setphase. the checks are done in generate_code.
+        if BACK_CONVERT and self.is_primary:
+            back_convert_start()
+
         # worker args passed to Worker init
         # werge default worker args with worker args from connection_table. connection_table takes precedence.
         # inputs and outputs are dictionaries themselves, so need to be merged separately
@@ -1527,6 +1721,18 @@ class FPGA_board(PseudoclockDevice):
         return table_mode_channels
 
     def generate_code(self, hdf5_file):
+        """
+        generate data of board and save into hdf5 file. see _generate_code.
+        on error stops collecting back conversion of channels,
+        otherwise the checks of this shot would be kept until the next shot.
+        """
+        try:
+            self._generate_code(hdf5_file)
+        except:
+            if BACK_CONVERT: back_convert_stop()
+            raise
+
+    def _generate_code(self, hdf5_file):
         global total_time
         
         if total_time is None:
@@ -1637,6 +1843,7 @@ class FPGA_board(PseudoclockDevice):
         special_STRB = False
         final_values = {} # final state of each used channel
         crc = {} # dict of CRC for each channel
+        back_converted = {} # dict of back conversion summary for each channel
         for pseudoclock in self.child_devices:
             #print('ps_clock %s:'%pseudoclock.name)
             for clockline in pseudoclock.child_devices:
@@ -1682,6 +1889,9 @@ class FPGA_board(PseudoclockDevice):
 
                             # convert raw data into data word and accumulate with other channels
                             d |= dev.to_words(dev.properties, dev.raw_output)
+                            if BACK_CONVERT:
+                                summary = back_convert_summary(dev.properties)
+                                if summary is not None: back_converted[dev.name] = summary
 
                             if use_prelim_version:
                                 default_value = dev.properties['default_value']
@@ -1763,6 +1973,9 @@ class FPGA_board(PseudoclockDevice):
                                 # convert raw data into data word
                                 d = sub.to_words(sub.properties, sub.raw_output)
                                 # print('%s data:' % sub.name, d)
+                                if BACK_CONVERT:
+                                    summary = back_convert_summary(sub.properties)
+                                    if summary is not None: back_converted[sub.name] = summary
 
                                 if len(d) != len(t):  # sanity check.
                                     raise LabscriptError('generate_code: %s raw output length %i not consistent with %i times? (should not happen)' % (sub.name, len(d), len(times)))
@@ -1974,26 +2187,45 @@ class FPGA_board(PseudoclockDevice):
                 for rack in range(self.num_racks):
                     data[:,rack+1] |= strb
 
+        # detect repetitions and save only one block which is repeated by board
+        cycles = 1
+        if AUTO_CYCLES and self.is_primary and (len(self.secondary_boards) == 0) and (not special_STRB) and (not CRC_CHECK) and \
+           (STR_CYCLES not in self.worker_args) and (STR_CYCLES not in self.worker_args_ex) and \
+           (STR_TRIG_RESTART not in self.worker_args.get(STR_INPUTS, {})) and (STR_TRIG_RESTART not in self.worker_args_ex.get(STR_INPUTS, {})):
+            cycles, block = find_cycles(data, strobe=BIT_STRB_GENERATE)
+            if cycles > 1:
+                save_print("'%s' data repeated %i times: save %i/%i samples and enable cycles." % (self.name, cycles, len(block), len(data)))
+                data = block
+                self.set_cycles(cycles, True)
+
         # save matrix for each board to file
         # TODO: had to add device name also to devices otherwise get error. however now we create board#_devices/board#.
         save_print('generate_code create group', self.name)
         group = hdf5_file['devices'].create_group(self.name)
-        group.create_dataset('%s_matrix' % self.name, compression=config.compression, data=data)
+        save_matrix(group, '%s_matrix' % self.name, data)
+        if cycles > 1: # runviewer needs number of cycles and period in ticks to show all cycles
+            group['%s_matrix' % self.name].attrs['cycles'] = cycles
+            group['%s_matrix' % self.name].attrs['period'] = get_board_samples(len(data), data[-1,0])[1] - data[0,0]
 
         # save final states
         save_print('final values:', final_values)
-        d = to_string(final_values)
-        group.create_dataset('%s_final' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d.encode('ascii', 'ignore'))
+        d = to_bytes(final_values)
+        group.create_dataset('%s_final' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d)
 
         # save CRC if enabled
         if CRC_CHECK:
             save_print('CRC:', crc)
-            d = to_string(crc)
-            group.create_dataset('%s_CRC' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d.encode('ascii', 'ignore'))
+            d = to_bytes(crc)
+            group.create_dataset('%s_CRC' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d)
+
+        # save back conversion summary if enabled
+        if BACK_CONVERT and len(back_converted) > 0:
+            d = to_bytes(back_converted)
+            group.create_dataset('%s_back_convert' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d)
 
         # save extra worker arguments into hdf5. we must convert everything into a string and convert it back in worker.
-        d = to_string(self.worker_args_ex)
-        group.create_dataset('%s_worker_args_ex' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d.encode('ascii', 'ignore'))
+        d = to_bytes(self.worker_args_ex)
+        group.create_dataset('%s_worker_args_ex' % self.name, shape=(1,), dtype='S%i' % (len(d)), data=d)
 
         # TODO: add another group with all used channels. this can be used by runviewer to avoid displaying unused channels.
         #      channels should be already saved somehow in hdf5? so maybe one can add this info for each channel there?
@@ -2229,6 +2461,33 @@ def get_channel_name(type, rack, address, channel):
     elif type == TYPE_DDS: return "dds_%x.%02x_%i" % (rack, address, channel)
     else: return "??_%x.%02x_%i" % (rack, address, channel)
 
+# per-process cache of device and unit conversion classes with key = class path or name, value = class object.
+# import_or_reload and get_unit_conversion_class are slow when called for each channel of many boards.
+# with CLASS_CACHE each class is imported only once per process: restart worker or runviewer to load modified classes.
+_class_cache = {}
+
+def get_device_class(channel, connection):
+    # returns device class object of channel given in channel.properties['device_class'] = module path + class name.
+    # note: channel.device_class is only the class name but we need the path + name for loading the class.
+    path = channel.properties['device_class']
+    if CLASS_CACHE and (path in _class_cache):
+        return _class_cache[path]
+    module_name, _, class_name = path.rpartition('.')
+    if class_name != channel.device_class:
+        raise LabscriptError("%s (%s) class name '%s' != '%s'!" % (channel.name, connection, class_name, channel.device_class))
+    cls = getattr(import_or_reload(module_name), class_name)
+    _class_cache[path] = cls
+    return cls
+
+def get_conversion_class(name):
+    # returns unit conversion class object with given name. see get_device_class.
+    key = ('unit', name)
+    if CLASS_CACHE and (key in _class_cache):
+        return _class_cache[key]
+    cls = get_unit_conversion_class(name)
+    _class_cache[key] = cls
+    return cls
+
 # finds all channels of given IM device
 # IM = intermediate device (Analog/Digital/DDSChannels) connection object
 # returns dictionary with:
@@ -2256,7 +2515,7 @@ def get_channels(IM):
             props = default_ao_props.copy() # Attention: enforce copying otherwise we change default_ao_props!
             if child.unit_conversion_class is not None:
                 # import class. importing/reloading is not working well in python and you might experience problems here.
-                unit_conversion_class = get_unit_conversion_class(child.unit_conversion_class)
+                unit_conversion_class = get_conversion_class(child.unit_conversion_class)
                 unit = child.unit_conversion_params['unit']
                 V_min, V_max, min, max = unit_conversion_class.get_limits(child.unit_conversion_params) # use class to get voltage limits
                 props['min'] = V_min
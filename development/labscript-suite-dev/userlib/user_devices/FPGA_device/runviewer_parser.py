@@ -5,16 +5,14 @@
 # last change 01/07/2024 by Andi
 #####################################################################
 
-import sys
 import numpy as np
 import h5py
 from labscript import LabscriptError
-from labscript_utils import import_or_reload
 from labscript_devices import runviewer_parser
-from labscript_utils.unitconversions import get_unit_conversion_class
 
 from .labscript_device import (
-    get_channels, word_to_time,
+    get_channels, word_to_time, load_matrix,
+    get_device_class, get_conversion_class,
     BIT_NOP_SH, ADDR_MASK_SH, ADDR_SHIFT, DATA_MASK,
     START_TIME,
     get_rack, get_address, get_channel, get_channel_name,
@@ -61,13 +59,7 @@ class FPGA_parser(object):
                     #print('%i channels:'%len(self.ao_list), list(self.ao_list.keys()))
                     self.channels = {}
                     for name, channel in device.child_list.items():
-                        device_class = channel.properties['device_class'].split('.')
-                        module_name = '.'.join(device_class[:-1])
-                        class_name = device_class[-1]
-                        if class_name != channel.device_class:
-                            raise LabscriptError("%s (%s) class name '%s' != '%s'!" % (channel.name, name, class_name, channel.device_class))
-                        import_or_reload(module_name)
-                        channel.cls = getattr(sys.modules[module_name], channel.device_class)
+                        channel.cls = get_device_class(channel, name)
                         self.channels[name] = channel
                 elif device.device_class == 'DigitalChannels':
                     self.type = TYPE_DO
@@ -81,13 +73,7 @@ class FPGA_parser(object):
                     #print('%i channels:' % len(self.dds_list), list(self.dds_list.keys()))
                     self.channels = {}
                     for name, dds in device.child_list.items():
-                        device_class = dds.properties['device_class'].split('.')
-                        module_name = '.'.join(device_class[:-1])
-                        class_name = device_class[-1]
-                        if class_name != dds.device_class:
-                            raise LabscriptError("%s (%s) class name '%s' != '%s'!" % (dds.name, name, class_name, dds.device_class))
-                        import_or_reload(module_name)
-                        dds.cls = getattr(sys.modules[module_name], dds.device_class)
+                        dds.cls = get_device_class(dds, name)
                         self.channels[name] = dds
                 else: # unknown device
                     print("runviewer loading '%s' (ignore)" % (device.name))
@@ -104,7 +90,7 @@ class FPGA_parser(object):
             with h5py.File(self.path, 'r') as f:
                 # get data sent to board
                 group = f['devices/%s' % (self.board.name)]
-                data = group['%s_matrix'%self.board.name][:]
+                data = load_matrix(group, '%s_matrix'%self.board.name, unroll=True)
             if len(data) == 0:
                 print("'%s' add trace (type %d) no data!" % (self.name, self.type))
             else:
@@ -141,14 +127,18 @@ class FPGA_parser(object):
                         #ch = self.device.child_list[name]
                         if ch.unit_conversion_class is not None:
                             # import class. importing/reloading is not working well in python and you might experience problems here!
-                            unit_conversion_class = get_unit_conversion_class(ch.unit_conversion_class)
+                            unit_conversion_class = get_conversion_class(ch.unit_conversion_class)
                             unit = ch.unit_conversion_params['unit']
                             print("'%s' unit conversion class: '%s', unit '%s'" % (name, ch.unit_conversion_class, unit))
                             #for k,v in ch.unit_conversion_params.items():
                             #    print('%s : %s' % (k, v))
                             if runviewer_show_units: # plot in given units
-                                txt = 'unit_conversion_class(calibration_parameters=%s)' % (ch.unit_conversion_params)
-                                unit_conversion = eval(compile(txt, 'conv', 'eval'))
+                                if hasattr(unit_conversion_class, 'get_conversion'):
+                                    # shared object for all channels with the same calibration
+                                    unit_conversion = unit_conversion_class.get_conversion(ch.unit_conversion_params)
+                                else:
+                                    txt = 'unit_conversion_class(calibration_parameters=%s)' % (ch.unit_conversion_params)
+                                    unit_conversion = eval(compile(txt, 'conv', 'eval'))
                                 to_unit = getattr(unit_conversion, unit+'_from_base')
                             #print(to_unit)
                             else: # plot in volts
@@ -258,6 +248,8 @@ class FPGA_parser(object):
                         address = dds.properties['address']
                         channel = dds.properties['channel']
                         ch_name = get_channel_name(TYPE_DDS, rack, address, channel)
+                        # decoded values of all sub-channels when device replays its register file only once
+                        decoded = None
                         for name, sub in dds.child_list.items():
                             addr        = sub.properties['address']
                             sub_channel = sub.properties['sub-channel']
@@ -282,7 +274,16 @@ class FPGA_parser(object):
                                 #show_data(d, info="DDS '%s' (%s, addr 0x%02x) raw data" % (name, ch_name, addr), bus_rate=self.bus_rate)
                                 # convert raw data into time and user value
                                 # time and value might be fewer than raw data!
-                                time, value = dds.cls.from_words(sub.properties, d[:,0]/self.bus_rate, d[:, rack + 1])
+                                if hasattr(dds.cls, 'words_to_values') and (dds.cls.addr_offset is None):
+                                    # all sub-channels share the same address (range): decode all at once.
+                                    if decoded is None:
+                                        decoded = dds.cls.words_to_values(sub.properties, d[:,0]/self.bus_rate, d[:, rack + 1])
+                                    if   sub_channel == DDS_CHANNEL_FREQ : time, value = decoded[0], decoded[1]
+                                    elif sub_channel == DDS_CHANNEL_AMP  : time, value = decoded[0], decoded[2]
+                                    elif sub_channel == DDS_CHANNEL_PHASE: time, value = decoded[0], decoded[3]
+                                    else: raise LabscriptError('%s sub-channel %s unknown!?' % (sub.name, sub_channel))
+                                else:
+                                    time, value = dds.cls.from_words(sub.properties, d[:,0]/self.bus_rate, d[:, rack + 1])
                                 if len(value) == 0:
                                     # from_words returned no data although data with device address available.
                                     # maybe wrong address or addr_mask or a bug in from_words?
@@ -2,6 +2,7 @@
 # shared data for FPGA_device.
 # saves constants, settings and shared functions in a single file and avoids circular imports
 import numpy as np
+from labscript import LabscriptError
 
 # default connection
 PRIMARY_IP   = '192.168.1.130'
@@ -17,6 +18,10 @@ DO_NAME     = 'Digital Outputs'             # GUI button name digital outputs
 DDS_NAME    = 'DDS'                         # GUI button name DDS outputs
 FPGA_NAME   = 'FPGA board'                  # GUI button name FPGA board
 
+# GUI and class loading at startup
+LAZY_WIDGETS    = True                      # if True create channel widgets of a group when group is opened the first time
+CLASS_CACHE     = True                      # if True import device and unit conversion classes only once per process
+
 # FPGA settings
 MAX_FPGA_RATE   = 20e6                      # maximum bus output rate of FPGA in Hz (limited by strobe)
 MAX_RACKS       = 2                         # 2 racks can share one clockline
@@ -36,8 +41,58 @@ DATA_ADDR_MASK  = DATA_MASK|ADDR_MASK_SH    # combined data field + address mask
 ALWAYS_SHOW     = False                     # if true always shows first and last MAX_SHOW/2 data
 MAX_SHOW        = 20                        # maximum number of samples until which data is shown
 
-# for debugging set True to check if back-conversion of DAC/freq/amp/phase tuning word is correct
-BACK_CONVERT = True
+# policy to check if back-conversion of DAC/freq/amp/phase tuning words is correct. see back_convert.
+# BACK_CONVERT_OFF     = no check
+# BACK_CONVERT_FULL    = check all samples in each call of to_words. this doubles conversion time. (True is the same)
+# BACK_CONVERT_SAMPLED = check every BACK_CONVERT_SAMPLE'th sample of each channel,
+#                        or a random fraction of samples if BACK_CONVERT_SAMPLE < 1.
+# BACK_CONVERT_FINAL   = check all samples once per channel in generate_code.
+#                        this includes DDS instructions converted already in setfreq/setamp/setphase.
+#                        outside of compilation (worker) the samples are checked immediately like BACK_CONVERT_FULL.
+# a summary for each checked channel is saved into the shot file as board name + '_back_convert'.
+BACK_CONVERT_OFF     = 0
+BACK_CONVERT_FULL    = 1
+BACK_CONVERT_SAMPLED = 2
+BACK_CONVERT_FINAL   = 3
+BACK_CONVERT         = BACK_CONVERT_FINAL
+BACK_CONVERT_SAMPLE  = 10
+
+# if True DDS with register file (like AnalogDevices_DDS) write only registers which are changed.
+# notes:
+# - a shadow of the register file is kept for each DDS while compiling a shot.
+#   registers not yet written in the shot are unknown and are always written.
+#   therefore, this is independent of reset/init of the hardware and of previous shots.
+# - this requires that for each DDS sub-channel instructions are inserted with increasing time,
+#   otherwise setfreq/setamp/setphase/sweep raise an error.
+#   labscript allows instructions in arbitrary order, therefore this is disabled by default.
+DDS_SHADOW_REGISTERS = False
+
+# if True generate_code detects if the board data is an exact repetition of a block of samples.
+# then only one block is saved and the board repeats it using CTRL_RESTART_EN and STR_CYCLES.
+# notes:
+# - only for a primary board without secondary boards, without restart trigger, with CRC_CHECK disabled
+#   and when number of cycles is not set by user.
+# - the next cycle starts at the board time after the last sample of the block (see get_board_samples).
+#   if needed NOP samples are appended to the block such that the timing is not changed.
+# - requires firmware and driver with working cycling mode. therefore this is disabled by default.
+AUTO_CYCLES = False
+
+# storage layout of board matrix '<board>_matrix' in shot file. see save_matrix and load_matrix.
+# MATRIX_PLAIN = single uint32 dataset (samples x racks+1) compressed with config.compression.
+# MATRIX_DELTA = group with time column saved as deltas ('time') and data of each rack as separate dataset ('rack#').
+#                each dataset uses HDF5 shuffle filter and MATRIX_COMPRESSION in chunks of MATRIX_CHUNK samples.
+# MATRIX_CONTIGUOUS = single uint32 dataset (samples x racks+1) without compression and contiguous in file.
+#                     the worker maps the dataset read-only from the file without copy until upload is finished (see open_matrix).
+#                     use this for local fast disks.
+# reading detects the layout from the 'layout' attribute, files without attribute have MATRIX_PLAIN layout.
+# MATRIX_PLAIN is the default since external analysis code might open '<board>_matrix' as a dataset.
+MATRIX_PLAIN            = 0
+MATRIX_DELTA            = 1
+MATRIX_CONTIGUOUS       = 2
+MATRIX_LAYOUT           = MATRIX_PLAIN
+MATRIX_COMPRESSION      = 'lzf'             # fast compression. use 'gzip' for smaller but slower files.
+MATRIX_COMPRESSION_OPTS = None              # compression options. for gzip 1-9 with 1 fastest.
+MATRIX_CHUNK            = 1<<16             # number of samples per chunk
 
 # device types (used for ID)
 TYPE_board      = 0
@@ -169,7 +224,6 @@ class CRC:
     def test(self):
         # verify code with zlib.crc32
         import zlib
-        from labscript import LabscriptError
         tests = [b'hello-world',b'1234',b'this is a test',b'\x00\x01\x02\x03\x04\x05\x06\x07']
         for t in tests:
             if len(t) % 4 != 0:
@@ -188,6 +242,111 @@ class CRC:
             else:
                 raise LabscriptError("zlib CRC %s = 0x%08x != 0x%08x != 0x%08x (error)" % (t, crc8, crc32, z))
 
+# back conversion checks of channels collected while compiling a shot. see back_convert_start.
+# list of [properties, summary, pending checks] for each channel. None when not collecting.
+_back_convert_channels = None
+
+def back_convert_start():
+    """
+    start collecting back conversion summary of each channel.
+    called when the primary board is created, i.e. before the first instruction of the shot.
+    channels of a previous shot are discarded.
+    only while collecting BACK_CONVERT_FINAL defers the checks until back_convert_summary
+    and BACK_CONVERT_SAMPLED counts samples over all calls of a channel.
+    otherwise, like in the worker, all policies check immediately without summary.
+    """
+    global _back_convert_channels
+    _back_convert_channels = []
+
+def back_convert_stop():
+    "stop collecting back conversion summary. called when generate_code fails. remaining channels are discarded."
+    global _back_convert_channels
+    _back_convert_channels = None
+
+def _back_convert_channel(properties, create=True):
+    # returns [properties, summary, pending] of (sub-)channel with given properties or None when not collecting.
+    # properties are compared by identity since they are not hashable.
+    if _back_convert_channels is None: return None
+    for channel in _back_convert_channels:
+        if channel[0] is properties: return channel
+    if not create: return None
+    channel = [properties, {'policy':BACK_CONVERT, 'samples':0, 'checked':0, 'failed':0, 'error':0.0, 'value':0.0, 'result':0.0}, []]
+    _back_convert_channels.append(channel)
+    return channel
+
+def back_convert(cls, properties, expected, mask, words, inverse, tolerance):
+    """
+    checks back conversion of words according to BACK_CONVERT policy.
+    cls       = class calling this function. used for error messages.
+    properties= (sub-)channel properties given to to_words.
+    expected  = np.array of expected values of inverse, one for each input value.
+    mask      = np.array of bool with True for valid values.
+    words     = np.array of words generated for all values. each value must give the same number of words.
+    inverse   = function(properties, times, words) returning [times, values] for valid words.
+    tolerance = maximum allowed absolute error.
+    raises LabscriptError when any checked value is out of tolerance.
+    with BACK_CONVERT_FINAL the check is done by back_convert_summary while collecting, otherwise immediately.
+    """
+    if (not BACK_CONVERT) or (not np.any(mask)): return
+    channel = _back_convert_channel(properties)
+    summary = None if channel is None else channel[1]
+    if (BACK_CONVERT == BACK_CONVERT_FINAL) and (channel is not None):
+        channel[2].append((cls, expected, mask, words, inverse, tolerance))
+        return
+    if BACK_CONVERT == BACK_CONVERT_SAMPLED:
+        # select samples counting over all calls for this channel
+        # words of each value are consecutive in words
+        count = 0 if summary is None else summary['samples']
+        if BACK_CONVERT_SAMPLE < 1: select = np.random.random(len(expected)) < BACK_CONVERT_SAMPLE
+        else:                       select = ((np.arange(len(expected)) + count) % int(BACK_CONVERT_SAMPLE)) == 0
+        num = len(words) // len(expected)
+        words_select = words.reshape((-1, num))[select].flatten()
+        _back_convert_check(cls, properties, summary, expected[select], mask[select], words_select, inverse, tolerance, len(expected))
+    else:
+        _back_convert_check(cls, properties, summary, expected, mask, words, inverse, tolerance, len(expected))
+
+def _back_convert_check(cls, properties, summary, expected, mask, words, inverse, tolerance, samples):
+    "check back conversion of words and update summary of channel if not None. see back_convert."
+    if summary is not None: summary['samples'] += samples
+    if not np.any(mask): return
+    expected = expected[mask]
+    result   = inverse(properties, np.arange(len(words)), words)[1]
+    if len(result) != len(expected):
+        raise LabscriptError("%s back conversion: %i values converted into %i values!" % (cls.__name__, len(expected), len(result)))
+    errors = np.abs(result - expected)
+    imax   = np.argmax(errors)
+    failed = np.count_nonzero(errors > tolerance)
+    if summary is not None:
+        summary['checked'] += len(expected)
+        summary['failed']  += failed
+        if errors[imax] / tolerance >= summary['error']:
+            summary['error']  = errors[imax] / tolerance
+            summary['value']  = expected[imax]
+            summary['result'] = result[imax]
+    if failed > 0:
+        raise LabscriptError("%s back conversion: %i values out of tolerance! max. error for %f != %f (%.1e > %.1e)" % (cls.__name__, failed, result[imax], expected[imax], errors[imax], tolerance))
+
+def back_convert_summary(properties):
+    """
+    returns summary dictionary of back conversion of the (sub-)channel or None if nothing was checked.
+    with BACK_CONVERT_FINAL all pending samples are checked here.
+    summary is removed, i.e. call this once per channel at the end of generate_code.
+    summary keys:
+    'policy' = BACK_CONVERT, 'samples' = number of converted samples, 'checked' = number of checked samples,
+    'failed' = number of samples out of tolerance, 'error' = largest error / tolerance,
+    'value', 'result' = expected and back-converted value with largest error.
+    """
+    channel = _back_convert_channel(properties, create=False)
+    if channel is None: return None
+    _back_convert_channels.remove(channel)
+    properties, summary, pending = channel
+    if len(pending) > 0:
+        cls, inverse, tolerance = pending[0][0], pending[0][4], pending[0][5]
+        expected = [p[1] for p in pending]
+        _back_convert_check(cls, properties, summary, np.concatenate(expected), np.concatenate([p[2] for p in pending]),
+                            np.concatenate([p[3] for p in pending]), inverse, tolerance, np.sum([len(e) for e in expected]))
+    return summary
+
 def show_data(data, info=None, bus_rate=None):
     if info is not None: print(info)
     if len(data) > MAX_SHOW:
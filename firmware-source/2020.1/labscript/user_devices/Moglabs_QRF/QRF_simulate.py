@@ -0,0 +1,231 @@
+# QRF_simulate.py
+# TCP emulator of Moglabs QRF
+# created 19/10/2026
+# this is only needed when you do not have a QRF and still want to test the software without hardware.
+# in contrast to MOGDevice_sim in blacs_workers.py this emulates the network protocol:
+# commands are parsed and checked, table state per channel is kept and each command takes a configurable latency.
+# use worker_args={'emulate':latency} for QRF to start the emulator within the worker and connect to it,
+# or run this file to benchmark table upload: python -m user_devices.Moglabs_QRF.QRF_simulate [rows] [latency]
+
+import socket
+import socketserver
+import threading
+from time import sleep, perf_counter as get_ticks
+
+from .labscript_devices import (
+    MAX_NUM_CHANNELS, TABLE_MAX_ENTRIES, TABLE_MAX_STRICT, DEFAULT_PORT,
+    F_MAX, A_MIN, A_MAX,
+)
+
+# default latency per command in seconds
+LATENCY         = 0.0
+
+# responds
+RESP_OK         = 'OK'
+RESP_ERR        = 'ERR: %s'
+
+# modes
+EMU_MODE_BASIC  = 'NSB'
+EMU_MODE_TABLE  = 'TSB'
+EMU_MODES       = [EMU_MODE_BASIC, EMU_MODE_TABLE]
+
+# table trigger edges
+EMU_EDGES       = ['RISING', 'FALLING']
+
+CRLF = b'\r\n'
+
+class QRF_channel(object):
+    """state of one emulated QRF channel"""
+    def __init__(self):
+        self.mode    = EMU_MODE_BASIC
+        self.freq    = 0.0      # MHz
+        self.amp     = A_MIN    # dBm
+        self.phase   = 0.0      # degree
+        self.signal  = False
+        self.power   = False
+        self.edge    = EMU_EDGES[0]
+        self.table   = []       # list of (freq, amp, phase, duration)
+        self.entries = 0
+        self.armed   = False
+
+def _number(text, unit=None):
+    # returns number from text with optional unit. raises ValueError on error.
+    text = text.strip()
+    if (unit is not None) and text.lower().endswith(unit.lower()):
+        text = text[:-len(unit)].strip()
+    try:
+        return float(text)
+    except ValueError:
+        return int(text, 0)
+
+class _QRF_handler(socketserver.StreamRequestHandler):
+    """handles one connection: reads CRLF terminated commands and writes one respond per command"""
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        # send each respond immediately like the device
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip().decode(errors='replace')
+            if len(line) == 0: continue
+            self.wfile.write(self.server.execute(line).encode() + CRLF)
+
+class QRF_emulator(socketserver.ThreadingTCPServer):
+    """
+    emulated QRF on host:port. use port=0 to select a free port.
+    latency     = time in seconds each command takes.
+    max_entries = maximum number of table entries per channel. None = no limit.
+                  by default TABLE_MAX_ENTRIES is enforced only when TABLE_MAX_STRICT = True.
+    implements the commands used by QRF_worker:
+    info, version, MODE, FREQ, POW, PHASE, ON, OFF, TABLE CLEAR/EDGE/APPEND/EDIT/ENTRIES/ARM/STOP.
+    """
+    allow_reuse_address = True
+    daemon_threads      = True
+
+    def __init__(self, host='127.0.0.1', port=DEFAULT_PORT, latency=LATENCY, max_entries=TABLE_MAX_ENTRIES if TABLE_MAX_STRICT else None):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), _QRF_handler)
+        self.latency     = latency
+        self.max_entries = max_entries
+        self.lock        = threading.Lock()
+        self.channels    = {}
+        self.thread      = None
+        self.reset()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def reset(self):
+        # reset all channels and counters
+        with self.lock:
+            self.channels = {i: QRF_channel() for i in range(1, MAX_NUM_CHANNELS + 1)}
+            self.count    = 0
+            self.errors   = 0
+
+    def start(self):
+        # run server in background thread. returns port.
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread = None
+
+    def execute(self, line):
+        # execute single command line and return respond
+        if self.latency > 0: sleep(self.latency)
+        with self.lock:
+            self.count += 1
+            try:
+                return self._execute([t.strip() for t in line.split(',')])
+            except (ValueError, IndexError) as e:
+                self.errors += 1
+                return RESP_ERR % ('invalid command %s (%s)' % (repr(line), str(e)))
+
+    def _channel(self, text):
+        channel = int(text)
+        if channel not in self.channels:
+            raise ValueError('channel %i not in range 1..%i' % (channel, MAX_NUM_CHANNELS))
+        return self.channels[channel]
+
+    def _row(self, tokens):
+        # returns table row (freq, amp, phase, duration) from tokens
+        freq, amp, phase, duration = _number(tokens[0], 'MHz'), _number(tokens[1], 'dBm'), _number(tokens[2], 'deg'), int(_number(tokens[3]))
+        if (freq < 0) or (freq > F_MAX): raise ValueError('frequency %f MHz out of range' % freq)
+        if amp > A_MAX:                  raise ValueError('amplitude %f dBm out of range' % amp)
+        if duration < 0:                 raise ValueError('duration %i negative' % duration)
+        return (freq, amp, phase, duration)
+
+    def _error(self, msg):
+        self.errors += 1
+        return RESP_ERR % msg
+
+    def _execute(self, tokens):
+        cmd = tokens[0].upper()
+        if cmd == 'INFO':
+            return 'QRF emulator, %i channels' % (len(self.channels))
+        elif cmd == 'VERSION':
+            return 'UC: emulator'
+        elif cmd == 'MODE':
+            ch = self._channel(tokens[1])
+            if len(tokens) == 2: return ch.mode
+            mode = tokens[2].upper()
+            if mode not in EMU_MODES: return self._error('mode %s not supported' % tokens[2])
+            ch.mode  = mode
+            ch.armed = False
+            return RESP_OK
+        elif cmd in ['FREQ', 'POW', 'PHASE']:
+            ch = self._channel(tokens[1])
+            attr, unit = {'FREQ': ('freq', 'MHz'), 'POW': ('amp', 'dBm'), 'PHASE': ('phase', 'deg')}[cmd]
+            if len(tokens) == 2: return '%f %s' % (getattr(ch, attr), unit)
+            value = _number(tokens[2], unit)
+            if (cmd == 'FREQ') and ((value < 0) or (value > F_MAX)): return self._error('frequency %f MHz out of range' % value)
+            if (cmd == 'POW') and (value > A_MAX):                    return self._error('amplitude %f dBm out of range' % value)
+            setattr(ch, attr, value)
+            return RESP_OK
+        elif cmd in ['ON', 'OFF']:
+            ch = self._channel(tokens[1])
+            what = tokens[2].upper() if len(tokens) > 2 else 'ALL'
+            if what not in ['ALL', 'SIG', 'POW']: return self._error('%s %s not supported' % (cmd, tokens[2]))
+            if what in ['ALL', 'SIG']: ch.signal = (cmd == 'ON')
+            if what in ['ALL', 'POW']: ch.power  = (cmd == 'ON')
+            return RESP_OK
+        elif cmd == 'TABLE':
+            sub = tokens[1].upper()
+            ch = self._channel(tokens[2])
+            if sub == 'CLEAR':
+                ch.table   = []
+                ch.entries = 0
+                ch.armed   = False
+            elif sub == 'EDGE':
+                edge = tokens[3].upper()
+                if edge not in EMU_EDGES: return self._error('edge %s not supported' % tokens[3])
+                ch.edge = edge
+            elif sub == 'APPEND':
+                if (self.max_entries is not None) and (len(ch.table) >= self.max_entries): return self._error('table full (%i entries)' % self.max_entries)
+                ch.table.append(self._row(tokens[3:]))
+            elif sub == 'EDIT':
+                row = int(tokens[3])
+                if (row < 1) or (row > len(ch.table)): return self._error('table row %i not in range 1..%i' % (row, len(ch.table)))
+                ch.table[row-1] = self._row(tokens[4:])
+            elif sub == 'ENTRIES':
+                if len(tokens) == 3: return '%i' % ch.entries
+                entries = int(tokens[3])
+                if (entries < 1) or (entries > len(ch.table)): return self._error('table entries %i not in range 1..%i' % (entries, len(ch.table)))
+                ch.entries = entries
+            elif sub == 'ARM':
+                if ch.mode != EMU_MODE_TABLE: return self._error('channel not in table mode')
+                if ch.entries == 0:           return self._error('table empty')
+                ch.armed = True
+            elif sub == 'STOP':
+                ch.armed = False
+            else:
+                return self._error('TABLE,%s not supported' % tokens[1])
+            return RESP_OK
+        return self._error('command %s not defined' % tokens[0])
+
+if __name__ == '__main__':
+    # benchmark table upload with single commands and pipelined batches
+    # note: this module uses relative imports. run it as module from labscript folder:
+    #       python -m user_devices.Moglabs_QRF.QRF_simulate [rows] [latency]
+    #       running the file directly gives ImportError. see also test_emulator.py.
+    import sys
+    from .mogdevice import MOGDevice
+    rows    = int(sys.argv[1])   if len(sys.argv) > 1 else 2000
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    emulator = QRF_emulator(port=0, latency=latency)
+    emulator.start()
+    dev = MOGDevice('127.0.0.1', emulator.port)
+    print(dev.info)
+    cmds = ['TABLE,APPEND,1,%i,%.3f,%.3f,%i' % (10 + i % 100, 0.0, 0.0, 1) for i in range(rows)]
+    for name, upload in [('single', lambda: [dev.cmd(cmd) for cmd in cmds]), ('batch', lambda: dev.cmd_batch(cmds))]:
+        dev.cmd('TABLE,CLEAR,1')
+        t_start = get_ticks()
+        upload()
+        print('%-6s: %i rows %.3f ms' % (name, rows, (get_ticks() - t_start) * 1e3))
+    print('%i commands, %i errors' % (emulator.count, emulator.errors))
+    dev.close()
+    emulator.stop()
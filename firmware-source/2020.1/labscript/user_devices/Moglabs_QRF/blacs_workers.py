@@ -15,7 +15,7 @@ from labscript import LabscriptError
 from user_devices.iPCdev.labscript_devices import (
     iPCdev,
     DEVICE_HARDWARE_INFO, DEVICE_INFO_TYPE, DEVICE_INFO_ADDRESS, DEVICE_INFO_CHANNEL, DEVICE_INFO_PATH,
-    DEVICE_DATA_DDS, DEVICE_TIME,
+    DEVICE_DATA_DDS, DEVICE_TIME, load_times,
     HARDWARE_TYPE, HARDWARE_TYPE_DDS,
 )
 from user_devices.iPCdev.blacs_tabs import (
@@ -34,6 +34,15 @@ from .labscript_devices import (
 # scale DDS channel analog values from hd5 file to displayed values of channels
 DDS_CHANNEL_SCALING = {DDS_CHANNEL_PROP_FREQ: 1e-6, DDS_CHANNEL_PROP_AMP: 1.0, DDS_CHANNEL_PROP_PHASE: 1.0}
 
+# if number of changed table rows is less or equal TABLE_EDIT_MAX times the number of rows,
+# only the changed rows are edited, otherwise the entire table is uploaded. 0 = always upload entire table.
+# when no row has changed nothing is uploaded and the table is only re-armed.
+TABLE_EDIT_MAX      = 0.25
+
+# optional worker_args: latency in seconds per command of QRF_simulate.QRF_emulator.
+# when given the worker starts the emulator and connects to it via TCP instead of the device.
+ARG_EMULATE         = 'emulate'
+
 # display status information only every UPDATE_TIME seconds
 UPDATE_TIME         = 1.0
 
@@ -56,12 +65,35 @@ MOGCMD_PWR_ON               = 'ON,%i,POW'
 MOGCMD_PWR_OFF              = 'OFF,%i,POW'
 MOGCMD_TABLE_CLEAR          = 'TABLE,CLEAR,%i'
 MOGCMD_TABLE_EDGE_RISING    = 'TABLE,EDGE,%i,RISING'
-MOGCMD_TABLE_APPEND         = 'TABLE,APPEND,%i,%i,%.3f,%.3f,%i'
-MOGCMD_TABLE_APPEND_OFF     = 'TABLE,APPEND,%i,10,0x0,0,%i'
+MOGCMD_TABLE_APPEND         = 'TABLE,APPEND,%i,%s'              # channel, row
+MOGCMD_TABLE_EDIT           = 'TABLE,EDIT,%i,%i,%s'             # channel, row index (1-based), row
+MOGCMD_TABLE_ROW            = '%i,%.3f,%.3f,%i'                 # frequency, amplitude, phase, duration in units of RESOLUTION_TABLE_MODE
+MOGCMD_TABLE_ROW_OFF        = '10,0x0,0,%i'                     # duration in units of RESOLUTION_TABLE_MODE
 MOGCMD_TABLE_ENTRIES        = 'TABLE,ENTRIES,%i,%i'
 MOGCMD_TABLE_ARM            = 'TABLE,ARM,%i'
 MOGCMD_TABLE_STOP           = 'TABLE,STOP,%i'
 
+def get_table_rows(data, times=None):
+    """
+    returns list of MOGCMD_TABLE_ROW strings for table data of one channel and last row switching RF off.
+    data  = dictionary with frequency, amplitude and phase arrays.
+    times = times in seconds for timed table mode or None for triggered table mode.
+    in timed table mode the duration of each row is the time until the next row.
+    this is needed since compact_data merges entries without changes into the previous row.
+    in triggered table mode the duration is 0 and the next row is output on the next trigger.
+    """
+    freq  = data[DDS_CHANNEL_PROP_FREQ]
+    amp   = data[DDS_CHANNEL_PROP_AMP]
+    phase = data[DDS_CHANNEL_PROP_PHASE]
+    if times is None:
+        rows = [MOGCMD_TABLE_ROW % (freq[i], amp[i], phase[i], 0) for i in range(len(freq)-1)]
+        rows.append(MOGCMD_TABLE_ROW_OFF % (0))
+    else:
+        durations = np.round(np.diff(times)/RESOLUTION_TABLE_MODE).astype(np.int64)
+        rows = [MOGCMD_TABLE_ROW % (freq[i], amp[i], phase[i], durations[i]) for i in range(len(times)-1)]
+        rows.append(MOGCMD_TABLE_ROW_OFF % (1))
+    return rows
+
 class MOGDevice_sim(object):
     """
     simulated MOGdevice.
@@ -74,6 +106,8 @@ class MOGDevice_sim(object):
     def ask(self, cmd):
         if cmd == 'info': return 'MOGdevice (simulated)'
         else: raise LabscriptError('MOGdevice ask %s not implemented in simulation!' % (cmd))
+    def cmd_batch(self, cmds):
+        return [MOGCMD_OK]*len(cmds)
     def flush(self):
         return MOGCMD_OK
     def close(self):
@@ -84,8 +118,13 @@ class QRF_worker(iPCdev_worker):
         global zTimeoutError; from zprocess.utils import TimeoutError as zTimeoutError
         global get_ticks; from time import perf_counter as get_ticks
 
-        # if address is None simulate device
-        if self.addr is None:
+        # start emulator on free port when requested
+        self.emulator = None
+        self.emulate  = self.properties['worker_args'].get(ARG_EMULATE, None)
+        if self.emulate is True: self.emulate = 0.0
+
+        # if address is None and device is not emulated simulate device
+        if (self.addr is None) and (self.emulate is None):
             self.properties['worker_args'].update({'simulate':True})
 
         super(QRF_worker, self).init()
@@ -113,12 +152,14 @@ class QRF_worker(iPCdev_worker):
 
 
         # last experiment data
-        self.file_id        = id
         self.exp_time       = 0.0
         self.table_basic    = {}
         self.table_timed    = {}
         self.table_trig     = {}
 
+        # shadow of tables in device with key = channel index, value = list of rows
+        self.table_shadow   = {}
+
         # board status after experiment
         self.board_status   = {}
 
@@ -147,13 +188,24 @@ class QRF_worker(iPCdev_worker):
         else:
             # TODO: not tested so far
             try:
-                from mogdevice import MOGDevice
-                self.dev = MOGDevice(self.addr, self.port)
+                from .mogdevice import MOGDevice
+                if self.emulate is not None:
+                    if self.emulator is None:
+                        from .QRF_simulate import QRF_emulator
+                        self.emulator = QRF_emulator(port=0, latency=self.emulate)
+                        self.emulator.start()
+                        print("%s: emulator port %i, latency %.3f ms" % (self.device_name, self.emulator.port, self.emulate*1e3))
+                    self.dev = MOGDevice('127.0.0.1', self.emulator.port)
+                else:
+                    self.dev = MOGDevice(self.addr, self.port)
             except Exception: # on Linux gives OSError, on Windows dont know
                 self.dev = None
                 #print('%s: no connection.' % (name))
                 return False
             self.dev.flush()
+            # device might have been restarted: force reprogramming of entire tables
+            self.cache_key = None
+            self.table_shadow = {}
             return True
 
     # switch RF signal on/off. returns True if ok, False on error.
@@ -195,6 +247,52 @@ class QRF_worker(iPCdev_worker):
         print(info + ' failed!')
         return False
 
+    def upload_table(self, channel_index, cmds, rows):
+        """
+        send table commands for given channel index.
+        rows = list with table row index for each command or None for commands not related to a row.
+        all commands are sent pipelined with MOGDevice.cmd_batch which avoids a round trip per command.
+        on error raises LabscriptError with the failing table row.
+        note: mogdevice.BatchError is derived from RuntimeError. we do not import it here since mogdevice is imported only when connecting.
+        """
+        try:
+            self.dev.cmd_batch(cmds)
+        except RuntimeError as E:
+            if not hasattr(E, 'index'): raise
+            if rows[E.index] is not None:
+                raise LabscriptError("'%s' channel %i: table row %i '%s' error: %s" % (self.device_name, channel_index, rows[E.index], E.cmd, E.resp))
+            else:
+                raise LabscriptError("'%s' channel %i: table command '%s' error: %s" % (self.device_name, channel_index, E.cmd, E.resp))
+
+    def program_table(self, channel_index, rows):
+        """
+        program table for given channel index. rows = list of MOGCMD_TABLE_ROW strings.
+        if the shadow of the table in device has the same number of rows and only few rows have changed,
+        only the changed rows are edited. otherwise the entire table is cleared and uploaded.
+        when no row has changed nothing is sent and the caller only re-arms the table.
+        on error the shadow is deleted and the entire table is uploaded.
+        """
+        shadow = self.table_shadow.pop(channel_index, None)
+        if (shadow is not None) and (len(shadow) == len(rows)):
+            changed = [i for i in range(len(rows)) if rows[i] != shadow[i]]
+            if len(changed) == 0:
+                self.table_shadow[channel_index] = shadow
+                return
+            elif len(changed) <= TABLE_EDIT_MAX*len(rows):
+                try:
+                    self.upload_table(channel_index, [MOGCMD_TABLE_EDIT % (channel_index, i+1, rows[i]) for i in changed], changed)
+                    self.table_shadow[channel_index] = rows
+                    print("'%s' channel %i: %i/%i table rows changed" % (self.device_name, channel_index, len(changed), len(rows)))
+                    return
+                except LabscriptError as E:
+                    print("'%s' channel %i: edit table failed (upload entire table)\n%s" % (self.device_name, channel_index, str(E)))
+        # clear table, set trigger edge rising, upload rows and set number of entries
+        cmds = [MOGCMD_TABLE_CLEAR % channel_index, MOGCMD_TABLE_EDGE_RISING % channel_index] + \
+               [MOGCMD_TABLE_APPEND % (channel_index, row) for row in rows] + \
+               [MOGCMD_TABLE_ENTRIES % (channel_index, len(rows))]
+        self.upload_table(channel_index, cmds, [None, None] + list(range(len(rows))) + [None])
+        self.table_shadow[channel_index] = rows
+
     def check_remote_values(self):
         # called by labscript when supports_remote_value_check(True)
         # return dictionary of actual value for each channel (connection, not name)
@@ -246,64 +344,78 @@ class QRF_worker(iPCdev_worker):
 
         return front_panel_values
 
+    def parse_tables(self, f):
+        """
+        returns parsed tables from open h5 file f. called by load_tables when tables are not in cache.
+        returns (exp_time, final_values, table_basic, table_timed, table_trig)
+        """
+        exp_time    = 0.0
+        final_values= {}
+        table_basic = {}
+        table_timed = {}
+        table_trig  = {}
+        # load data tables for all DDS channels. shared times are loaded only once.
+        times_cache = {}
+        for connection, device in self.channels.items():
+            hardware_info = device.properties[DEVICE_HARDWARE_INFO]
+            channel_index = hardware_info[DEVICE_INFO_CHANNEL]
+            mode_name = device.properties[DDS_CHANNEL_PROP_MODE]
+            mode = MODES[mode_name]
+            group = f[hardware_info[DEVICE_INFO_PATH]]
+            times = load_times(group, times_cache)
+            if times[-1] > exp_time: exp_time = times[-1]
+            print('%s (%s): %i times' % (device.name, mode_name, len(times)))
+            final = {}
+            dds_data  = {}
+            for channel in device.child_list.values():
+                dataset = DEVICE_DATA_DDS % (device.name, hardware_info[DEVICE_INFO_ADDRESS], channel.parent_port)
+                data = group[dataset][()]
+                if data is None:
+                    raise LabscriptError("device %s: dataset %s not existing!" % (channel.name, dataset))
+                if mode == MODE_BASIC:
+                    if (len(times) > 2) or (len(data) > 2): # basic mode allows only programming once!
+                        raise LabscriptError('%s in mode %s cannot be programmed during runtime!' % (device.name, mode_name))
+                elif (len(times) != len(data)):
+                    raise LabscriptError("device %s: %i times but %i data!" % (channel.name, len(times), len(data)))
+                channel_data = iPCdev.extract_channel_data(hardware_info, data)
+                scaling = DDS_CHANNEL_SCALING[channel.parent_port]
+                dds_data[channel.parent_port] = channel_data * scaling
+                final[channel.parent_port]    = channel_data[-1] * scaling
+            final_values[connection] = final
+            # save data and times for each channel
+            # the channels indices are 1..4
+            if mode == MODE_BASIC:
+                table_basic[channel_index] = dds_data
+            elif mode == MODE_TABLE_TIMED:
+                table_timed[channel_index] = (times, dds_data)
+            elif mode == MODE_TABLE_TIMED_SW:
+                table_timed[channel_index] = (times, dds_data)
+            elif mode == MODE_TABLE_TRIGGERED:
+                table_trig[channel_index] = dds_data
+            else:
+                raise LabscriptError("dds '%s' channel %i mode '%s' unknown!" % (self.device_name, channel_index, mode_name))
+
+        return (exp_time, final_values, table_basic, table_timed, table_trig)
+
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
 
-        # load data from h5 file when needed
-        # file id is used to check if file has been changed (update = True) or not (update = False)
-        update = fresh
-        with h5py.File(h5file,'r') as f:
-            id = f.attrs['sequence_id'] + ('_%i' % f.attrs['sequence_index']) + ('_%i' % f.attrs['run number'])
-            if update or (self.file_id is None) or (self.file_id != id):
-                # new file
-                update              = True
-                self.file_id        = id
-                self.exp_time       = 0.0
-                self.final_values   = {}
-                self.table_basic    = {}
-                self.table_timed    = {}
-                self.table_trig     = {}
-
-                # load data tables for all DDS channels
-                for connection, device in self.channels.items():
-                    hardware_info = device.properties[DEVICE_HARDWARE_INFO]
-                    channel_index = hardware_info[DEVICE_INFO_CHANNEL]
-                    mode_name = device.properties[DDS_CHANNEL_PROP_MODE]
-                    mode = MODES[mode_name]
-                    group = f[hardware_info[DEVICE_INFO_PATH]]
-                    times = group[DEVICE_TIME][()]
-                    if times[-1] > self.exp_time: self.exp_time = times[-1]
-                    print('%s (%s): %i times' % (device.name, mode_name, len(times)))
-                    final = {}
-                    dds_data  = {}
-                    for channel in device.child_list.values():
-                        dataset = DEVICE_DATA_DDS % (device.name, hardware_info[DEVICE_INFO_ADDRESS], channel.parent_port)
-                        data = group[dataset][()]
-                        if data is None:
-                            raise LabscriptError("device %s: dataset %s not existing!" % (channel.name, dataset))
-                        if mode == MODE_BASIC:
-                            if (len(times) > 2) or (len(data) > 2): # basic mode allows only programming once!
-                                raise LabscriptError('%s in mode %s cannot be programmed during runtime!' % (device.name, mode_name))
-                        elif (len(times) != len(data)):
-                            raise LabscriptError("device %s: %i times but %i data!" % (channel.name, len(times), len(data)))
-                        channel_data = iPCdev.extract_channel_data(hardware_info, data)
-                        scaling = DDS_CHANNEL_SCALING[channel.parent_port]
-                        dds_data[channel.parent_port] = channel_data * scaling
-                        final[channel.parent_port]    = channel_data[-1] * scaling
-                    self.final_values[connection] = final
-                    # save data and times for each channel
-                    # the channels indices are 1..4
-                    if mode == MODE_BASIC:
-                        self.table_basic[channel_index] = dds_data
-                    elif mode == MODE_TABLE_TIMED:
-                        self.table_timed[channel_index] = (times, dds_data)
-                    elif mode == MODE_TABLE_TIMED_SW:
-                        self.table_timed[channel_index] = (times, dds_data)
-                    elif mode == MODE_TABLE_TRIGGERED:
-                        self.table_trig[channel_index] = dds_data
-                    else:
-                        raise LabscriptError("dds '%s' channel %i mode '%s' unknown!" % (device_name, channel_index, mode_name))
+        self.timing.start()
+        self.h5file = h5file
+
+        # if we are not connected try to connect. return on failure.
+        # this is done before loading tables since connect forces reprogramming of tables.
+        if (not self.simulate) and (self.dev is None) and (not self.connect('check_remote_values')):
+            return None # error
+        self.timing.mark('config')
 
-                print('final values:', self.final_values)
+        # load tables from file or from cache. update = False when tables have not changed.
+        with h5py.File(h5file,'r') as f:
+            (tables, update) = self.load_tables(f, fresh)
+        self.timing.mark('read')
+        (self.exp_time, final_values, self.table_basic, self.table_timed, self.table_trig) = tables
+        # final values are shared with cache
+        self.final_values = final_values.copy()
+        if update: print('final values:', self.final_values)
 
         # experiment time
         if   self.exp_time >= 1.0:  tm = '%.3f s'  % (self.exp_time)
@@ -324,10 +436,6 @@ class QRF_worker(iPCdev_worker):
         else:
             print('\n%s start experiment. %s, duration %s %s' % (self.device_name, ch_info, tm, '(old file)' if not update else '(new file)'))
 
-        # if we are not connected try to connect. return on failure.
-        if (not self.simulate) and (self.dev is None) and (not self.connect('check_remote_values')):
-            return None # error
-
         # program basic mode channels immediately and switch RF on
         for channel_index, data in self.table_basic.items():
             self.dev.cmd(MOGCMD_MODE_BASIC % channel_index)
@@ -335,40 +443,27 @@ class QRF_worker(iPCdev_worker):
             self.dev.cmd(MOGCMD_SET_AMP   % (channel_index, data[DDS_CHANNEL_PROP_AMP][0]))
             self.dev.cmd(MOGCMD_SET_PHASE % (channel_index, data[DDS_CHANNEL_PROP_PHASE][0]))
             self.dev.cmd(MOGCMD_ALL_ON % channel_index)
+        self.timing.mark('config')
 
         # table mode with internal timing
+        # when tables have not changed they are still in the device and we only re-arm them.
         for channel_index, (times, data) in self.table_timed.items():
             self.dev.cmd(MOGCMD_MODE_TABLE % channel_index)
-            self.dev.cmd(MOGCMD_TABLE_CLEAR % channel_index)
-            self.dev.cmd(MOGCMD_TABLE_EDGE_RISING % channel_index)  # set trigger edge rising
-            freq  = data[DDS_CHANNEL_PROP_FREQ]
-            amp   = data[DDS_CHANNEL_PROP_AMP]
-            phase = data[DDS_CHANNEL_PROP_PHASE]
-            for i in range(len(times)-1):
-                self.dev.cmd(MOGCMD_TABLE_APPEND % (channel_index, freq[i], amp[i], phase[i], int(times[i]/RESOLUTION_TABLE_MODE)))
-            # switch off at end of table
-            self.dev.cmd(MOGCMD_TABLE_APPEND_OFF % (channel_index, int(times[-1]/RESOLUTION_TABLE_MODE)+1))
-            # set number of entries and arm table
-            self.dev.cmd(MOGCMD_TABLE_ENTRIES % (channel_index,len(times)))
+            if update:
+                self.program_table(channel_index, get_table_rows(data, times))
+            # arm table
             self.dev.cmd(MOGCMD_TABLE_ARM % channel_index)
             self.dev.cmd(MOGCMD_ALL_ON % channel_index)
 
         # table mode with external trigger
-        for channel, data in self.table_trig.items():
-            self.dev.cmd(MOGCMD_MODE_TABLE)
-            self.dev.cmd(MOGCMD_TABLE_CLEAR % channel_index)
-            self.dev.cmd(MOGCMD_TABLE_EDGE_RISING % channel_index)  # set trigger edge rising
-            freq  = data[DDS_CHANNEL_PROP_FREQ]
-            amp   = data[DDS_CHANNEL_PROP_AMP]
-            phase = data[DDS_CHANNEL_PROP_PHASE]
-            for i in range(len(times)-1):
-                self.dev.cmd(MOGCMD_TABLE_APPEND % (channel_index, freq[i], amp[i], phase[i], 0))
-            # switch off at end of table
-            self.dev.cmd(MOGCMD_TABLE_APPEND_OFF % (channel_index, 0))
-            # set number of entries and arm table
-            self.dev.cmd(MOGCMD_TABLE_ENTRIES % (channel_index, len(data)))
+        for channel_index, data in self.table_trig.items():
+            self.dev.cmd(MOGCMD_MODE_TABLE % channel_index)
+            if update:
+                self.program_table(channel_index, get_table_rows(data))
+            # arm table
             self.dev.cmd(MOGCMD_TABLE_ARM % channel_index)
             self.dev.cmd(MOGCMD_ALL_ON % channel_index)
+        self.timing.mark('upload')
 
         if self.sync:
             # synchronize boards and get experiment time for all of them
@@ -389,6 +484,7 @@ class QRF_worker(iPCdev_worker):
                     print("\ntimeout %ssync with all boards! (%.3fms, abort)\n" % (tmp, duration))
                     return None
                 count += 1
+            self.timing.mark('wait', self.arrival)
             print('board times (%.3fms):'%duration, board_times)
 
             if True:
@@ -401,6 +497,7 @@ class QRF_worker(iPCdev_worker):
         # save starting time and last update time such that first status_monitor prints status immediately
         self.t_start = get_ticks()
         self.t_last  = -2*self.update_time
+        self.timing.mark('start')
 
         return self.final_values
 
@@ -414,6 +511,9 @@ class QRF_worker(iPCdev_worker):
             # on abort manually program final values
             print('transition to manual (abort)')
             self.program_manual(self.final_values)
+            # tables might be only partially programmed
+            self.cache_key = None
+            self.table_shadow = {}
         else:
             if self.sync:
                 # get status (error) of all boards
@@ -427,6 +527,8 @@ class QRF_worker(iPCdev_worker):
                     print("\ntimeout %sget status of all boards! (%.3fms)\n" % (tmp, duration))
                     return True
 
+        self.timing_done(save=not abort)
+
         # return True to indicate we successfully transitioned back to manual mode
         # we do this even on error to avoid ugly error in GUI and force user to restart board.
         # the error code is transmitted with status_monitor status_end=True after this function returns.
@@ -445,11 +547,13 @@ class QRF_worker(iPCdev_worker):
         """
         end = False
         run_time = get_ticks() - self.t_start
+        self.timing.since_run('status')
         if self.simulate:
             end = (run_time >= self.exp_time)
         else:
             # TODO: can we read out status in timed mode?
             end = (run_time >= self.exp_time)
+        if end: self.timing.since_run('end')
 
         if end:
             if status_end:
@@ -473,5 +577,8 @@ class QRF_worker(iPCdev_worker):
             for i in range(1, MAX_NUM_CHANNELS + 1):
                 self.dev.cmd(MOGCMD_ALL_OFF % i)
             self.dev.close()
+        if self.emulator is not None:
+            self.emulator.stop()
+            self.emulator = None
         print(self.device_name,'shutdown')
         sleep(1.0)
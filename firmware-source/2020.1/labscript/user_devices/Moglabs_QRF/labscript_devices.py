@@ -54,6 +54,14 @@ P_DEC    = 3     # TODO: find out what the phase precision is!
 # timing
 RESOLUTION_TABLE_MODE   = 5e-6
 
+# maximum number of table entries per channel including last entry which switches RF off.
+# exceeding it gives an error. the limit is not confirmed with the device: if TABLE_MAX_STRICT = False exceeding it gives only a warning.
+TABLE_MAX_ENTRIES       = 8191
+TABLE_MAX_STRICT        = True
+
+# if True in timed table modes entries with same frequency, amplitude and phase as the previous entry are removed.
+TABLE_COMPACT           = True
+
 # default IP port
 DEFAULT_PORT = 7802
 
@@ -393,6 +401,36 @@ class QRF(iPCdev):
         else:
             raise LabscriptError("device '%s', type '%s' added to '%s' but only QRF_DDS are allowed!" % (device.name, type(device), self.name))
 
+    def compact_data(self, IM, times):
+        """
+        custom implementation of iPCdev.compact_data. for details see there.
+        in timed table modes entries with the same frequency, amplitude and phase as the previous entry are removed,
+        i.e. the previous entry lasts until the next change. first and last times are kept.
+        in all table modes checks that the table fits into the device.
+        returns times for the IM device.
+        """
+        channels = [dev for dev in IM.child_devices if isinstance(dev, DDS) and (MODES[dev.mode_name] != MODE_BASIC)]
+        if len(channels) == 0:
+            return times
+        entries = len(times)
+        if TABLE_COMPACT and (entries > 2) and all([MODES[dev.mode_name] in [MODE_TABLE_TIMED, MODE_TABLE_TIMED_SW] for dev in channels]):
+            # keep entries where any value of any channel changes
+            keep = np.ones(entries, dtype=bool)
+            keep[1:-1] = np.any([sub.raw_output[1:-1] != sub.raw_output[:-2] for dev in channels for sub in dev.child_devices], axis=0)
+            if not np.all(keep):
+                times = np.asarray(times)[keep]
+                for dev in channels:
+                    for sub in dev.child_devices:
+                        sub.raw_output = sub.raw_output[keep]
+                print("'%s' table compacted from %i to %i entries" % (IM.name, entries, len(times)))
+        if len(times) > TABLE_MAX_ENTRIES:
+            msg = "%s in mode '%s' needs %i table entries (%i before compaction) but the device allows only %i!\nreduce the number of changes of frequency, amplitude or phase." % (
+                ', '.join(["'%s' channel %i" % (dev.name, dev.hardware_info[DEVICE_INFO_CHANNEL]) for dev in channels]),
+                channels[0].mode_name, len(times), entries, TABLE_MAX_ENTRIES)
+            if TABLE_MAX_STRICT: raise LabscriptError(msg)
+            else:                print('warning: ' + msg)
+        return times
+
     def split_connection(self, channel):
         """
         custom implementation from iPCdev class. for details see there.
@@ -20,6 +20,17 @@ from collections import OrderedDict
 import six
 CRLF = b'\r\n'
 
+# default number of commands sent at once by cmd_batch before responses are read
+BATCH_WINDOW = 256
+
+class BatchError(RuntimeError):
+    """Error response of a command sent with cmd_batch. index = index of failing command"""
+    def __init__(self, index, cmd, resp):
+        RuntimeError.__init__(self, 'command %i %s: %s' % (index, repr(cmd), resp))
+        self.index = index
+        self.cmd   = cmd
+        self.resp  = resp
+
 # Handles communication with devices
 class MOGDevice(object):
     def __init__(self,addr,port=None,timeout=1,check=True):
@@ -109,6 +120,32 @@ class MOGDevice(object):
         else:
             raise RuntimeError(resp)
         
+    def cmd_batch(self,cmds,window=BATCH_WINDOW):
+        """Send many commands pipelined and check all responses are OK. Returns list of responses in Unicode.
+        Up to 'window' commands are sent at once and then their responses are read line by line,
+        which avoids one round trip and the receive timeout of recv for each command.
+        On error the responses of the window are read and BatchError with the index of the first failing command is raised."""
+        self.flush()
+        resps = []
+        rest = b''
+        for start in range(0, len(cmds), window):
+            block = cmds[start:start+window]
+            data = []
+            for cmd in block:
+                if hasattr(cmd,'encode'): cmd = cmd.encode()
+                if not cmd.endswith(CRLF): cmd += CRLF
+                data.append(cmd)
+            self.send_all(b''.join(data))
+            lines, rest = self.recv_lines(len(block), rest)
+            error = None
+            for i, line in enumerate(lines):
+                resp = line.decode(errors='replace').strip()
+                resps.append(resp)
+                if (error is None) and not resp.startswith('OK'):
+                    error = BatchError(start+i, block[i], resp[4:].strip() if resp.startswith('ERR:') else resp)
+            if error is not None: raise error
+        return resps
+
     def ask(self,cmd):
         """Send followed by receive, returning response in Unicode"""
         # check if there's any response waiting on the line
@@ -201,6 +238,35 @@ class MOGDevice(object):
             # even though we EXPECTED a string, we got raw data so return it as bytes
             return data
     
+    def send_all(self,data):
+        """Send all data, without appending newline"""
+        self._check()
+        if self.is_usb:
+            return self.dev.write(data)
+        else:
+            return self.dev.sendall(data)
+
+    def recv_lines(self,count,rest=b'',buffer=4096):
+        """Receive 'count' CRLF-terminated lines, returned as list of Bytes without CRLF.
+        rest = data received before. Returns (lines, rest) with rest = data after the last line."""
+        self._check()
+        lines = []
+        data = rest
+        while True:
+            while len(lines) < count:
+                end = data.find(CRLF)
+                if end < 0: break
+                lines.append(data[:end])
+                data = data[end+len(CRLF):]
+            if len(lines) == count: break
+            if self.is_usb:
+                chunk = self.dev.readline(buffer)
+            else:
+                chunk = self.dev.recv(buffer)
+            if len(chunk) == 0: raise RuntimeError('Timed out')
+            data += chunk
+        return lines, data
+
     def send_raw(self,cmd):
         """Send, without appending newline"""
         self._check()
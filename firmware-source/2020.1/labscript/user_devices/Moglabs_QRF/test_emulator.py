@@ -0,0 +1,99 @@
+# test_emulator.py
+# test of table upload of QRF_worker with the TCP emulator QRF_simulate.QRF_emulator without BLACS and without device.
+# created 19/10/2026
+# checks MOGDevice.cmd_batch and QRF_worker.program_table (upload of entire table, edit of changed rows and unchanged table).
+# checks get_table_rows (duration of rows in timed and triggered table mode).
+# run from labscript folder with: python -m pytest user_devices/Moglabs_QRF/test_emulator.py
+# note: make_worker fixture is defined in user_devices/conftest.py.
+
+from time import perf_counter as get_ticks
+import numpy as np
+import pytest
+
+from labscript import LabscriptError
+
+from user_devices.Moglabs_QRF.blacs_workers import QRF_worker, MOGCMD_TABLE_ROW, MOGCMD_TABLE_ROW_OFF, MOGCMD_TABLE_APPEND, get_table_rows
+from user_devices.Moglabs_QRF.labscript_devices import RESOLUTION_TABLE_MODE
+from user_devices.Moglabs_QRF.mogdevice import MOGDevice, BatchError
+from user_devices.Moglabs_QRF.QRF_simulate import QRF_emulator
+from user_devices.iPCdev.blacs_tabs import DDS_CHANNEL_PROP_FREQ, DDS_CHANNEL_PROP_AMP, DDS_CHANNEL_PROP_PHASE
+
+# number of table rows
+ROWS = 500
+
+# latency in seconds per command of the emulator
+LATENCY = 0.0
+
+@pytest.fixture
+def emulator():
+    # started emulator on free port
+    emulator = QRF_emulator(port=0, latency=LATENCY)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+@pytest.fixture
+def dev(emulator):
+    # device connected to emulator
+    dev = MOGDevice('127.0.0.1', emulator.port)
+    yield dev
+    dev.close()
+
+def get_rows(rows, offset=0):
+    # returns list of table rows with last row switching RF off
+    return [MOGCMD_TABLE_ROW % (10 + (i + offset) % 100, 0.0, 0.0, 1) for i in range(rows - 1)] + [MOGCMD_TABLE_ROW_OFF % 1]
+
+def test_table_rows():
+    # timed table mode: duration of each row is the time until the next row, also for rows merged by compact_data
+    times = np.array([0, 1, 3, 7]) * RESOLUTION_TABLE_MODE
+    data  = {DDS_CHANNEL_PROP_FREQ: [10, 20, 30, 30], DDS_CHANNEL_PROP_AMP: [0, 1, 2, 2], DDS_CHANNEL_PROP_PHASE: [0, 0, 0, 0]}
+    rows  = get_table_rows(data, times)
+    assert rows == [MOGCMD_TABLE_ROW % (10, 0, 0, 1), MOGCMD_TABLE_ROW % (20, 1, 0, 2), MOGCMD_TABLE_ROW % (30, 2, 0, 4), MOGCMD_TABLE_ROW_OFF % 1], rows
+    # triggered table mode: duration 0
+    rows  = get_table_rows(data)
+    assert rows == [MOGCMD_TABLE_ROW % (10, 0, 0, 0), MOGCMD_TABLE_ROW % (20, 1, 0, 0), MOGCMD_TABLE_ROW % (30, 2, 0, 0), MOGCMD_TABLE_ROW_OFF % 0], rows
+
+def test_cmd_batch(emulator, dev):
+    # cmd_batch returns one respond per command
+    resps = dev.cmd_batch(['MODE,1,TSB', 'TABLE,CLEAR,1', 'TABLE,EDGE,1,RISING'])
+    assert (len(resps) == 3) and all(r.startswith('OK') for r in resps), resps
+    # cmd_batch raises BatchError with index of first failing command. following commands are still executed.
+    with pytest.raises(BatchError) as E:
+        dev.cmd_batch([MOGCMD_TABLE_APPEND % (1, '10,0,0,1'), 'TABLE,APPEND,1,1e6,0,0,1', MOGCMD_TABLE_APPEND % (1, '11,0,0,1')])
+    assert E.value.index == 1, E.value.index
+    assert len(emulator.channels[1].table) == 2
+
+def test_program_table(emulator, dev, make_worker):
+    # worker with only what program_table needs
+    worker = make_worker(QRF_worker, device_name='QRF_test', dev=dev, table_shadow={})
+
+    # upload entire table
+    rows = get_rows(ROWS)
+    t_start = get_ticks()
+    worker.program_table(1, rows)
+    print('upload %i rows %.3f ms' % (ROWS, (get_ticks() - t_start) * 1e3))
+    channel = emulator.channels[1]
+    assert (len(channel.table) == ROWS) and (channel.entries == ROWS)
+    assert channel.table[5][0] == 15.0
+    assert worker.table_shadow[1] == rows
+
+    # unchanged table: nothing is sent
+    count = emulator.count
+    worker.program_table(1, rows)
+    assert emulator.count == count, emulator.count - count
+
+    # edit only changed rows
+    rows = rows.copy()
+    rows[5] = MOGCMD_TABLE_ROW % (55, 0.0, 0.0, 1)
+    worker.program_table(1, rows)
+    assert (emulator.count - count) == 1, emulator.count - count
+    assert (len(channel.table) == ROWS) and (channel.table[5][0] == 55.0)
+
+    # error in table row gives LabscriptError with row index
+    rows = get_rows(ROWS)
+    rows[7] = MOGCMD_TABLE_ROW % (1e6, 0.0, 0.0, 1)
+    with pytest.raises(LabscriptError) as E:
+        worker.program_table(1, rows)
+    assert 'row 7' in str(E.value), str(E.value)
+    assert 1 not in worker.table_shadow
+    print('%i commands, %i errors' % (emulator.count, emulator.errors))
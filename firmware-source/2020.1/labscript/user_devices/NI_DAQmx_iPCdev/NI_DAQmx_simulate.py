@@ -3,8 +3,12 @@
 # created 25/4/2024 by Andi
 # last change 13/5/2024 by Andi
 # this is only needed when you do not have a NI installation and still want to test the software without hardware.
+# tasks record created channels, number of samples and written data and Task.created/cleared count all tasks.
+# this allows to check which tasks are created and reused by the worker.
+# for counters get_rising_edges returns the generated clock ticks, either from written samples or from the pulse train.
 
 from ctypes import c_uint as uInt32, c_void_p, byref, cast, POINTER, c_wchar
+import numpy as np
 
 TaskHandle = c_void_p
 
@@ -20,9 +24,20 @@ DAQmx_Val_Low               = 10214     # Low
 DAQmx_Val_High              = 10192     # High
 
 class Task:
+    # number of created and cleared tasks
+    created = 0
+    cleared = 0
+
     def __init__(self, name=""):
         self.taskHandle = TaskHandle(0)
         #DAQmxCreateTask(name, byref(self.taskHandle))
+        self.name     = name
+        self.channels = []      # created channels
+        self.samples  = 0       # samples per channel configured by timing
+        self.data     = None    # last written data
+        self.write_pos = 0      # samples written since timing configured or task stopped
+        self.pulse    = None    # (initialDelay, lowTicks, highTicks) of counter
+        Task.created += 1
 
     def StartTask(self):
         return 0
@@ -31,21 +46,27 @@ class Task:
         return 0
     
     def StopTask(self):
+        self.write_pos = 0
         return 0
     
     def ClearTask(self):
+        Task.cleared += 1
         return 0
     
     def RegisterDoneEvent(self, task, options, callbackFunction, callbackData):
         return 0
     
     def CreateAOVoltageChan(self, physicalChannel, nameToAssignToChannel, minVal, maxVal, units, customScaleName):
+        self.channels.append(physicalChannel)
         return 0
         
     def CreateDOChan(self, lines, nameToAssignToLines, lineGrouping):
+        self.channels.append(lines)
         return 0
         
     def CreateCOPulseChanTicks(self, counter, nameToAssignToChannel, sourceTerminal, idleState, initialDelay, lowTicks, highTicks):
+        self.channels.append(counter)
+        self.pulse = (initialDelay, lowTicks, highTicks)
         return 0
         
     def SetRefClkSrc(self, data):
@@ -58,20 +79,41 @@ class Task:
         return 0
         
     def CfgImplicitTiming(self, sampleMode, sampsPerChan):
+        self.samples = sampsPerChan
+        self.write_pos = 0
         return 0
         
     def CfgSampClkTiming(self, source, rate, activeEdge, sampleMode, sampsPerChan):
+        self.samples = sampsPerChan
+        self.write_pos = 0
         return 0
         
     def WriteCtrTicks(self, numSampsPerChan, autoStart, timeout, dataLayout, highTicks, lowTicks, numSampsPerChanWritten, reserved):
+        # highTicks and lowTicks are ctypes pointers to uint32. data is appended at the write position.
+        low  = np.ctypeslib.as_array(lowTicks, shape=(numSampsPerChan,)).copy()
+        high = np.ctypeslib.as_array(highTicks, shape=(numSampsPerChan,)).copy()
+        if self.write_pos == 0: self.data = (low, high)
+        else:                   self.data = (np.concatenate((self.data[0], low)), np.concatenate((self.data[1], high)))
+        self.write_pos += numSampsPerChan
         numSampsPerChanWritten.value = numSampsPerChan
         return 0
+
+    def get_rising_edges(self):
+        # returns ticks of the rising edges of the counter output after start.
+        # without written data the counter generates samples pulses given by CreateCOPulseChanTicks.
+        if self.data is None:
+            delay, low, high = self.pulse
+            return delay + np.arange(self.samples, dtype=np.uint64) * (low + high)
+        low, high = self.data
+        return np.cumsum(low, dtype=np.uint64) + np.concatenate(([0], np.cumsum(high[:-1], dtype=np.uint64))).astype(np.uint64)
         
     def WriteAnalogF64(self, numSampsPerChan, autoStart, timeout, dataLayout, writeArray, sampsPerChanWritten, reserved) :
+        self.data = np.array(writeArray)
         sampsPerChanWritten.value = numSampsPerChan
         return 0
         
     def WriteDigitalU32(self, numSampsPerChan, autoStart, timeout, dataLayout, writeArray, sampsPerChanWritten, reserved):
+        self.data = np.array(writeArray)
         sampsPerChanWritten.value = numSampsPerChan
         return 0
         
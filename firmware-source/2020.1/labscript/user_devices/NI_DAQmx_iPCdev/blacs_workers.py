@@ -55,7 +55,7 @@ from labscript_utils.connections import _ensure_str
 
 from user_devices.iPCdev.labscript_devices import (
     DEVICE_HARDWARE_INFO, DEVICE_DEVICES, DEVICE_SEP,
-    DEVICE_TIME, DEVICE_DATA_DO, DEVICE_DATA_AO,
+    DEVICE_TIME, load_times, DEVICE_DATA_DO, DEVICE_DATA_AO,
     DEVICE_INFO_TYPE, DEVICE_INFO_PATH, DEVICE_INFO_ADDRESS, DEVICE_INFO_CHANNEL, DEVICE_INFO_BOARD,
     HARDWARE_TYPE, HARDWARE_TYPE_AO, HARDWARE_TYPE_DO,
     HARDWARE_SUBTYPE, HARDWARE_SUBTYPE_STATIC, HARDWARE_SUBTYPE_TRIGGER,
@@ -96,6 +96,10 @@ TIMEOUT_DONE        = 1.0
 WAIT_STATIC_AO_TASK_DONE    = False     # enabling gives timeout error while for DO it is fine?
 WAIT_STATIC_DO_TASK_DONE    = False     # not required but better to to do. might timeout?
 LOCK_REFCLOCK_AO_DO         = True      # required, otherwise get an error
+TASK_REUSE                  = True      # reuse buffered tasks with same configuration and write only new data. False = create new tasks each update.
+AUTO_STATIC                 = False     # program buffered AO channels and DO ports which are constant for the whole shot as static.
+                                        # note: static outputs are set already at transition_to_buffered and not with the first clock tick.
+                                        #       this changes the output timing. therefore, enable only when this is fine for your setup.
 
 # output channel info for each run for CO/AO/DO channels. set to None if should not print this
 # device name, number and type of channels, counter port name, number of samples, additional info
@@ -106,6 +110,13 @@ MIN_TIME            = 60e-9
 MIN_TICKS_10MHz     = 2
 MIN_TICKS_100MHz    = 3
 
+# counter programming:
+# COUNTER_IMPLICIT = True: counter with the same period between all rising edges is programmed as pulse train without buffer.
+#                    otherwise the low and high ticks of each sample are written into the counter buffer.
+# COUNTER_CHUNK    = maximum number of samples written with one call of WriteCtrTicks.
+COUNTER_IMPLICIT    = True
+COUNTER_CHUNK       = 65536
+
 def get_clock_ticks(times, clock_rate=None, values=None, safe_state=None, min_time_or_ticks=None):
     """
     convert times to low and high times.
@@ -215,6 +226,41 @@ def get_clock_ticks(times, clock_rate=None, values=None, safe_state=None, min_ti
     # return low and high times
     return [dtime_low, dtime_high]
 
+def get_tick_runs(ticks_low, ticks_high):
+    """
+    run-length encoding of counter ticks returned by get_clock_ticks.
+    the counter output has a rising edge after each low time.
+    the period between rising edges i-1 and i is ticks_high[i-1] + ticks_low[i].
+    returns (index, count, period) numpy arrays with one entry per run of equal periods:
+    index  = first rising edge of run (>= 1)
+    count  = number of periods in run
+    period = period in ticks
+    for less than 2 samples returns empty arrays.
+    """
+    period = ticks_high[:-1].astype(np.uint64) + ticks_low[1:]
+    if len(period) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), period
+    start = np.concatenate(([0], np.flatnonzero(period[1:] != period[:-1]) + 1))
+    count = np.diff(np.concatenate((start, [len(period)])))
+    return start + 1, count, period[start]
+
+def get_buffer(table, dtype):
+    """
+    returns C-contiguous 2d array of given dtype with one row per value of table dictionary.
+    this is the layout needed for DAQmx_Val_GroupByChannel.
+    if the values of table are already the rows of such an array (see get_output_tables)
+    this array is returned without copy. otherwise data is converted while copied into a new array.
+    """
+    rows = list(table.values())
+    base = rows[0].base
+    if (base is not None) and (base.dtype == dtype) and base.flags.c_contiguous and (base.shape == (len(rows), len(rows[0]))):
+        if all((row.base is base) and (row.ctypes.data == base.ctypes.data + i*base.strides[0]) for i, row in enumerate(rows)):
+            return base
+    buffer = np.empty(shape=(len(rows), len(rows[0])), dtype=dtype)
+    for i, row in enumerate(rows):
+        buffer[i] = row
+    return buffer
+
 class NI_DAQmx_OutputWorker(iPCdev_worker):
 
     iPCdev_worker.sync_reset_each_run = SYNC_RESET_EACH_RUN
@@ -311,6 +357,14 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
         self.DO_task = None
         self.CO_tasks = {}
 
+        # configuration key and number of samples of buffered tasks for reuse.
+        # key = counter name or 'AO'/'DO', value = [configuration key, number of samples]
+        self.task_keys = {}
+
+        # counters generating a pulse train without buffer (implicit timing).
+        # these have no write position and only the generated samples can be checked.
+        self.CO_implicit = set()
+
         # dictionary for counter output ports for each used counter.
         # key = counter name self.counter_DO/AO, value = (port name (bytes), board name)
         self.counter_ports = {}
@@ -318,9 +372,6 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
         if self.counter_AO is not None: self.counters_used += 1
         if self.counter_DO is not None: self.counters_used += 1
 
-        # last file id used to detect if file has been changed
-        self.file_id = None
-
         # experiment time in seconds and number of samples
         self.exp_time               = 0
         self.exp_samples_CO         = []
@@ -374,28 +425,52 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                 Please ensure you upgrade to v14.2.0 or higher."""
             raise Exception(dedent(msg) % (major.value, minor.value, patch.value))
 
-    def stop_tasks(self):
-        print("stop tasks")
+    def stop_tasks(self, clear=True):
+        """
+        stop all tasks.
+        if clear = True clears all tasks. otherwise buffered tasks are kept for reuse with reuse_task.
+        """
+        print("stop tasks" if clear else "stop tasks (keep for reuse)")
         if self.AO_task is not None:
             self.AO_task.StopTask()
-            self.AO_task.ClearTask()
-            self.AO_task = None
+            if clear:
+                self.AO_task.ClearTask()
+                self.AO_task = None
         if self.DO_task is not None:
             self.DO_task.StopTask()
-            self.DO_task.ClearTask()
-            self.DO_task = None
+            if clear:
+                self.DO_task.ClearTask()
+                self.DO_task = None
         for counter, task in self.CO_tasks.items():
-            print('delete counter',counter)
             task.StopTask()
-            task.ClearTask()
-        self.CO_tasks = {}
-        # force reloading of file
-        self.file_id = None
+            if clear:
+                print('delete counter',counter)
+                task.ClearTask()
+        if clear:
+            self.CO_tasks = {}
+            self.task_keys = {}
+        # force reprogramming. tables are kept in cache.
+        self.cache_key = None
         # Remove the mirroring of the clock terminal, if applicable:
         self.set_mirror_clock_terminal_connected(False)
         # Remove connections between other terminals, if applicable:
         self.set_connected_terminals_connected(False)
 
+    def reuse_task(self, name, task, key):
+        """
+        returns True if the stopped buffered task with given name was configured with the same key and can be reused.
+        then only the sample count and data need to be written.
+        otherwise clears task if not None and returns False. caller has to create and configure a new task.
+        name = counter name or 'AO'/'DO'
+        key  = tuple of all parameters used to create channels and timing, without number of samples.
+        """
+        if task is not None:
+            if TASK_REUSE and (name in self.task_keys) and (self.task_keys[name][0] == key):
+                return True
+            task.ClearTask()
+        self.task_keys.pop(name, None)
+        return False
+
     def start_manual_mode_tasks(self):
         # Create tasks:
         if self.num_AO > 0:
@@ -548,6 +623,9 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
 
         #read_group(f)
 
+        # times shared between clocklines and channels are loaded only once
+        times_cache = {}
+
         # load times of board counters connected with AO/DO channels
         # they can be shared between boards and might be different from the AO/DO channels below.
         group = f[DEVICE_DEVICES]
@@ -572,7 +650,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                             print(device.device_class)
                             raise LabscriptError("device '%s': counter '%s' given but '%s' expected!" % (device.name, device.parent_port, counter))
                     g_IM = group[self.device_name + DEVICE_SEP + device.name]
-                    times = g_IM[DEVICE_TIME][()]
+                    times = load_times(g_IM, times_cache)
                     if times is None:
                         raise LabscriptError("device %s: dataset %s not existing!" % (device.name, dataset))
                     elif static and len(times) != 2:
@@ -609,7 +687,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                 print("info: device %s of other board %s (skip)" % (device.name, board))
                 continue
             group = f[hardware_info[DEVICE_INFO_PATH]]
-            times = group[DEVICE_TIME][()]
+            times = load_times(group, times_cache)
             data  = group[dataset][()]
             if data is None:
                 raise LabscriptError("device %s: dataset %s not existing!" % (device.name, dataset))
@@ -641,70 +719,141 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                         raise LabscriptError("DO device %s: %i samples different than before %i!\neach AO channel must use the same clockline!" % (device.name, self.exp_samples_DO, len(data)))
             if times[-1] > self.exp_time: self.exp_time = times[-1]
 
+        if AUTO_STATIC:
+            # move channels and ports which do not change during the shot to static tables
+            for table, table_static in [(AO_table, AO_table_static), (DO_table, DO_table_static)]:
+                for name in [name for name, data in table.items() if np.all(data == data[0])]:
+                    table_static[name] = table.pop(name)[:1]
+            if len(AO_table) == 0: self.exp_samples_AO = 0
+            if len(DO_table) == 0: self.exp_samples_DO = 0
+
+        # save AO and DO data as rows of a single array which is written without copy.
+        # DO data is converted here from the integer type of the file to uint32 written to the device (see program_manual).
+        # parsed tables are cached, so for a repeated shot no data is copied or converted.
+        if len(AO_table) > 0:
+            buffer = get_buffer(AO_table, np.float64)
+            AO_table = {name: row for name, row in zip(AO_table.keys(), buffer)}
+        if len(DO_table) > 0:
+            buffer = get_buffer(DO_table, np.uint32)
+            DO_table = {name: row for name, row in zip(DO_table.keys(), buffer)}
+
         return CO_table, AO_table, AO_table_static, DO_table, DO_table_static
 
+    def get_cache_datasets(self, f):
+        """
+        returns list of groups in open h5 file f on which the output tables depend.
+        these are the groups of all channels and of the clocklines of this board.
+        """
+        groups = super(NI_DAQmx_OutputWorker, self).get_cache_datasets(f)
+        group = f[DEVICE_DEVICES]
+        for device in self.clocklines:
+            if device.properties[DEVICE_HARDWARE_INFO][DEVICE_INFO_BOARD] == self.device_name:
+                groups.append(group[self.device_name + DEVICE_SEP + device.name])
+        return groups
+
+    def parse_tables(self, f):
+        """
+        returns parsed tables from open h5 file f. called by load_tables when tables are not in cache.
+        returns (output tables, exp_time, exp_samples_CO, exp_samples_AO, exp_samples_DO)
+        with output tables = (CO_table, AO_table, AO_table_static, DO_table, DO_table_static)
+        """
+        tables = self.get_output_tables(f, self.device_name)
+        return (tables, self.exp_time, self.exp_samples_CO, self.exp_samples_AO, self.exp_samples_DO)
+
     def program_buffered_CO(self, CO_table):
         """
         program counters.
         CO_table = dictionary with key = counter name, value = np.array of times in seconds.
+        tasks of the previous shot are reused when the configuration is the same.
         """
         written = int32()
-        info = ''
+        self.CO_implicit = set()
+        # clear counters not used in this shot
+        for counter in [c for c in self.CO_tasks if c not in CO_table]:
+            self.reuse_task(counter, self.CO_tasks.pop(counter), None)
+        # configuration of counters. number of samples is not included.
+        config = (self.clock_terminal, self.clock_rate, self.start_trigger_terminal, self.start_trigger_edge)
         for counter, times in CO_table.items():
-            if counter in self.CO_tasks:
-                task = self.CO_tasks[counter]
-                task.ClearTask()
-            task = self.CO_tasks[counter] = Task(self.device_name + "CObuf_" + counter.replace('/',''))
             num_samples = len(times)
 
-            # create counter. this implicitly assigns PFI output
-            # sourceTerminal = None uses always the internal 100MHz clock
-            # if needed this clock can be locked with PLL to external source
-            # minimum ticks = min_ticks_100MHz
-            task.CreateCOPulseChanTicks(counter                 = counter,
-                                        nameToAssignToChannel   = '',
-                                        sourceTerminal          = None,
-                                        idleState               = DAQmx_Val_Low,
-                                        initialDelay            = 0,
-                                        lowTicks                = MIN_TICKS_100MHz,
-                                        highTicks               = MIN_TICKS_100MHz)
-
-            # lock internal 100MHz clock to external clock at given rate
-            # this must be set for all tasks, othwerwise get an error thar resources are already in use
-            # we have seen a similar behaviour with C code.
-            if self.clock_terminal is not None:
-                task.SetRefClkSrc(self.clock_terminal)
-                task.SetRefClkRate(self.clock_rate)
-
-            if self.start_trigger_terminal is not None:
-                # set external start trigger channel
-                if self.start_trigger_edge is None:
-                    edge = DAQmx_Val_Rising
-                else:
-                    edge = DAQmx_Val_Rising if self.start_trigger_edge == START_TRIGGER_EDGE_RISING else DAQmx_Val_Falling
-                task.CfgDigEdgeStartTrig(self.start_trigger_terminal, edge)
-
-            # setup implicit timing with finite samples
-            task.CfgImplicitTiming(sampleMode=DAQmx_Val_FiniteSamps, sampsPerChan=num_samples)
-
-            # write times to counter. times are given as pointer to a continuous array of uint32.
             # get difference of times (as numpy.ndarray) and divide evenly between high and low time
             # the first low time we want to be as short as possible.
             ticks_low, ticks_high = get_clock_ticks(times, clock_rate=self.internal_clock_rate, min_time_or_ticks=MIN_TICKS_100MHz)
-            ptr_low  = ticks_low.ctypes.data_as(POINTER(c_uint32))
-            ptr_high = ticks_high.ctypes.data_as(POINTER(c_uint32))
-            result = task.WriteCtrTicks(
-                               numSampsPerChan          = num_samples,
-                               autoStart                = 0,
-                               timeout                  = TIMEOUT_WRITE,
-                               dataLayout               = DAQmx_Val_GroupByChannel,
-                               highTicks                = ptr_high,
-                               lowTicks                 = ptr_low,
-                               numSampsPerChanWritten   = written,
-                               reserved                 = None
-                               )
-            if (result != 0) or (written.value != len(times)):
-                raise LabscriptError("counter write result %i (%i/%i written)!" % (result, written.value, num_samples))
+
+            # with the same period between all rising edges the counter generates the pulse train without buffer:
+            # the first low time is the initial delay, followed by num_samples pulses with the high and low time of the first period.
+            # the rising edges are the same as for the buffered ticks, only the last pulse might be longer.
+            index, count, period = get_tick_runs(ticks_low, ticks_high)
+            if COUNTER_IMPLICIT and (len(period) == 1):
+                implicit = (int(ticks_low[0]), int(ticks_high[0]), int(period[0] - ticks_high[0]))
+                key = config + implicit
+            else:
+                implicit = None
+                key = config
+
+            task = self.CO_tasks.get(counter, None)
+            reuse = self.reuse_task(counter, task, key)
+            info = ' (reuse)' if reuse else ''
+            if not reuse:
+                task = self.CO_tasks[counter] = Task(self.device_name + "CObuf_" + counter.replace('/',''))
+
+                # create counter. this implicitly assigns PFI output
+                # sourceTerminal = None uses always the internal 100MHz clock
+                # if needed this clock can be locked with PLL to external source
+                # minimum ticks = min_ticks_100MHz
+                # for buffered counter the initial delay, low and high ticks are given by the written samples.
+                task.CreateCOPulseChanTicks(counter                 = counter,
+                                            nameToAssignToChannel   = '',
+                                            sourceTerminal          = None,
+                                            idleState               = DAQmx_Val_Low,
+                                            initialDelay            = 0 if implicit is None else implicit[0],
+                                            lowTicks                = MIN_TICKS_100MHz if implicit is None else implicit[2],
+                                            highTicks               = MIN_TICKS_100MHz if implicit is None else implicit[1])
+
+                # lock internal 100MHz clock to external clock at given rate
+                # this must be set for all tasks, othwerwise get an error thar resources are already in use
+                # we have seen a similar behaviour with C code.
+                if self.clock_terminal is not None:
+                    task.SetRefClkSrc(self.clock_terminal)
+                    task.SetRefClkRate(self.clock_rate)
+
+                if self.start_trigger_terminal is not None:
+                    # set external start trigger channel
+                    if self.start_trigger_edge is None:
+                        edge = DAQmx_Val_Rising
+                    else:
+                        edge = DAQmx_Val_Rising if self.start_trigger_edge == START_TRIGGER_EDGE_RISING else DAQmx_Val_Falling
+                    task.CfgDigEdgeStartTrig(self.start_trigger_terminal, edge)
+
+            if not reuse or (self.task_keys[counter][1] != num_samples):
+                # setup implicit timing with finite samples
+                task.CfgImplicitTiming(sampleMode=DAQmx_Val_FiniteSamps, sampsPerChan=num_samples)
+            self.task_keys[counter] = [key, num_samples]
+
+            if implicit is not None:
+                self.CO_implicit.add(counter)
+                info += ' (pulse train %i ticks)' % (period[0])
+            else:
+                # write ticks to counter in chunks of COUNTER_CHUNK samples.
+                # ticks are given as pointer to a continuous array of uint32. slices of ticks_low/high are continuous.
+                total = 0
+                for start in range(0, num_samples, COUNTER_CHUNK):
+                    chunk = slice(start, min(start + COUNTER_CHUNK, num_samples))
+                    result = task.WriteCtrTicks(
+                                       numSampsPerChan          = chunk.stop - chunk.start,
+                                       autoStart                = 0,
+                                       timeout                  = TIMEOUT_WRITE,
+                                       dataLayout               = DAQmx_Val_GroupByChannel,
+                                       highTicks                = ticks_high[chunk].ctypes.data_as(POINTER(c_uint32)),
+                                       lowTicks                 = ticks_low[chunk].ctypes.data_as(POINTER(c_uint32)),
+                                       numSampsPerChanWritten   = written,
+                                       reserved                 = None
+                                       )
+                    total += written.value
+                    if (result != 0) or (written.value != (chunk.stop - chunk.start)):
+                        raise LabscriptError("counter write result %i (%i/%i written)!" % (result, total, num_samples))
+                if len(period) > 1:
+                    info += ' (%i runs)' % (len(period))
 
             if counter not in self.counter_ports:
                 # get the counter output port
@@ -776,7 +925,6 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
     def program_buffered_AO(self, AO_table):
 
         final_values    = {}
-        num_buffered    = 0
         num_samples     = None
         matrix_buffered = None
         written         = int32()
@@ -787,33 +935,12 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
             for name, data in AO_table.items():
                 if num_samples is None:
                     num_samples = len(data)
-
-                    if self.AO_task is not None:
-                        self.AO_task.ClearTask()
-                    self.AO_task = Task(self.device_name + "AObuf")
-
-                    matrix_buffered = np.empty(shape=(len(AO_table), num_samples), dtype=np.float64)
                 elif len(data) != num_samples:
                     raise LabscriptError("channel '%s' number of samples %i != %i! different clocklines for different channels is not supported at the moment." % (name, len(data), num_samples))
                 final_values[name] = data[-1]
 
-                con = self.MAX_name + '/' + name
-                matrix_buffered[num_buffered] = data
-                self.AO_task.CreateAOVoltageChan(con, "", self.Vmin, self.Vmax, DAQmx_Val_Volts, None)
-
-                num_buffered += 1
-
-            # lock internal 100MHz clock to external clock at given rate.
-            # this must be set also for DO/AO tasks as for the counters, otherwise get an error that resources are already in use.
-            # however, for the PXIe-6535 board without counters we cannot set this, otherwise we get another error.
-            # we have seen a similar behaviour with C code.
-            if (self.clock_terminal is not None) and LOCK_REFCLOCK_AO_DO:
-                length = DAQmxGetDevCOPhysicalChans(self.MAX_name, None, 0);
-                if length == 0:
-                    info = ' (no internal counter)'
-                else:
-                    self.AO_task.SetRefClkSrc(self.clock_terminal)
-                    self.AO_task.SetRefClkRate(self.clock_rate)
+            # data of all channels as contiguous array. this does not copy data from get_output_tables.
+            matrix_buffered = get_buffer(AO_table, np.float64)
 
             # get counter port
             try:
@@ -821,14 +948,39 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
             except KeyError:
                 raise LabscriptError("AO counter '%s' port not found!" % (self.counter_DO))
 
-            # Set up timing:
-            self.AO_task.CfgSampClkTiming(
-                counter_port.encode('utf-8'),
-                self.max_AO_sample_rate,
-                DAQmx_Val_Rising,
-                DAQmx_Val_FiniteSamps,
-                num_samples,
-            )
+            # reuse task when channels and timing are the same
+            key = (tuple(AO_table.keys()), counter_port, self.max_AO_sample_rate, self.Vmin, self.Vmax, self.clock_terminal, self.clock_rate)
+            reuse = self.reuse_task('AO', self.AO_task, key)
+            if reuse:
+                info = ' (reuse)'
+            else:
+                self.AO_task = Task(self.device_name + "AObuf")
+                for name in AO_table.keys():
+                    con = self.MAX_name + '/' + name
+                    self.AO_task.CreateAOVoltageChan(con, "", self.Vmin, self.Vmax, DAQmx_Val_Volts, None)
+
+                # lock internal 100MHz clock to external clock at given rate.
+                # this must be set also for DO/AO tasks as for the counters, otherwise get an error that resources are already in use.
+                # however, for the PXIe-6535 board without counters we cannot set this, otherwise we get another error.
+                # we have seen a similar behaviour with C code.
+                if (self.clock_terminal is not None) and LOCK_REFCLOCK_AO_DO:
+                    length = DAQmxGetDevCOPhysicalChans(self.MAX_name, None, 0);
+                    if length == 0:
+                        info = ' (no internal counter)'
+                    else:
+                        self.AO_task.SetRefClkSrc(self.clock_terminal)
+                        self.AO_task.SetRefClkRate(self.clock_rate)
+
+            if not reuse or (self.task_keys['AO'][1] != num_samples):
+                # Set up timing:
+                self.AO_task.CfgSampClkTiming(
+                    counter_port.encode('utf-8'),
+                    self.max_AO_sample_rate,
+                    DAQmx_Val_Rising,
+                    DAQmx_Val_FiniteSamps,
+                    num_samples,
+                )
+            self.task_keys['AO'] = [key, num_samples]
 
             # Write data:
             result = self.AO_task.WriteAnalogF64(
@@ -836,7 +988,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                 False,
                 TIMEOUT_WRITE,
                 DAQmx_Val_GroupByChannel, #DAQmx_Val_GroupByScanNumber,
-                np.ascontiguousarray(matrix_buffered),
+                matrix_buffered,
                 written,
                 None,
             )
@@ -849,6 +1001,11 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                                       counter_port, counter_board,
                                       num_samples, info))
 
+        elif self.AO_task is not None:
+            # no buffered AO in this shot: clear task of previous shot
+            self.reuse_task('AO', self.AO_task, None)
+            self.AO_task = None
+
         return final_values
 
     def program_static_DO(self, DO_table_static):
@@ -913,11 +1070,11 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
     def program_buffered_DO(self, DO_table):
         """
         Create the DO task and program in the DO table for a shot.
+        the task of the previous shot is reused when ports and timing are the same.
         Return a dictionary of the final values of each channel.
         """
         written         = int32()
         final_values    = {}
-        num_buffered    = 0
         num_samples     = None
         matrix_buffered = None
         info            = ''
@@ -925,15 +1082,9 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
         if len(DO_table) > 0:
 
             for port_str, data in DO_table.items():
-                # create port, save data into matrix_buffered and get final values of each channel
+                # check number of samples and get final values of each channel
                 if num_samples is None:
                     num_samples = len(data)
-
-                    if self.DO_task is not None:
-                        self.DO_task.ClearTask()
-                    self.DO_task = Task(self.device_name + "DObuf")
-
-                    matrix_buffered = np.empty(shape=(len(DO_table), num_samples), dtype=np.uint32)
                 elif len(data) != num_samples:
                     raise LabscriptError("channel '%s' number of samples %i != %i! different clocklines for different channels is not supported at the moment." % (port_str, len(data), num_samples))
 
@@ -945,23 +1096,10 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                     line_final_value = bool((1 << line) & port_final_value)
                     final_values['%s/line%d' % (port_str, line)] = int(line_final_value)
 
-                con = '%s/%s' % (self.MAX_name, port_str)
-                matrix_buffered[num_buffered] = data
-                self.DO_task.CreateDOChan(con, "", DAQmx_Val_ChanForAllLines)
-
-                num_buffered += 1
-
-            # lock internal 100MHz clock to external clock at given rate.
-            # this must be set also for DO/AO tasks as for the counters, otherwise get an error that resources are already in use.
-            # however, for the PXIe-6535 board without counters we cannot set this, otherwise we get another error.
-            # we have seen a similar behaviour with C code.
-            if (self.clock_terminal is not None) and LOCK_REFCLOCK_AO_DO:
-                length = DAQmxGetDevCOPhysicalChans(self.MAX_name, None, 0);
-                if length == 0:
-                    info = ' (no internal counter)'
-                else:
-                    self.DO_task.SetRefClkSrc(self.clock_terminal)
-                    self.DO_task.SetRefClkRate(self.clock_rate)
+            # data of all ports as contiguous array. See the comment in self.program_manual
+            # as to why we are using uint32 instead of the native size of each port.
+            # tables from parse_tables are already in this layout and are not copied.
+            matrix_buffered = get_buffer(DO_table, np.uint32)
 
             # get counter port
             try:
@@ -969,14 +1107,39 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
             except KeyError:
                 raise LabscriptError("DO counter '%s' port found!" % (self.counter_DO))
 
-            # Set up timing:
-            self.DO_task.CfgSampClkTiming(
-                counter_port.encode('utf-8'),
-                self.max_DO_sample_rate,
-                DAQmx_Val_Rising,
-                DAQmx_Val_FiniteSamps,
-                num_samples,
-            )
+            # reuse task when ports and timing are the same
+            key = (tuple(DO_table.keys()), counter_port, self.max_DO_sample_rate, self.clock_terminal, self.clock_rate)
+            reuse = self.reuse_task('DO', self.DO_task, key)
+            if reuse:
+                info = ' (reuse)'
+            else:
+                self.DO_task = Task(self.device_name + "DObuf")
+                for port_str in DO_table.keys():
+                    con = '%s/%s' % (self.MAX_name, port_str)
+                    self.DO_task.CreateDOChan(con, "", DAQmx_Val_ChanForAllLines)
+
+                # lock internal 100MHz clock to external clock at given rate.
+                # this must be set also for DO/AO tasks as for the counters, otherwise get an error that resources are already in use.
+                # however, for the PXIe-6535 board without counters we cannot set this, otherwise we get another error.
+                # we have seen a similar behaviour with C code.
+                if (self.clock_terminal is not None) and LOCK_REFCLOCK_AO_DO:
+                    length = DAQmxGetDevCOPhysicalChans(self.MAX_name, None, 0);
+                    if length == 0:
+                        info = ' (no internal counter)'
+                    else:
+                        self.DO_task.SetRefClkSrc(self.clock_terminal)
+                        self.DO_task.SetRefClkRate(self.clock_rate)
+
+            if not reuse or (self.task_keys['DO'][1] != num_samples):
+                # Set up timing:
+                self.DO_task.CfgSampClkTiming(
+                    counter_port.encode('utf-8'),
+                    self.max_DO_sample_rate,
+                    DAQmx_Val_Rising,
+                    DAQmx_Val_FiniteSamps,
+                    num_samples,
+                )
+            self.task_keys['DO'] = [key, num_samples]
 
             # Write data. See the comment in self.program_manual as to why we are using
             # uint32 instead of the native size of each port.
@@ -985,7 +1148,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                 False,
                 TIMEOUT_WRITE,
                 DAQmx_Val_GroupByChannel, #DAQmx_Val_GroupByScanNumber,
-                np.ascontiguousarray(matrix_buffered), #DO_table,
+                matrix_buffered,
                 written,
                 None,
             )
@@ -997,26 +1160,35 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                                       counter_port, counter_board,
                                       num_samples, info))
 
+        elif self.DO_task is not None:
+            # no buffered DO in this shot: clear task of previous shot
+            self.reuse_task('DO', self.DO_task, None)
+            self.DO_task = None
+
         return final_values
 
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         # Store the initial values in case we have to abort and restore them:
         self.initial_values = initial_values
         final_values = {}
+        self.timing.start()
+        self.h5file = h5file
         # 'fresh' is True on startup and when user pushes the button 'clear smart-programming cache' but is unrelated to new file.
         update = fresh
 
-        if self.tasks_manual:
+        manual = self.tasks_manual
+        if manual:
             # force update to stop the manual mode tasks
             self.tasks_manual = False
             update = True
 
         with h5py.File(h5file, 'r') as f:
-            # file id used to check if file has been changed
-            id = f.attrs['sequence_id'] + ('_%i'%f.attrs['sequence_index']) + ('_%i'%f.attrs['run number'])
-            if self.file_id is None or self.file_id != id:
-                # new file
-                update = True
+            # get data tables from file or cache. changed = True if tables have been changed.
+            # note: for a new file this might take several seconds!
+            (tables, changed) = self.load_tables(f, fresh)
+            if changed: update = True
+            cache_key = self.cache_key
+            self.timing.mark('read')
 
             # transmit to all boards if need to update.
             # this is needed when one worker was restarted otherwise get PyDAQmx.DAQmxFunctions.RuntimeAborted_RoutingError (-88709).
@@ -1039,6 +1211,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                     # second timeout: something more serious happenend?
                     print("\ntimeout waiting for board status update!\n")
                     return None # this causes abort_transition_to_buffered which does not require user to restart worker.
+            self.timing.mark('wait', self.arrival)
 
             # update if any board needs to update
             print('board update:', board_update)
@@ -1048,21 +1221,21 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                     print("\n%s %s is not updating after successful restart!?\n" % (self.device_name, board))
                     return None
 
-            if update:
-                # clear all old tasks (manual or buffered) otherwise get errors of already used resources.
-                self.stop_tasks()
-                # get data tables from h5 file.
-                # note: this might take several seconds!
-                CO_table, AO_table, AO_table_static, DO_table, DO_table_static = self.get_output_tables(f, device_name)
-                # save new file id (after stop_tasks which resets id)
-                self.file_id = id
+        (CO_table, AO_table, AO_table_static, DO_table, DO_table_static), self.exp_time, self.exp_samples_CO, self.exp_samples_AO, self.exp_samples_DO = tables
 
         if update:
+            # clear all old tasks (manual or buffered) otherwise get errors of already used resources.
+            # buffered tasks of the previous shot are only stopped and reused when their configuration is the same.
+            # on fresh start, after manual mode or after a board was restarted all tasks are cleared.
+            # stop_tasks resets cache_key and we restore it only when all channels are programmed.
+            self.stop_tasks(clear=(not TASK_REUSE) or fresh or manual or reset_event_counter)
+
             print('\n%s reprogram channels:' % device_name)
             # Program static tasks and retrieve the final values
             # note: when programming counters before this get unexpected errors!
             final_values.update(self.program_static_AO(AO_table_static))
             final_values.update(self.program_static_DO(DO_table_static))
+            self.timing.mark('config')
 
             # wait until all static channels are programmed.
             # note: this might timeout when one boards has many data in h5 file to read.
@@ -1074,6 +1247,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
             if result[0] != SYNC_RESULT_OK:
                 print("\ntimeout waiting to read file & static channels programmed!\n")
                 return None
+            self.timing.mark('wait', self.arrival)
             print(device_name, result)
 
             # Mirror the clock terminal, if applicable:
@@ -1084,12 +1258,14 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
 
             # program counter
             self.program_buffered_CO(CO_table)
+            self.timing.mark('upload')
 
             # wait until all boards have programmed counters and share counters output ports among boards
             (timeout, board_counters, duration) = self.sync_boards(payload={c:p[0] for c,p in self.counter_ports.items()} if len(self.counter_ports) > 0 else None, timeout=TIMEOUT_WRITE)
             if timeout:
                 print("\ntimeout waiting for counter PFI ports or reading file took me too long!\n")
                 return None # TODO should cause abort transition to buffered?
+            self.timing.mark('wait', self.arrival)
             if len(self.counter_ports) < self.counters_used:
                 #print('shared couner ports:', board_counters)
                 counters = {}
@@ -1111,6 +1287,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
             # Program buffered tasks and retrieve the final values of each output
             final_values.update(self.program_buffered_DO(DO_table))
             final_values.update(self.program_buffered_AO(AO_table))
+            self.timing.mark('upload')
 
             #print('final values:', final_values)
 
@@ -1118,12 +1295,17 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
             if self.sync_boards(timeout=TIMEOUT_WRITE)[0] != SYNC_RESULT_OK:
                 print("\ntimeout program channels!\n")
                 return None
+            self.timing.mark('wait', self.arrival)
+
+            # all channels programmed with tables of cache_key
+            self.cache_key = cache_key
         
         if   self.exp_time >= 1.0: tmp = '%.3f s'  % (self.exp_time)
         elif self.exp_time > 1e-3: tmp = '%.3f ms' % (self.exp_time*1e3)
         elif self.exp_time > 1e-6: tmp = '%.3f us' % (self.exp_time*1e6)
         else:                      tmp = '%.1f ns' % (self.exp_time*1e9)
         print('\nstart experiment: duration', tmp, '(new file)' if update else '(old file)')
+        self.timing.mark('config')
 
         if self.AO_task is not None: self.AO_task.StartTask()
         if self.DO_task is not None: self.DO_task.StartTask()
@@ -1138,6 +1320,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
         # note: if several counters are used an external trigger is needed to synchronize them!
         for task in self.CO_tasks.values():
             task.StartTask()
+        self.timing.mark('start')
 
         return final_values
 
@@ -1179,12 +1362,16 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                         if self.simulate:
                             current = total = num_samples
                         else:
-                            task.GetWriteCurrWritePos(npts)
                             task.GetWriteTotalSampPerChanGenerated(samples)
                             # Detect -1 even though they're supposed to be unsigned ints, -1
                             # seems to indicate the task was not started:
                             current = samples.value if samples.value != 2 ** 64 - 1 else -1
-                            total = npts.value if npts.value != 2 ** 64 - 1 else -1
+                            if name in self.CO_implicit:
+                                # pulse train has no buffer and no write position: check only generated samples
+                                total = num_samples
+                            else:
+                                task.GetWriteCurrWritePos(npts)
+                                total = npts.value if npts.value != 2 ** 64 - 1 else -1
                         ok = (not timeout) and (current == total) and (total == num_samples)
                         if ok:
                             print("run %4i: %s done %i/%i samples (ok)" % (self.run_count, name, current, num_samples))
@@ -1226,6 +1413,8 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                 if board_error != 0: print('%s status error (%i)' % (board, board_error))
                 #else:                print('%s ok' % (board))
 
+        self.timing_done(save=not abort)
+
         # return True = all ok
         return (error == 0)
 
@@ -1240,6 +1429,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
            and worker should return self.board_status with key = board name. value = error code. 0 = ok.
         """
         run_time = get_ticks() - self.t_start
+        self.timing.since_run('status')
         if self.simulate:
             # simulate end with computer clock
             end = (run_time >= self.exp_time)
@@ -1256,6 +1446,7 @@ class NI_DAQmx_OutputWorker(iPCdev_worker):
                     end = False
         if end:
             # all tasks finished
+            self.timing.since_run('end')
             if status_end:
                 # called after transition_to_manual for status check
                 # return error code of all boards. 0 = ok, {} = aborted
@@ -248,9 +248,13 @@ class NI_DAQmx_iPCdev(iPCdev):
         # set MAX name. None can be used only for simulation.
         self.MAX_name = MAX_name if MAX_name is not None else name
 
-        # for digital out we have 8 bits per port, so we can reduce the data width of combine_channel_data.
+        # for digital out we reduce the data width of combine_channel_data to the smallest type holding all lines of a port.
+        # the type is shared by all boards: the primary board sets it and secondary boards can only increase it.
         # alternatively, we could overload this static function.
-        if self.primary is None: iPCdev.DO_type = np.uint8
+        num_lines = max([port['num_lines'] for port in ports.values()]) if ports else 8
+        DO_type = _smallest_int_type(num_lines)
+        if (self.primary is None) or (np.dtype(DO_type).itemsize > np.dtype(iPCdev.DO_type).itemsize):
+            iPCdev.DO_type = DO_type
 
         # the counters define the clocklines which we need.
         # they can be shared between devices. see add_device.
@@ -361,9 +365,6 @@ class NI_DAQmx_iPCdev(iPCdev):
         # initial double underscore:
         self.set_property('__version__', __version__, 'connection_table_properties')
 
-        if self.primary is None:
-            iPCdev.DO_type = np.uint8
-
     ###############################################################
     # derived class implementation                                #
     ###############################################################
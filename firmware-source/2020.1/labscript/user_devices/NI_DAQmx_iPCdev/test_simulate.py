@@ -0,0 +1,99 @@
+# test_simulate.py
+# test of NI_DAQmx_OutputWorker against NI_DAQmx_simulate without BLACS and without hardware
+# created 19/10/2026
+# checks rising edges of counters and reuse of tasks counted by Task.created and Task.cleared.
+# run from labscript folder with: python -m pytest user_devices/NI_DAQmx_iPCdev/test_simulate.py
+# note: make_worker fixture is defined in user_devices/conftest.py.
+
+import numpy as np
+import pytest
+
+from user_devices.NI_DAQmx_iPCdev import blacs_workers
+from user_devices.NI_DAQmx_iPCdev.blacs_workers import NI_DAQmx_OutputWorker
+from user_devices.NI_DAQmx_iPCdev.NI_DAQmx_simulate import Task
+
+# internal clock rate in Hz
+CLOCK_RATE = 100e6
+
+@pytest.fixture
+def new_worker(make_worker, monkeypatch):
+    # returns function which creates a worker with simulated tasks.
+    # init only what program_buffered_CO/AO/DO and stop_tasks need.
+    monkeypatch.setattr(blacs_workers, 'Task', Task)
+    def new_worker(name='NI_test'):
+        return make_worker(NI_DAQmx_OutputWorker,
+            device_name            = name,
+            MAX_name               = 'Dev1',
+            clock_terminal         = None,
+            clock_rate             = None,
+            internal_clock_rate    = CLOCK_RATE,
+            start_trigger_terminal = None,
+            start_trigger_edge     = None,
+            clock_mirror_terminal  = None,
+            connected_terminals    = None,
+            Vmin                   = -10.0,
+            Vmax                   = 10.0,
+            max_AO_sample_rate     = 1e6,
+            max_DO_sample_rate     = 1e6,
+            ports                  = {'port0': {'num_lines': 8}},
+            counter_AO             = 'Dev1/ctr0',
+            counter_DO             = 'Dev1/ctr1',
+            AO_task                = None,
+            DO_task                = None,
+            CO_tasks               = {},
+            CO_implicit            = set(),
+            task_keys              = {},
+            counter_ports          = {})
+    return new_worker
+
+def program_counter(new_worker, monkeypatch, times, implicit):
+    # program counter with given times in seconds and returns (task, True if programmed as pulse train)
+    monkeypatch.setattr(blacs_workers, 'COUNTER_IMPLICIT', implicit)
+    worker = new_worker()
+    worker.program_buffered_CO({'ctr0': times})
+    assert (worker.task_keys['ctr0'][1] == len(times)), worker.task_keys
+    return (worker.CO_tasks['ctr0'], 'ctr0' in worker.CO_implicit)
+
+def test_counters(new_worker, monkeypatch):
+    # same period between all rising edges: pulse train must give the same rising edges as written ticks.
+    # note: the last sample is repeated by labscript but is a normal rising edge for the counter.
+    times = np.arange(1000) * 2e-6 + 10e-6
+    buffered, is_implicit = program_counter(new_worker, monkeypatch, times, implicit=False)
+    assert (not is_implicit) and (buffered.data is not None)
+    implicit, is_implicit = program_counter(new_worker, monkeypatch, times, implicit=True)
+    assert is_implicit and (implicit.data is None)
+    assert np.array_equal(buffered.get_rising_edges(), implicit.get_rising_edges())
+    # different periods: always buffered
+    times = np.concatenate((times, times[-1] + np.arange(1, 11) * 3e-6))
+    task, is_implicit = program_counter(new_worker, monkeypatch, times, implicit=True)
+    assert (not is_implicit) and (task.data is not None)
+    ticks_low, ticks_high = blacs_workers.get_clock_ticks(times, clock_rate=CLOCK_RATE, min_time_or_ticks=blacs_workers.MIN_TICKS_100MHz)
+    assert np.array_equal(task.get_rising_edges(), np.cumsum(ticks_low.astype(np.uint64)) + np.concatenate(([0], np.cumsum(ticks_high[:-1].astype(np.uint64)))))
+
+def test_task_reuse(new_worker, monkeypatch):
+    # tasks with the same configuration are reused for the next shot, only data and number of samples are written.
+    monkeypatch.setattr(blacs_workers, 'TASK_REUSE', True)
+    worker = new_worker()
+    created, cleared = Task.created, Task.cleared
+    def shot(samples, AO=True):
+        # program one shot and return number of created and cleared tasks since start of test
+        times = np.linspace(0, 1e-3, samples)
+        worker.program_buffered_CO({'Dev1/ctr0': times, 'Dev1/ctr1': times})
+        worker.program_buffered_DO({'port0': np.arange(samples, dtype=np.uint32)})
+        worker.program_buffered_AO({'ao0': np.zeros(samples), 'ao1': np.ones(samples)} if AO else {})
+        worker.stop_tasks(clear=False)
+        return (Task.created - created, Task.cleared - cleared)
+    # first shot creates 2 counters + DO + AO task
+    assert shot(10) == (4, 0)
+    # same shot: all tasks are reused
+    assert shot(10) == (4, 0)
+    # more samples: AO and DO are reused with new number of samples.
+    # the pulse trains of the counters have a different period and are created again.
+    assert shot(20) == (6, 2)
+    assert (worker.AO_task.samples == 20) and (worker.DO_task.samples == 20)
+    # without AO the AO task is cleared, with AO again it is created.
+    assert shot(20, AO=False) == (6, 3) and (worker.AO_task is None)
+    assert shot(20) == (7, 3)
+    # stop and clear all tasks
+    worker.stop_tasks(clear=True)
+    assert (Task.created - created, Task.cleared - cleared) == (7, 7) and (len(worker.task_keys) == 0)
@@ -0,0 +1,24 @@
+# conftest.py
+# shared pytest fixtures for the tests of the user devices
+# created 19/10/2026
+# run all tests from labscript folder with: python -m pytest user_devices
+# note: run with python -m from labscript folder such that the tests can import user_devices.
+
+import pytest
+
+# scripts which match the pytest file pattern but are not tests
+collect_ignore = ['remote_test.py']
+
+@pytest.fixture
+def make_worker():
+    """
+    returns function make_worker(cls, **attrs) which creates a worker of class cls without BLACS.
+    worker __init__ is not called, only the given attributes are set.
+    give the attributes which are needed by the tested functions.
+    """
+    def make_worker(cls, **attrs):
+        worker = cls.__new__(cls)
+        for name, value in attrs.items():
+            setattr(worker, name, value)
+        return worker
+    return make_worker
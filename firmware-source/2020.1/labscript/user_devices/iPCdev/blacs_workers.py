@@ -3,6 +3,8 @@
 # last change 14/6/2024 by Andi
 
 import numpy as np
+import uuid
+from collections import OrderedDict
 import labscript_utils.h5_lock
 import h5py
 from zprocess import Event
@@ -15,15 +17,16 @@ from blacs.tab_base_classes import Worker
 import logging
 from .labscript_devices import (
     log_level,
-    DEVICE_INFO_PATH, DEVICE_TIME, DEVICE_HARDWARE_INFO, DEVICE_INFO_ADDRESS, DEVICE_INFO_TYPE, DEVICE_INFO_BOARD,
-    DEVICE_DATA_AO, DEVICE_DATA_DO, DEVICE_DATA_DDS,
+    DEVICE_INFO_PATH, DEVICE_TIME, load_times, DEVICE_HARDWARE_INFO, DEVICE_INFO_ADDRESS, DEVICE_INFO_TYPE, DEVICE_INFO_BOARD,
+    DEVICE_DATA_AO, DEVICE_DATA_DO, DEVICE_DATA_DDS, DEVICE_CRC,
     HARDWARE_TYPE, HARDWARE_SUBTYPE,
     HARDWARE_TYPE_AO, HARDWARE_TYPE_DO, HARDWARE_TYPE_DDS,
     HARDWARE_SUBTYPE_STATIC, HARDWARE_SUBTYPE_TRIGGER,
 )
 from .blacs_tabs import DDS_CHANNEL_PROP_FREQ, DDS_CHANNEL_PROP_AMP, DDS_CHANNEL_PROP_PHASE
+from .shot_timing import ShotTiming, TIMING_SHOTS, TIMING_SUMMARY, TIMING_SAVE
 
-from time import sleep
+from time import sleep, perf_counter as get_ticks
 
 # for testing
 #from user_devices.h5_file_parser import read_group
@@ -46,13 +49,12 @@ SYNC_TIMEOUT                    = 1.0
 #       so its not so easy to detect if it is working now or not.
 SYNC_RESET_EACH_RUN             = True
 
-# time margin for sync_boards with reset_event_counter=True
-# this is not used with SYNC_RESET_EACH_RUN
-SYNC_TIME_MARGIN                = 0.2
-
 # events
+# secondary boards post arrivals to the primary board and the primary board posts one reply to all secondary boards.
+# all events use the same identifier. the generation (epoch) of each barrier is given in the event data.
 EVENT_TO_PRIMARY                = '%s_to_prim'
 EVENT_FROM_PRIMARY              = '%s_from_prim'
+EVENT_ID                        = 'sync'
 EVENT_TIMEOUT                   = 'timeout!'
 EVENT_COUNT_INITIAL             = 0
 
@@ -61,6 +63,9 @@ SYNC_RESULT_OK                  = 0     # ok
 SYNC_RESULT_TIMEOUT             = 1     # connection timeout
 SYNC_RESULT_TIMEOUT_OTHER       = 2     # timeout on another board
 
+# number of parsed tables per device kept in shot-data cache. 0 = cache disabled.
+CACHE_SIZE                      = 4
+
 # scale DDS channel analog values from hd5 file to displayed values of channels
 DDS_CHANNEL_SCALING = {DDS_CHANNEL_PROP_FREQ: 1e-6, DDS_CHANNEL_PROP_AMP: 1.0, DDS_CHANNEL_PROP_PHASE: 1.0}
 
@@ -68,7 +73,14 @@ class iPCdev_worker(Worker):
 
     # synchronization options. overwrite in derived class
     sync_reset_each_run = SYNC_RESET_EACH_RUN
-    sync_time_margin    = SYNC_TIME_MARGIN
+
+    # number of cached tables. overwrite in derived class
+    cache_size          = CACHE_SIZE
+
+    # shot timing options. overwrite in derived class
+    timing_shots        = TIMING_SHOTS
+    timing_summary      = TIMING_SUMMARY
+    timing_save         = TIMING_SAVE
 
     def init(self):
         global zTimeoutError; from zprocess.utils import TimeoutError as zTimeoutError
@@ -130,31 +142,68 @@ class iPCdev_worker(Worker):
         # file id used to determine if file has changed or not
         self.file_id = None
 
+        # shot-data cache with key = checksums of datasets, value = parsed tables
+        # cache_key = key of last loaded tables. set to None to force reprogramming of device.
+        self.cache = OrderedDict()
+        self.cache_key = None
+
+        # timing of transition phases of last shots
+        self.timing = ShotTiming(self.device_name, shots=self.timing_shots)
+        self.h5file = None
+
         # experiment time in seconds and number of channels for different output types
         self.exp_time = 0
         self.num_channels = {}
 
         # prepare zprocess events for communication between primary and secondary boards
-        # primary board: boards/events = list of all secondary board names/events
-        # secondary board: boards/events = list containing only primary board name/event
+        # primary board: boards = list of all secondary board names
+        # secondary board: boards = list containing only primary board name
         self.create_events()
 
     def create_events(self):
+        # primary board: waits for arrivals of all secondary boards and posts one reply to all of them.
+        # secondary boards: post arrival to primary board and wait for reply.
+        # session = unique id of this worker process. a new session of a board means the board was restarted.
+        # event_count = generation (epoch) of next barrier.
         if self.is_primary:
-            self.events_wait = [self.process_tree.event(EVENT_TO_PRIMARY % self.device_name, role='wait')]
-            self.events_post = [self.process_tree.event(EVENT_FROM_PRIMARY % s, role='post') for s in self.boards]
+            self.event_wait = self.process_tree.event(EVENT_TO_PRIMARY % self.device_name, role='wait')
+            self.event_post = self.process_tree.event(EVENT_FROM_PRIMARY % self.device_name, role='post')
         else:
-            self.events_post = [self.process_tree.event(EVENT_TO_PRIMARY % self.boards[0], role='post')]
-            self.events_wait = [self.process_tree.event(EVENT_FROM_PRIMARY % self.device_name, role='wait')]
+            self.event_post = self.process_tree.event(EVENT_TO_PRIMARY % self.boards[0], role='post')
+            self.event_wait = self.process_tree.event(EVENT_FROM_PRIMARY % self.boards[0], role='wait')
         self.event_count = EVENT_COUNT_INITIAL
+        self.session = uuid.uuid4().hex
+        # primary board: session of each secondary board and arrivals of future generations
+        self.sessions = {}
+        self.pending = []
+        # arrival time in ms of each board of last barrier, measured by primary board
+        self.arrival = {}
+
+    def _accept(self, arrival):
+        # primary board: returns True if arrival of secondary board belongs to the actual generation.
+        # arrivals of older generations are stale and discarded, arrivals of newer generations are kept for next barrier.
+        # the first arrival of a new session (restarted board or restarted primary) is always accepted.
+        if self.sessions.get(arrival['board'], None) != arrival['session']:
+            return True
+        elif arrival['epoch'] == self.event_count:
+            return True
+        elif arrival['epoch'] > self.event_count:
+            self.pending.append(arrival)
+        return False
 
     def sync_boards(self, payload=None, timeout=SYNC_TIMEOUT, reset_event_counter=False):
-        # synchronize multiple boards
+        # synchronize multiple boards with a barrier numbered by generation (self.event_count).
         # payload = data to be distributed to all boards.
         # timeout = timeout time in seconds
-        # reset_event_counter = if True resets event counter before waiting.
-        # 1. primary board waits for events of all secondary boards and then sends event back.
-        # 2. each secondary board sends event to primary board and waits for primary event.
+        # reset_event_counter = if True secondary board takes the generation of any reply of the primary board
+        #                       which does not contain this board, also of an older generation (restarted primary).
+        #                       if False this is done only for replies of the same or newer generations (see 3.).
+        # 1. each secondary board posts (board, session, generation, payload) to primary board and waits for reply.
+        # 2. primary board waits until all secondary boards have arrived or timeout and posts one reply to all boards.
+        #    the reply contains the generation and session of each arrival, so each secondary board discards old replies,
+        #    and the next generation which all boards take. this resynchronizes boards after restart.
+        # 3. a secondary board which has missed a barrier gets a reply of a newer generation without its arrival.
+        #    it takes the next generation from this reply and posts its arrival again. this resynchronizes lagging boards.
         # primary collects dictionary {board_name:payload} for all boards and sends back to all boards.
         # this allows to share data among boards.
         # returns (status, result, duration)
@@ -163,80 +212,69 @@ class iPCdev_worker(Worker):
         #            SYNC_RESULT_TIMEOUT_OTHER if connection to any other board timeout
         # result   = if not None dictionary with key = board name, value = payload
         # duration = total time in ms the worker spent in sync_boards function
-        # timeout behaviour:
-        # since each board can be reset by user self.event_count might get out of sync with other boards.
-        # this will cause timeout on all boards - event the ones which are still synchronized!
-        # this is by purpose to ensure all boards have the same waiting times.
-        # on timeout each worker should call sync_boards again with reset_event_counter=True
-        # this allows to re-synchronize all boards and continue without restarting of blacs.
-        # notes:
-        # - in rare cases this was not working since the primary can by chance still wait for timeout,
-        #   while any secondary is already timeout and calls sync_boards again but with reset self.event_count.
-        #   in this case the primary might discard the new event since it still waits for the old event.
-        #   when it then resets it will timeout because the new event was already discarded.
-        #   to avoid this issue on reset_event_counter the secondary boards wait SYNC_TIME_MARGIN time
-        #   before sending the reset events and the primary should be reset and waiting for the new event.
-        # TODO:
-        # - test this option again: use reset_event_counter=True in each loop and set SYNC_TIME_MARGIN=0
-        #   this was essentially the first configuration I tested but due to further bugs was not working.
-        #   possibly this works now again and does not need the retry option.
+        # self.arrival = dictionary with key = board name, value = arrival time in ms after primary started waiting.
+        #                missing boards have EVENT_TIMEOUT.
         t_start = get_ticks()
-        if reset_event_counter: self.event_count = EVENT_COUNT_INITIAL
         sync_result = SYNC_RESULT_OK
         if self.is_primary:
-            # 1. primary board: first wait then send
-            if not iPCdev_worker.sync_reset_each_run and reset_event_counter:
-                # compensate the additional waiting time of secondary boards
-                timeout += iPCdev_worker.sync_time_margin
+            # 1. primary board: wait for all secondary boards with a common deadline
             result = {} if payload is None else {self.device_name:payload}
-            event = self.events_wait[0]
-            #sleep(0.1) # this triggers 100% the timeout event! when restarting both secondary boards!
-            for i in range(len(self.boards)):
-                is_timeout = False
+            arrived = {}
+            self.arrival = {self.device_name: 0.0}
+            pending, self.pending = self.pending, []
+            while len(arrived) < len(self.boards):
+                if len(pending) > 0:
+                    arrival = pending.pop(0)
+                else:
+                    remaining = timeout - (get_ticks() - t_start)
+                    try:
+                        if remaining <= 0: raise zTimeoutError()
+                        arrival = self.event_wait.wait(EVENT_ID, timeout=remaining)
+                    except zTimeoutError:
+                        sync_result = SYNC_RESULT_TIMEOUT
+                        break
+                if (arrival['board'] in self.boards) and self._accept(arrival):
+                    self.sessions[arrival['board']] = arrival['session']
+                    arrived[arrival['board']] = [arrival['session'], arrival['epoch']]
+                    result[arrival['board']] = arrival['payload']
+                    self.arrival[arrival['board']] = (get_ticks() - t_start) * 1e3
+            for board in self.boards:
+                if board not in arrived:
+                    result[board] = self.arrival[board] = EVENT_TIMEOUT
+            # 2. reply to all secondary boards, also on timeout such that waiting boards return immediately.
+            self.event_count += 1
+            self.event_post.post(EVENT_ID, data={'boards': arrived, 'next': self.event_count, 'result': result, 'arrival': self.arrival})
+        else:
+            # 1. secondary board: post arrival
+            epoch = self.event_count
+            self.event_post.post(EVENT_ID, data={'board': self.device_name, 'session': self.session, 'epoch': epoch, 'payload': payload})
+            # 2. wait for reply of actual generation. replies of older generations are discarded.
+            result = None
+            while True:
+                remaining = timeout - (get_ticks() - t_start)
                 try:
-                    _t_start = get_ticks()
-                    #self.logger.log(logging.INFO, "%s (pri) wait evt %i (#%i) ..." % (self.device_name, self.event_count, i))
-                    _result = event.wait(self.event_count, timeout=timeout/len(self.boards))
-                    if _result is not None: result.update(_result)
+                    if remaining <= 0: raise zTimeoutError()
+                    reply = self.event_wait.wait(EVENT_ID, timeout=remaining)
                 except zTimeoutError:
-                    is_timeout = True
                     sync_result = SYNC_RESULT_TIMEOUT
-                    result[self.boards[i]] = EVENT_TIMEOUT
-                #self.logger.log(logging.WARNING if is_timeout else logging.INFO, "%s (pri) wait evt %i (#%i) %.3fms: %s" % (self.device_name, self.event_count, i, (get_ticks() - _t_start) * 1e3, 'timeout!' if is_timeout else str(_result)))
-            if sync_result == SYNC_RESULT_OK:
-                for event in self.events_post:
-                    event.post(self.event_count, data=None if len(result) == 0 else result)
-            else:
-                # on timeout we have to ensure that primary board waits the same time as secondary boards,
-                # otherwise primary board resets and starts waiting too early while other boards are still waiting for first event.
-                remaining = timeout - (get_ticks() - t_start)
-                if remaining > 0:
-                    #self.logger.log(logging.INFO,"%s (pri) wait remaining %.3fms ..." % (self.device_name, remaining * 1e3))
-                    sleep(remaining)
-            # return total duration in ms
-            duration = (get_ticks() - t_start) * 1e3
-        else:
-            # 2. secondary board: first send then wait
-            if not iPCdev_worker.sync_reset_each_run and reset_event_counter:
-                # ensure primary is reset before sending the reset event id
-                sleep(iPCdev_worker.sync_time_margin)
-            self.events_post[0].post(self.event_count, data={self.device_name:payload})
-            is_timeout = False
-            try:
-                #self.logger.log(logging.INFO, "%s (sec) wait evt %i ..." % (self.device_name, self.event_count))
-                result = self.events_wait[0].wait(self.event_count, timeout=timeout)
-                if (result is not None) and (sync_result == SYNC_RESULT_OK):
+                    self.event_count = epoch + 1
+                    break
+                if reply['boards'].get(self.device_name, None) == [self.session, epoch]:
+                    result = reply['result']
+                    self.arrival = reply['arrival']
+                    self.event_count = reply['next']
                     for board, _result in result.items():
                         if isinstance(_result, str) and _result == EVENT_TIMEOUT:
                             sync_result = SYNC_RESULT_TIMEOUT_OTHER
                             break
-            except zTimeoutError:
-                is_timeout = True
-                sync_result = SYNC_RESULT_TIMEOUT
-                result = None
-            duration = (get_ticks() - t_start) * 1e3
-            #self.logger.log(logging.WARNING if is_timeout else logging.INFO, "%s (sec) wait evt %i %.3fms: %s" % (self.device_name, self.event_count, duration, 'timeout!' if is_timeout else 'ok'))
-        self.event_count += 1
+                    break
+                elif (reply['next'] > epoch) or (reset_event_counter and reply['next'] != epoch):
+                    # primary board has finished our barrier without us or a newer one, or after reset with any generation:
+                    # this board has missed a barrier or the primary was restarted. take next generation and post again.
+                    epoch = reply['next']
+                    self.event_post.post(EVENT_ID, data={'board': self.device_name, 'session': self.session, 'epoch': epoch, 'payload': payload})
+        # return total duration in ms
+        duration = (get_ticks() - t_start) * 1e3
 
         return (sync_result, result, duration)
 
@@ -244,75 +282,151 @@ class iPCdev_worker(Worker):
         print(self.device_name, 'program manual')
         return {}
 
+    def get_file_id(self, f):
+        # returns file id used to check if file has been changed
+        return f.attrs['sequence_id'] + ('_%i' % f.attrs['sequence_index']) + ('_%i' % f.attrs['run number'])
+
+    def get_cache_datasets(self, f):
+        """
+        returns list of groups and datasets in open h5 file f on which parsed tables of this device depend.
+        for groups all datasets in the group are used.
+        overwrite in derived class when tables depend on other datasets.
+        default: groups of all channels.
+        """
+        return [f[device.properties[DEVICE_HARDWARE_INFO][DEVICE_INFO_PATH]] for device in self.channels.values()]
+
+    def get_cache_key(self, f):
+        """
+        returns cache key from open h5 file f.
+        key = tuple of (name, dtype, shape, crc32) for all datasets returned by get_cache_datasets.
+        crc32 is taken from the attribute saved by save_data in generate_code. only metadata is read.
+        for datasets without this attribute the file name is used instead, i.e. such tables are parsed for each new file.
+        note: hard links to the same dataset are counted only once.
+        """
+        datasets = {}
+        for obj in self.get_cache_datasets(f):
+            if isinstance(obj, h5py.Group):
+                for dataset in obj.values():
+                    if isinstance(dataset, h5py.Dataset) and (dataset.id not in datasets):
+                        datasets[dataset.id] = dataset
+            elif obj.id not in datasets:
+                datasets[obj.id] = obj
+        key = []
+        for dataset in datasets.values():
+            key.append((dataset.name, dataset.dtype.str, dataset.shape, dataset.attrs.get(DEVICE_CRC, f.filename)))
+        return tuple(sorted(key))
+
+    def load_tables(self, f, fresh):
+        """
+        returns (tables, update) from open h5 file f using the shot-data cache.
+        tables = parsed tables returned by parse_tables. tables are shared with the cache and must not be modified.
+        update = True if tables are different from the last call and device needs to be reprogrammed.
+        fresh  = if True cache is cleared and tables are parsed again.
+        for the same file as last time nothing is read from the file.
+        for a new file the cache key is taken from the metadata of all datasets of get_cache_datasets
+        and if the tables are found in the cache parse_tables is not called.
+        """
+        file_id = self.get_file_id(f)
+        if fresh:
+            self.cache.clear()
+            self.cache_key = None
+        elif (file_id == self.file_id) and (self.cache_key in self.cache):
+            self.cache.move_to_end(self.cache_key)
+            return (self.cache[self.cache_key], False)
+        key = self.get_cache_key(f)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            tables = self.cache[key]
+        else:
+            tables = self.parse_tables(f)
+            if self.cache_size > 0:
+                self.cache[key] = tables
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        update = (key != self.cache_key)
+        self.file_id   = file_id
+        self.cache_key = key
+        return (tables, update)
+
+    def parse_tables(self, f):
+        """
+        returns parsed tables from open h5 file f. called by load_tables when tables are not in cache.
+        overwrite in derived class. the returned object is saved in the cache.
+        returns (exp_time, num_channels, final_values)
+        """
+        exp_time     = 0
+        num_channels = {}
+        final_values = {}
+        # load data tables for all output channels. shared times are loaded only once.
+        times_cache = {}
+        for connection, device in self.channels.items():
+            hardware_info    = device.properties[DEVICE_HARDWARE_INFO]
+            hardware_type    = hardware_info[DEVICE_INFO_TYPE][HARDWARE_TYPE]
+            hardware_subtype = hardware_info[DEVICE_INFO_TYPE][HARDWARE_SUBTYPE]
+            group = f[hardware_info[DEVICE_INFO_PATH]]
+            times = load_times(group, times_cache)
+            static = False
+            if hardware_type == HARDWARE_TYPE_AO:
+                devices = [(device.name, DEVICE_DATA_AO % (device.name, hardware_info[DEVICE_INFO_ADDRESS]),device.parent_port, 'AO', None)]
+                if hardware_subtype == HARDWARE_SUBTYPE_STATIC:
+                    static = True
+            elif (hardware_type == HARDWARE_TYPE_DO): # note: this includes trigger devices as well
+                devices = [(device.name, DEVICE_DATA_DO % (hardware_info[DEVICE_INFO_BOARD], hardware_info[DEVICE_INFO_ADDRESS]), device.parent_port, 'DO', None)]
+                if hardware_subtype == HARDWARE_SUBTYPE_STATIC:
+                    static = True
+            elif hardware_type == HARDWARE_TYPE_DDS:
+                if hardware_subtype == HARDWARE_SUBTYPE_STATIC:
+                    static = True
+                devices = [(channel.name, DEVICE_DATA_DDS % (device.name, hardware_info[DEVICE_INFO_ADDRESS], channel.parent_port), channel.parent_port, None, DDS_CHANNEL_SCALING[channel.parent_port]) for channel in device.child_list.values()]
+            else:
+                print("warning: device %s unknown type %s (skip)" % (device.name, hardware_type))
+                continue
+            final = {}
+            for (name, dataset, port, type, scaling) in devices:
+                data = group[dataset][()]
+                if data is None:
+                    raise LabscriptError("device %s: dataset %s not existing!" % (name, dataset))
+                elif static and ((len(times) != 2) or (len(data) != 1)):
+                    raise LabscriptError("static device %s: %i/%i times/data instead of 2/1!" % (name, len(times), len(data)))
+                elif not static and (len(times) != len(data)):
+                    raise LabscriptError("device %s: %i times but %i data!" % (name, len(times), len(data)))
+                if times[-1] > exp_time: exp_time = times[-1]
+                channel_data = self.device_class_object.extract_channel_data(hardware_info, data)
+                if scaling is not None:
+                    final[port] = channel_data[-1]*scaling
+                else:
+                    final[port] = channel_data[-1]
+                # save number of used channels per type of port.
+                if (type is not None) and (len(channel_data) > 2):
+                    changes = ((channel_data[1:].astype(int) - channel_data[:-1].astype(int)) != 0)
+                    if np.any(changes):
+                        try:
+                            num_channels[type] += 1
+                        except KeyError:
+                            num_channels[type] = 1
+
+            if len(devices) == 1: final_values[connection] = final[device.parent_port]
+            else:                 final_values[connection] = final
+
+        return (exp_time, num_channels, final_values)
+
     def transition_to_buffered(self, device_name, h5file, initial_values, fresh):
         # this is called for all iPCdev devices
         # return None on error, dictionary of final values for each channel otherwise
         print(self.device_name, 'transition to buffered')
         #print('initial values:', initial_values)
-        final_values = {}
-        update = fresh # requires supports_smart_programming=True and fresh=True when 'clear smart-programming cache' symbol clicked
+        self.timing.start()
+        self.h5file = h5file
 
+        # load tables from file or from cache. update = False when tables have not changed.
+        # fresh requires supports_smart_programming=True and fresh=True when 'clear smart-programming cache' symbol clicked
         with h5py.File(h5file,'r') as f:
-            # file id used to check if file has been changed
-            id = f.attrs['sequence_id'] + ('_%i' % f.attrs['sequence_index']) + ('_%i' % f.attrs['run number'])
-            if update or (self.file_id is None) or (self.file_id != id):
-                # new file
-                self.file_id = id
-                self.exp_time = 0
-                self.num_channels = {}
-                update = True
-
-                # load data tables for all output channels
-                for connection, device in self.channels.items():
-                    hardware_info    = device.properties[DEVICE_HARDWARE_INFO]
-                    hardware_type    = hardware_info[DEVICE_INFO_TYPE][HARDWARE_TYPE]
-                    hardware_subtype = hardware_info[DEVICE_INFO_TYPE][HARDWARE_SUBTYPE]
-                    group = f[hardware_info[DEVICE_INFO_PATH]]
-                    times = group[DEVICE_TIME][()]
-                    static = False
-                    if hardware_type == HARDWARE_TYPE_AO:
-                        devices = [(device.name, DEVICE_DATA_AO % (device.name, hardware_info[DEVICE_INFO_ADDRESS]),device.parent_port, 'AO', None)]
-                        if hardware_subtype == HARDWARE_SUBTYPE_STATIC:
-                            static = True
-                    elif (hardware_type == HARDWARE_TYPE_DO): # note: this includes trigger devices as well
-                        devices = [(device.name, DEVICE_DATA_DO % (hardware_info[DEVICE_INFO_BOARD], hardware_info[DEVICE_INFO_ADDRESS]), device.parent_port, 'DO', None)]
-                        if hardware_subtype == HARDWARE_SUBTYPE_STATIC:
-                            static = True
-                    elif hardware_type == HARDWARE_TYPE_DDS:
-                        if hardware_subtype == HARDWARE_SUBTYPE_STATIC:
-                            static = True
-                        devices = [(channel.name, DEVICE_DATA_DDS % (device.name, hardware_info[DEVICE_INFO_ADDRESS], channel.parent_port), channel.parent_port, None, DDS_CHANNEL_SCALING[channel.parent_port]) for channel in device.child_list.values()]
-                    else:
-                        print("warning: device %s unknown type %s (skip)" % (device.name, hardware_type))
-                        continue
-                    final = {}
-                    for (name, dataset, port, type, scaling) in devices:
-                        data = group[dataset][()]
-                        if data is None:
-                            raise LabscriptError("device %s: dataset %s not existing!" % (name, dataset))
-                        elif static and ((len(times) != 2) or (len(data) != 1)):
-                            raise LabscriptError("static device %s: %i/%i times/data instead of 2/1!" % (name, len(times), len(data)))
-                        elif not static and (len(times) != len(data)):
-                            raise LabscriptError("device %s: %i times but %i data!" % (name, len(times), len(data)))
-                        if times[-1] > self.exp_time: self.exp_time = times[-1]
-                        channel_data = self.device_class_object.extract_channel_data(hardware_info, data)
-                        if scaling is not None:
-                            final[port] = channel_data[-1]*scaling
-                        else:
-                            final[port] = channel_data[-1]
-                        # save number of used channels per type of port.
-                        if (type is not None) and (len(channel_data) > 2):
-                            changes = ((channel_data[1:].astype(int) - channel_data[:-1].astype(int)) != 0)
-                            if np.any(changes):
-                                try:
-                                    self.num_channels[type] += 1
-                                except KeyError:
-                                    self.num_channels[type] = 1
-
-                    if len(devices) == 1: final_values[connection] = final[device.parent_port]
-                    else:                 final_values[connection] = final
-
-                print('final values:', final_values)
+            (tables, update) = self.load_tables(f, fresh)
+        self.timing.mark('read')
+        (self.exp_time, self.num_channels, final_values) = tables
+        # final values are shared with cache
+        final_values = final_values.copy()
+        if update: print('final values:', final_values)
 
         if   self.exp_time >= 1.0: tmp = '%.3f s'  % (self.exp_time)
         elif self.exp_time > 1e-3: tmp = '%.3f ms' % (self.exp_time*1e3)
@@ -329,6 +443,7 @@ class iPCdev_worker(Worker):
             #       if a board is restarted we will get timeout but we can restart all boards and try again.
             count = 0
             payload = np.round(self.exp_time,6)
+            self.timing.mark('config')
             (timeout, board_times, duration) = self.sync_boards(payload=payload, reset_event_counter=SYNC_RESET_EACH_RUN)
             while timeout != SYNC_RESULT_OK:
                 if timeout == SYNC_RESULT_TIMEOUT:         tmp = ''
@@ -341,6 +456,7 @@ class iPCdev_worker(Worker):
                     print("\ntimeout %ssync with all boards! (%.3fms, abort)\n" % (tmp, duration))
                     return None
                 count += 1
+            self.timing.mark('wait', self.arrival)
             print('board times (%.3fms):'%duration, board_times)
 
             if True:
@@ -351,7 +467,9 @@ class iPCdev_worker(Worker):
                         self.exp_time = exp_time
 
         # manually call start_run from here
+        self.timing.mark('config')
         self.start_run()
+        self.timing.mark('start')
 
         return final_values
 
@@ -387,9 +505,26 @@ class iPCdev_worker(Worker):
             else:
                 self.board_status = {self.device_name: error}
 
+        self.timing_done(save=not abort)
+
         # return True = all ok
         return (error == 0)
 
+    def timing_done(self, save=True):
+        # finish timing of shot. call at end of transition_to_manual.
+        # prints timing of shot and each timing_summary shots the summary of the last shots.
+        # when timing_save = True and save = True the timing is saved into the shot file.
+        if not self.timing.done(): return
+        print(self.timing.text())
+        if (self.timing_summary > 0) and ((self.timing.count % self.timing_summary) == 0):
+            print(self.timing.summary_text(self.timing_summary))
+        if save and self.timing_save and (self.h5file is not None):
+            try:
+                with h5py.File(self.h5file, 'r+') as f:
+                    self.timing.save(f)
+            except Exception as e:
+                print('%s save timing failed: %s' % (self.device_name, str(e)))
+
     def abort_transition_to_buffered(self):
         print(self.device_name, 'transition to buffered abort')
         return self.transition_to_manual(abort=True)
@@ -420,11 +555,13 @@ class iPCdev_worker(Worker):
         """
         end = False
         run_time = get_ticks() - self.t_start
+        self.timing.since_run('status')
         if self.simulate:
             end = (run_time >= self.exp_time)
         else:
             # TODO: implement for your device!
             end = (run_time >= self.exp_time)
+        if end: self.timing.since_run('end')
 
         if end:
             if status_end:
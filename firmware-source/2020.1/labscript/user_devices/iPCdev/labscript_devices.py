@@ -18,6 +18,7 @@ from labscript import (
 )
 
 import numpy as np
+import zlib
 from time import perf_counter as get_ticks
 
 # reduce number of log entries in logfile (labscript-suite/logs/BLACS.log)
@@ -82,6 +83,12 @@ DEVICE_TIME             = 'time'
 DEVICE_DATA_AO          = 'data_ao_%s_%x'       # name + address
 DEVICE_DATA_DO          = 'data_do_%s_%x'       # board name + address
 DEVICE_DATA_DDS         = 'data_dds_%s_%s_%s'   # name + address + sub-channel name
+# attribute of each saved dataset with crc32 of its data. workers use it as cache key without reading the data.
+DEVICE_CRC              = 'crc32'
+
+# if True generate_code saves identical times of IM devices only once and the other IM devices get a hard link to it.
+# for the workers this is transparent but with load_times each time array is loaded only once per shot.
+DEVICE_TIME_SHARED      = True
 
 # hardware info entry in connection table property
 DEVICE_HARDWARE_INFO            = 'hardware_info'
@@ -100,6 +107,30 @@ TIME_EPSILON            = 1e-12
 # number of digits labscript.add_instructions and other functions rounds times
 ROUND_DIGITS = 10
 
+def save_data(group, name, data):
+    """
+    saves data as dataset with given name into hdf5 group and returns the dataset.
+    the crc32 of the data is saved as attribute DEVICE_CRC.
+    """
+    data = np.ascontiguousarray(data)
+    dataset = group.create_dataset(name, compression=config.compression, data=data)
+    dataset.attrs[DEVICE_CRC] = zlib.crc32(data)
+    return dataset
+
+def load_times(group, cache):
+    """
+    returns times of IM device group.
+    cache = dictionary used for one open file. when several groups link to the same time dataset,
+            times are loaded only once from file. key = h5py object id which is the same for all hard links.
+    note: returned array is shared between devices and must not be modified in place.
+    """
+    dataset = group[DEVICE_TIME]
+    try:
+        return cache[dataset.id]
+    except KeyError:
+        times = cache[dataset.id] = dataset[()]
+        return times
+
 class _iPCdev(Pseudoclock):
     def add_device(self, device):
         if isinstance(device, ClockLine):
@@ -561,18 +592,22 @@ class iPCdev(PseudoclockDevice):
     @staticmethod
     def get_trigger_times(dev, device_info):
         """
-        returns unsorted list of trigger times from dev.instructions.
+        returns unsorted np.array of trigger times from dev.instructions.
         checks that instructions contains only integer or float values.
         removes dev.default_value at time=dev.t0 which is automatically inserted by labscript.
-        note: for many instructions this is very inefficient!
+        keys and values are gathered into arrays once and types are checked in bulk,
+        only on error we loop over the instructions to find the first invalid entry.
         """
-        times = []
-        for t, instruction in dev.instructions.items():
-            if not isinstance(instruction, (int, float, np.float64, np.float32)):
-                raise LabscriptError(device_info, "instruction at time %f is of type %s but only integer or real are allowed!" % (t, type(instruction)))
-            elif t != dev.t0 or instruction != dev.default_value:
-                times.append(t)
-        return times
+        count  = len(dev.instructions)
+        times  = np.fromiter(dev.instructions.keys(), dtype=np.float64, count=count)
+        values = list(dev.instructions.values())
+        # check types once per distinct type and not for each instruction
+        if not all(issubclass(tp, (int, float, np.integer, np.floating)) for tp in set(map(type, values))):
+            for t, instruction in dev.instructions.items():
+                if not isinstance(instruction, (int, float, np.integer, np.floating)):
+                    raise LabscriptError(device_info, "instruction at time %f is of type %s but only integer or real are allowed!" % (t, type(instruction)))
+        values = np.array(values, dtype=np.float64)
+        return times[(times != dev.t0) | (values != dev.default_value)]
 
     def prepare_generate_code(self, hdf5_file):
         """
@@ -623,31 +658,74 @@ class iPCdev(PseudoclockDevice):
                                     # no instructions: check if device has sub-devices (like DDS) with instructions
                                     for sub in dev.child_devices:
                                         if hasattr(sub, 'instructions') and len(sub.instructions) != 0:
-                                            times += iPCdev.get_trigger_times(sub, device_info)
+                                            times.append(iPCdev.get_trigger_times(sub, device_info))
+                                    times = np.concatenate(times) if len(times) > 0 else []
                                 if len(times) > 0:
                                     # this gives sorted list and ignores same times
                                     times = np.unique(times)
                                     # check that time difference between instructions is > trigger_duration + trigger_delay
                                     trigger_delay    = dev.trigger_delay
                                     trigger_duration = dev.trigger_duration
-                                    # manually check times
-                                    # labscript will check negative times
+                                    # gate times are rounded like labscript does in add_instruction with python round,
+                                    # such that they are equal to the times of other instructions. np.round might differ in the last digit.
+                                    t_high = np.array([round(t, ROUND_DIGITS) for t in (times - trigger_delay).tolist()])
+                                    t_low  = np.array([round(t, ROUND_DIGITS) for t in (times - trigger_delay + trigger_duration).tolist()])
+                                    # check all pulses at once: time difference between instructions must be >= trigger_duration + trigger_delay
+                                    # and each pulse must end before the next pulse starts. labscript will check negative times.
                                     deltas = times[1:]-times[:-1]
-                                    mask = (deltas < (trigger_duration + trigger_delay - TIME_EPSILON))
+                                    mask = (deltas < (trigger_duration + trigger_delay - TIME_EPSILON)) | (t_high[1:] <= t_low[:-1])
                                     if np.any(mask):
                                         first = np.argmax(mask)
                                         raise LabscriptError("%s instructions at time %f and %f (delta %f) are closer than trigger duration + delay %f + %f = %f!" % (
                                                 device_info, times[first], times[first+1],
                                                 deltas[first], trigger_duration, trigger_delay,
                                                 trigger_duration + trigger_delay))
+                                    # the pulses are inserted below without add_instruction, so we check here what add_instruction would check:
+                                    # all pulses must end before stop time and pulse and gap durations must be >= minimum period of clockline.
+                                    stop_time  = dev.gate.pseudoclock_device.stop_time
+                                    min_period = 1.0/dev.gate.clock_limit
+                                    if t_low[-1] > stop_time + TIME_EPSILON:
+                                        raise LabscriptError("%s trigger pulse at time %f ends at %f after stop time %f!" % (device_info, t_high[-1], t_low[-1], stop_time))
+                                    if trigger_duration < min_period - TIME_EPSILON:
+                                        raise LabscriptError("%s trigger duration %e is smaller than minimum period %e of clockline '%s'!" % (device_info, trigger_duration, min_period, dev.gate.parent_clock_line.name))
+                                    gaps = t_high[1:] - t_low[:-1]
+                                    mask = gaps < (min_period - TIME_EPSILON)
+                                    if np.any(mask):
+                                        first = np.argmax(mask)
+                                        raise LabscriptError("%s trigger pulses at time %f and %f have a gap %e smaller than minimum period %e of clockline '%s'!" % (
+                                                device_info, t_high[first], t_high[first+1], gaps[first], min_period, dev.gate.parent_clock_line.name))
                                     print(device_info, "adding %i trigger times" % (len(times)))
-                                    print(dev.name, dev.gate.name)
-                                    print(times)
-                                    for t in times:
-                                        #dev.gate.go_high(t - trigger_delay) # this will give an error for negative times.
-                                        #dev.gate.go_low (t - trigger_delay + trigger_duration)
-                                        dev.enable (t - trigger_delay) # this will give an error for negative times.
-                                        dev.disable(t - trigger_delay + trigger_duration)
+                                    # first pulse is programmed with enable/disable. this gives an error for times before t0
+                                    # and since times are sorted and checked above this check is valid for all other pulses.
+                                    # from the first pulse we get the gate values used by enable/disable,
+                                    # the other pulses are inserted as one block into the gate instructions.
+                                    # labscript checks the minimum time between instructions of all channels later in generate_code.
+                                    dev.enable (float(t_high[0]))
+                                    dev.disable(float(t_low[0]))
+                                    if len(times) > 1:
+                                        gate      = dev.gate.instructions
+                                        value_on  = gate[t_high[0]]
+                                        value_off = gate[t_low[0]]
+                                        t_high    = t_high[1:]
+                                        t_low     = t_low[1:]
+                                        # gate has only first pulse and possibly default value at t0
+                                        existing  = np.fromiter(gate.keys(), dtype=np.float64, count=len(gate))
+                                        collision = np.isin(t_high, existing) | np.isin(t_low, existing)
+                                        if np.any(collision):
+                                            raise LabscriptError("%s gate has already an instruction at time %f!" % (device_info, t_high[np.argmax(collision)]))
+                                        gate.update(zip(t_high.tolist(), [value_on]*len(t_high)))
+                                        gate.update(zip(t_low.tolist(), [value_off]*len(t_low)))
+
+    def compact_data(self, IM, times):
+        """
+        TODO: overwrite in derived class when needed.
+        called from generate_code for each IM device after labscript has generated times and raw_output of all channels.
+        returns times saved for the IM device.
+        derived class can remove redundant times here and must remove the same entries from raw_output of all channels of the IM device.
+        the first and last time must be kept. times must not be modified in place since it is shared by all IM devices of the clockline.
+        default: returns times unchanged.
+        """
+        return times
 
     def generate_code(self, hdf5_file):
         """
@@ -667,15 +745,30 @@ class iPCdev(PseudoclockDevice):
 
         secondary = []
         exp_time = 0.0
+        # saved time datasets with key = (length, hash) and value = list of (times, dataset)
+        time_datasets = {}
         for pseudoclock in self.child_devices:
             for clockline in pseudoclock.child_devices: # there should be only one
                 times = pseudoclock.times[clockline]
                 #print('generate_code %s times:' % clockline.name, times)
                 if times[-1] > exp_time: exp_time = times[-1]
                 for IM in clockline.child_devices:
+                    # remove redundant times and data in derived class
+                    times = self.compact_data(IM, pseudoclock.times[clockline])
                     # create IM device sub-group and save time
                     g_IM = group.create_group(IM.name)
-                    g_IM.create_dataset(DEVICE_TIME, compression=config.compression, data=times)
+                    if DEVICE_TIME_SHARED:
+                        # save identical times only once and create hard link for the other IM devices
+                        key = (len(times), hash(np.asarray(times).tobytes()))
+                        datasets = time_datasets.setdefault(key, [])
+                        for (_times, dataset) in datasets:
+                            if np.array_equal(_times, times):
+                                g_IM[DEVICE_TIME] = dataset
+                                break
+                        else:
+                            datasets.append((times, save_data(g_IM, DEVICE_TIME, times)))
+                    else:
+                        save_data(g_IM, DEVICE_TIME, times)
                     # device path
                     path = DEVICE_DEVICES + DEVICE_SEP + self.name + DEVICE_SEP + IM.name
                     if IM.hardware_type is None:
@@ -694,7 +787,7 @@ class iPCdev(PseudoclockDevice):
                                 #        raise LabscriptError(dev.name, "time not increasing!")
                                 data = type(self).combine_channel_data(dev.hardware_info, dev.raw_output, None)
                                 dataset = DEVICE_DATA_AO % (dev.name, dev.hardware_info[DEVICE_INFO_ADDRESS])
-                                g_IM.create_dataset(dataset, compression=config.compression, data=data)
+                                save_data(g_IM, dataset, data)
                                 # save device path into device properties
                                 dev.hardware_info[DEVICE_INFO_PATH] = path
                         elif addr_type == HARDWARE_ADDRTYPE_MERGED:
@@ -740,7 +833,7 @@ class iPCdev(PseudoclockDevice):
                                             dev.hardware_info[DEVICE_INFO_PATH] = path
                                     #print(board, 'DO address', address, 'data:', data)
                                     dataset = DEVICE_DATA_DO % (board, address)
-                                    g_IM.create_dataset(dataset, compression=config.compression, data=data)
+                                    save_data(g_IM, dataset, data)
                         elif addr_type == HARDWARE_ADDRTYPE_MULTIPLE:
                             # save data for sub-channels like for DDS:
                             for dev in IM.child_devices:
@@ -749,7 +842,7 @@ class iPCdev(PseudoclockDevice):
                                     # print('DDS', subdev.name, dev.hardware_info, subdev.raw_output)
                                     data = type(self).combine_channel_data(dev.hardware_info, subdev.raw_output, None)
                                     dataset = DEVICE_DATA_DDS % (dev.name, str(dev.hardware_info[DEVICE_INFO_ADDRESS]), subdev.connection)
-                                    g_IM.create_dataset(dataset, compression=config.compression, data=data)
+                                    save_data(g_IM, dataset, data)
                                 # save device path into device properties
                                 dev.hardware_info[DEVICE_INFO_PATH] = path
                         else:
@@ -13,7 +13,7 @@ from user_devices.iPCdev.labscript_devices import (
     iPCdev,
     DEVICE_DEVICES, DEVICE_SEP,
     DEVICE_HARDWARE_INFO, DEVICE_INFO_PATH, DEVICE_INFO_ADDRESS, DEVICE_INFO_BOARD, DEVICE_INFO_CHANNEL, DEVICE_INFO_TYPE,
-    DEVICE_TIME, DEVICE_DATA_AO, DEVICE_DATA_DO, DEVICE_DATA_DDS,
+    DEVICE_TIME, load_times, DEVICE_DATA_AO, DEVICE_DATA_DO, DEVICE_DATA_DDS,
     HARDWARE_TYPE, HARDWARE_SUBTYPE, HARDWARE_ADDRTYPE,
     HARDWARE_TYPE_AO, HARDWARE_TYPE_DO, HARDWARE_TYPE_DDS,
     HARDWARE_SUBTYPE_STATIC, HARDWARE_SUBTYPE_TRIGGER
@@ -58,14 +58,15 @@ class iPCdev_parser(object):
         clocklines = []
 
         with h5py.File(self.path, 'r') as f:
-            # load data tables for analog and digital outputs
+            # load data tables for analog and digital outputs. shared times are loaded only once.
+            times_cache = {}
             for device in self.channels:
                 hardware_info = device.properties[DEVICE_HARDWARE_INFO]
                 hardware_type = hardware_info[DEVICE_INFO_TYPE]
                 board         = hardware_info[DEVICE_INFO_BOARD] # this is the physical board where the channel belongs.
                 address       = hardware_info[DEVICE_INFO_ADDRESS]
                 group = f[hardware_info[DEVICE_INFO_PATH]]
-                times = group[DEVICE_TIME][()]
+                times = load_times(group, times_cache)
                 parent = device.parent
                 if parent.name not in clocklines:
                     # manually insert clockline IM device when not already done. name must be true device name.
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# shot_timing.py
+# timing of transition phases of the last shots of a worker.
+# shared by iPCdev and derived workers and by FPGA_device. keep only this copy.
+# no dependency on labscript or BLACS such that it can be imported by any worker.
+
+import numpy as np
+from collections import OrderedDict
+from time import perf_counter as get_ticks
+
+# shot timing telemetry
+# each worker records per shot the time in ms of the transition phases in TIMING_PHASES:
+# read = read hdf5 file, config = configure device, upload = upload data, wait = wait for other boards, start = start run,
+# status = time after start until first status monitor, end = time after start until end detected (primary board only).
+# phases which are not measured by a device are nan.
+TIMING_PHASES                   = ['read', 'config', 'upload', 'wait', 'start', 'status', 'end']
+TIMING_RUN                      = 'start'       # end of this phase is start of run for 'status' and 'end'
+TIMING_SHOTS                    = 100           # number of shots kept in ring buffer
+TIMING_SUMMARY                  = 50            # print median and 95% percentile each number of shots. 0 = never.
+TIMING_SAVE                     = False         # if True save timing of each shot into shot file
+TIMING_GROUP                    = 'data/timing' # group in shot file. dataset name = device name.
+
+class ShotTiming(object):
+    """
+    time in ms of transition phases of the last shots in a ring buffer.
+    start() starts a new shot and done() finishes it.
+    mark(phase) adds the time since the last mark to phase.
+    boards = optional dictionary of arrival times in ms of each board given by sync_boards which are added per board.
+    after mark(TIMING_RUN) since_run(phase) saves the time since start of run once per shot.
+    summary(last) returns median and 95% percentile of each phase over the last shots.
+    """
+    def __init__(self, name, shots=TIMING_SHOTS, phases=TIMING_PHASES):
+        self.name   = name
+        self.phases = list(phases)
+        self.index  = {phase:i for i, phase in enumerate(self.phases)}
+        self.times  = np.full((max(shots, 1), len(self.phases)), np.nan)
+        self.boards = [{} for _ in range(len(self.times))]
+        self.count  = 0     # number of finished shots
+        self.row    = None  # index of actual shot or None when no shot is running
+        self.t_last = None
+        self.t_run  = None
+
+    def start(self):
+        self.row = self.count % len(self.times)
+        self.times[self.row] = np.nan
+        self.boards[self.row] = {}
+        self.t_last = get_ticks()
+        self.t_run  = None
+
+    def mark(self, phase, boards=None):
+        if self.row is None: return
+        t = get_ticks()
+        i = self.index[phase]
+        dt = (t - self.t_last) * 1e3
+        self.times[self.row, i] = dt if np.isnan(self.times[self.row, i]) else self.times[self.row, i] + dt
+        self.t_last = t
+        if phase == TIMING_RUN: self.t_run = t
+        if boards is not None:
+            arrival = self.boards[self.row]
+            for board, ms in boards.items():
+                # boards with timeout have a string (EVENT_TIMEOUT) instead of time. primary board is the reference.
+                if (board != self.name) and not isinstance(ms, str): arrival[board] = arrival.get(board, 0.0) + ms
+
+    def since_run(self, phase):
+        if (self.row is None) or (self.t_run is None): return
+        i = self.index[phase]
+        if np.isnan(self.times[self.row, i]):
+            self.times[self.row, i] = (get_ticks() - self.t_run) * 1e3
+
+    def done(self):
+        # finish shot. returns False if no shot was running.
+        if self.row is None: return False
+        self.row = None
+        self.count += 1
+        return True
+
+    def last(self):
+        # returns index of last finished shot or None
+        return None if self.count == 0 else (self.count - 1) % len(self.times)
+
+    def text(self):
+        # returns timing of last finished shot as text
+        i = self.last()
+        if i is None: return '%s timing: no shot' % self.name
+        tmp = ['%s %.1f' % (phase, t) for phase, t in zip(self.phases, self.times[i]) if not np.isnan(t)]
+        if len(self.boards[i]) > 0:
+            board = max(self.boards[i], key=self.boards[i].get)
+            tmp += ['last board %s %.1f' % (board, self.boards[i][board])]
+        return '%s timing shot %i (ms): %s' % (self.name, self.count, ', '.join(tmp))
+
+    def summary(self, last=None):
+        # returns ordered dictionary with key = phase, value = (median, 95% percentile, number of shots)
+        # over the last finished shots. last = None for all shots in ring buffer.
+        # for arrival times of boards the key is 'arrival ' + board name.
+        n = min(self.count, len(self.times))
+        if last is not None: n = min(n, last)
+        result = OrderedDict()
+        if n == 0: return result
+        rows = (self.count - 1 - np.arange(n)) % len(self.times)
+        columns = [(phase, self.times[rows, i]) for i, phase in enumerate(self.phases)]
+        boards = OrderedDict()
+        for row in rows:
+            for board, ms in self.boards[row].items():
+                boards.setdefault(board, []).append(ms)
+        columns += [('arrival ' + board, np.array(ms)) for board, ms in boards.items()]
+        for name, data in columns:
+            data = data[~np.isnan(data)]
+            if len(data) > 0: result[name] = (np.percentile(data, 50), np.percentile(data, 95), len(data))
+        return result
+
+    def summary_text(self, last=None):
+        result = self.summary(last)
+        lines = ['%s timing summary of %i shots (ms):' % (self.name, max([n for _, _, n in result.values()] + [0]))]
+        lines += ['%-20s p50 %9.3f p95 %9.3f (%i)' % (name, p50, p95, n) for name, (p50, p95, n) in result.items()]
+        return '\n'.join(lines)
+
+    def save(self, f, group=TIMING_GROUP):
+        # save timing of last finished shot into open h5 file f. arrival times of boards are saved as attributes.
+        i = self.last()
+        if i is None: return
+        g = f.require_group(group)
+        if self.name in g: del g[self.name]
+        dataset = g.create_dataset(self.name, data=self.times[i])
+        dataset.attrs['phases'] = ','.join(self.phases)
+        for board, ms in self.boards[i].items():
+            dataset.attrs['arrival ' + board] = ms
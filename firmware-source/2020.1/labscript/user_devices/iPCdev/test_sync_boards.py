@@ -0,0 +1,95 @@
+# test_sync_boards.py
+# test of iPCdev_worker.sync_boards without BLACS
+# created 19/10/2026
+# primary and secondary workers run in threads of this process and
+# zprocess events are replaced by queues with the same post/wait interface.
+# run from labscript folder with: python -m pytest user_devices/iPCdev/test_sync_boards.py
+# note: make_worker fixture is defined in user_devices/conftest.py.
+
+import threading, queue
+from time import perf_counter as get_ticks
+import pytest
+
+from user_devices.iPCdev import blacs_workers
+from user_devices.iPCdev.blacs_workers import iPCdev_worker, SYNC_RESULT_OK, SYNC_RESULT_TIMEOUT
+
+# timeout in seconds for each barrier
+TIMEOUT = 0.5
+
+class Timeout(Exception):
+    pass
+
+class Event(object):
+    # replaces zprocess event. each waiting event gets all posted data.
+    subscribers = {}
+    lock = threading.Lock()
+    def __init__(self, name, role):
+        self.name = name
+        if role == 'wait':
+            self.queue = queue.Queue()
+            with Event.lock:
+                Event.subscribers.setdefault(name, []).append(self.queue)
+    def post(self, identifier, data=None):
+        with Event.lock:
+            queues = list(Event.subscribers.get(self.name, []))
+        for q in queues:
+            q.put((identifier, data))
+    def wait(self, identifier, timeout=None):
+        end = get_ticks() + timeout
+        while True:
+            try:
+                _identifier, data = self.queue.get(timeout=max(end - get_ticks(), 0))
+            except queue.Empty:
+                raise Timeout()
+            if _identifier == identifier: return data
+
+class ProcessTree(object):
+    def event(self, name, role):
+        return Event(name, role)
+
+@pytest.fixture
+def new_worker(make_worker, monkeypatch):
+    # returns function which creates a worker with queue events. init only what sync_boards needs.
+    # zTimeoutError is defined in worker init which is not called
+    monkeypatch.setattr(blacs_workers, 'zTimeoutError', Timeout, raising=False)
+    monkeypatch.setattr(Event, 'subscribers', {})
+    def new_worker(name, is_primary, boards):
+        worker = make_worker(iPCdev_worker, device_name=name, is_primary=is_primary, boards=boards, process_tree=ProcessTree())
+        worker.create_events()
+        return worker
+    return new_worker
+
+def barrier(workers, skip=[]):
+    # call sync_boards on all workers except skip in parallel threads.
+    # returns dictionary with key = board name, value = sync result
+    result = {}
+    def run(worker):
+        result[worker.device_name] = worker.sync_boards(payload=worker.device_name, timeout=TIMEOUT)[0]
+    threads = [threading.Thread(target=run, args=(w,)) for w in workers if w.device_name not in skip]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    return result
+
+def test_sync_boards(new_worker):
+    primary = new_worker('P', True, ['A', 'B'])
+    workers = [primary, new_worker('A', False, ['P']), new_worker('B', False, ['P'])]
+    for i in range(3):
+        result = barrier(workers)
+        assert all(r == SYNC_RESULT_OK for r in result.values()), result
+    # B misses one barrier: primary and A get timeout
+    result = barrier(workers, skip=['B'])
+    assert result['P'] == SYNC_RESULT_TIMEOUT, result
+    print('B missed barrier: event counts', [w.event_count for w in workers])
+    # B resynchronizes with the reply of the missed barrier
+    for i in range(3):
+        result = barrier(workers)
+        assert all(r == SYNC_RESULT_OK for r in result.values()), result
+    counts = [w.event_count for w in workers]
+    assert len(set(counts)) == 1, counts
+    # B is restarted: primary accepts new session
+    workers[2] = new_worker('B', False, ['P'])
+    result = barrier(workers)
+    assert all(r == SYNC_RESULT_OK for r in result.values()), result
+    counts = [w.event_count for w in workers]
+    assert len(set(counts)) == 1, counts
+    print('sync_boards event counts', counts)